@@ -0,0 +1,34 @@
+"""
+EventHandler() construction rate: abstract attributes scanned per instance (the old ABCMeta) vs. cached per class.
+
+Run with: ENV=TEST python -m benchmarks.bench_abc_construction [N]
+"""
+from abc import ABCMeta as NativeABCMeta
+import sys
+import timeit
+
+from llama.event_handler import EventHandler
+
+
+def dir_scanning_construct(cls: type):
+    # the pre-cache ABCMeta.__call__, kept here as the baseline
+    instance = NativeABCMeta.__call__(cls)
+    abstract_attributes = {
+        name
+        for name in dir(instance)
+        if getattr(getattr(instance, name, None), "__is_abstract_attribute__", False)
+    }
+    if abstract_attributes:
+        raise NotImplementedError(abstract_attributes)
+    return instance
+
+
+def main(n: int = 50_000):
+    old = timeit.timeit(lambda: dir_scanning_construct(EventHandler), number=n)
+    new = timeit.timeit(EventHandler, number=n)
+    print(f"{'dir() per instance':>20}: {n / old / 1e3:>8.1f}k/s")
+    print(f"{'cached per class':>20}: {n / new / 1e3:>8.1f}k/s ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,37 @@
+"""
+LlamaMixin.as_dict(): compiled per-class field schema vs. the old dir() walk.
+
+Run with: ENV=TEST python -m benchmarks.bench_as_dict
+"""
+import timeit
+
+from llama.base import LlamaMixin
+
+
+def dir_as_dict(llama: LlamaMixin) -> dict:
+    # the pre-schema implementation, kept here as the baseline
+    return {
+        k: getattr(llama, k)
+        for k in set(dir(llama)) - set(LlamaMixin.json_excludes)
+        if not (k.startswith("_") or callable(getattr(llama, k)))
+    }
+
+
+def make_llama(num_attrs: int) -> LlamaMixin:
+    cls = type(f"Wide{num_attrs}", (LlamaMixin,), {})
+    return cls(**{f"field_{i}": i for i in range(num_attrs - 1)})
+
+
+def main(number: int = 2000):
+    print(f"{'attrs':>6} {'dir() us':>10} {'schema us':>10} {'speedup':>8}")
+    for num_attrs in (10, 50, 200):
+        llama = make_llama(num_attrs)
+        assert llama.as_dict() == dir_as_dict(llama)
+
+        old = timeit.timeit(lambda: dir_as_dict(llama), number=number) / number
+        new = timeit.timeit(llama.as_dict, number=number) / number
+        print(f"{num_attrs:>6} {old * 1e6:>10.2f} {new * 1e6:>10.2f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Event loop latency under heavy insert load: the blocking ORM called from coroutines vs. AsyncORM.
+
+A probe task asks to wake up every millisecond and records how late it actually woke. Meanwhile
+producer tasks insert small groups of llamas as fast as they can.
+Run with: ENV=TEST python -m benchmarks.bench_async_orm [SECONDS] [PRODUCERS]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from llama.async_orm import AsyncORM
+from llama.event_handler import EventHandler
+from llama.orm import ORM
+
+
+TICK = 0.001
+GROUP = 50
+
+
+async def probe(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def run(label: str, insert, seconds: float, producers: int):
+    stop = asyncio.Event()
+    lags = []
+    written = 0
+
+    async def produce():
+        nonlocal written
+        while not stop.is_set():
+            await insert(*(EventHandler(num=i) for i in range(GROUP)))
+            written += GROUP
+            await asyncio.sleep(0)
+
+    tasks = [asyncio.create_task(probe(stop, lags))] + [asyncio.create_task(produce()) for _ in range(producers)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    lags.sort()
+    ms = [1_000 * lags[int(q * (len(lags) - 1))] for q in (0.5, 0.99)]
+    print(
+        f"{label:>10}: {written / seconds:>9.0f} rows/s  loop lag p50 {ms[0]:>7.2f}ms  p99 {ms[1]:>7.2f}ms  "
+        f"max {1_000 * lags[-1]:>7.2f}ms  mean {1_000 * statistics.mean(lags):>6.2f}ms"
+    )
+
+
+async def main(seconds: float = 5, producers: int = 8):
+    with tempfile.TemporaryDirectory() as directory:
+        ori = ORM(db_uri=f"sqlite+pysqlite:///{os.path.join(directory, 'sync.sqlite')}", echo=False)
+        ori.add_table(EventHandler)
+        ori.bootstrap_db()
+
+        async def sync_insert(*objs):
+            ori.insert(EventHandler, *objs)
+
+        await run("ORM", sync_insert, seconds, producers)
+        ori.dispose()
+
+        aori = AsyncORM(db_uri=f"sqlite:///{os.path.join(directory, 'async.sqlite')}", echo=False)
+        aori.add_table(EventHandler)
+        await aori.bootstrap_db()
+
+        async def async_insert(*objs):
+            await aori.insert(EventHandler, *objs)
+
+        await run("AsyncORM", async_insert, seconds, producers)
+        print(f"{'':>10}  {aori.metrics()}")
+        await aori.dispose()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(float(args[0]) if args else 5, int(args[1]) if len(args) > 1 else 8))
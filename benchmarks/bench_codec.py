@@ -0,0 +1,61 @@
+"""
+Event codec throughput per installed backend, plus the legacy json.dumps(..., default=str) path.
+
+Run with: ENV=TEST python -m benchmarks.bench_codec [N]
+"""
+import datetime
+import json
+import sys
+import time
+import uuid
+
+from llama.codec import available_codecs
+
+
+def make_events(n: int) -> list:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            "table_id": uuid.uuid4(),
+            "created_at": now,
+            "symbol": "IBM",
+            "side": "buy",
+            "qty": i,
+            "price": 128.7324 + i,
+            "venue": "IEX",
+            "conditions": ["@", "F"],
+        }
+        for i in range(n)
+    ]
+
+
+def rate(n: int, seconds: float) -> str:
+    return f"{n / seconds / 1e3:>9.1f}k/s"
+
+
+def main(n: int = 100_000):
+    events = make_events(n)
+    print(f"{'codec':>10} {'encode':>12} {'decode':>12} {'bytes/event':>12}")
+
+    start = time.perf_counter()
+    legacy = [json.dumps(d, sort_keys=True, default=str) for d in events]
+    encode = time.perf_counter() - start
+    start = time.perf_counter()
+    for j in legacy:
+        json.loads(j)
+    decode = time.perf_counter() - start
+    print(f"{'legacy':>10} {rate(n, encode):>12} {rate(n, decode):>12} {sum(map(len, legacy)) / n:>12.1f}")
+
+    for name, codec in available_codecs().items():
+        start = time.perf_counter()
+        encoded = [codec.dumps(d) for d in events]
+        encode = time.perf_counter() - start
+        start = time.perf_counter()
+        for data in encoded:
+            codec.loads(data)
+        decode = time.perf_counter() - start
+        print(f"{name:>10} {rate(n, encode):>12} {rate(n, decode):>12} {sum(map(len, encoded)) / n:>12.1f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,85 @@
+"""
+Stored event size and insert/retrieve throughput: the plain JSON event column vs. compressed event payloads,
+with and without a trained dictionary.
+
+Run with: ENV=TEST python -m benchmarks.bench_compression [N]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from llama import codec
+from llama.codec import CompressedCodec
+from llama.event_handler import EventHandler
+from llama.orm import ORM
+
+
+SYMBOLS = ["IBM", "AAPL", "MSFT", "GOOG", "AMZN", "TSLA", "NVDA", "SPY"]
+
+
+def make_events(n: int):
+    return [
+        EventHandler(
+            symbol=random.choice(SYMBOLS),
+            side=random.choice(["buy", "sell"]),
+            qty=random.randint(1, 1_000),
+            price=round(random.uniform(10, 500), 2),
+            order_type="limit",
+            time_in_force="day",
+        )
+        for _ in range(n)
+    ]
+
+
+def run(label: str, path: str, make_codec, train: bool, events: list):
+    ori = ORM(db_uri=f"sqlite+pysqlite:///{path}", echo=False)
+    ori.add_table(EventHandler, codec=make_codec() if make_codec else None)
+    ori.bootstrap_db()
+
+    if train:
+        ori.insert(EventHandler, *make_events(1_000))
+        ori.train_dictionary(EventHandler)
+        with ori.engine.begin() as conn:
+            conn.execute(text("DELETE FROM events"))
+
+    start = time.perf_counter()
+    for i in range(0, len(events), 1_000):
+        ori.insert(EventHandler, *events[i : i + 1_000])
+    insert_seconds = time.perf_counter() - start
+
+    ids = [e.table_id for e in events]
+    start = time.perf_counter()
+    ori.retrieve(EventHandler, *ids)
+    retrieve_seconds = time.perf_counter() - start
+
+    with ori.engine.connect() as conn:
+        payload = conn.execute(text("SELECT sum(length(event)) FROM events")).scalar()
+    ori.dispose()
+
+    n = len(events)
+    print(
+        f"{label:>14}: {payload / n:>7.1f} bytes/event {n / insert_seconds:>10.0f} inserts/s "
+        f"{n / retrieve_seconds:>10.0f} retrieves/s"
+    )
+
+
+def main(n: int = 20_000):
+    events = make_events(n)
+    variants = [("json column", None, False)]
+    algorithms = [codec.COMPRESSION_ZLIB] + ([codec.COMPRESSION_ZSTD] if codec.zstandard is not None else [])
+    for algorithm in algorithms:
+        variants.append((algorithm, lambda a=algorithm: CompressedCodec(a), False))
+        variants.append((f"{algorithm}+dict", lambda a=algorithm: CompressedCodec(a), True))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i, (label, make_codec, train) in enumerate(variants):
+            run(label, os.path.join(directory, f"{i}.sqlite"), make_codec, train, events)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 20_000)
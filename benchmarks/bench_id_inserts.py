@@ -0,0 +1,72 @@
+"""
+Insert throughput into a file-backed SQLite table as it grows, by id scheme:
+random uuid4 strings (the default), uuid7 strings, and uuid7 16-byte BLOBs.
+
+Run with: ENV=TEST python -m benchmarks.bench_id_inserts [ROWS ...]   (defaults to 1M 10M 50M)
+Rates are reported per million rows so the slow-down as the table grows is visible.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import insert
+
+from llama import ids
+from llama.event_handler import EventHandler
+import llama.orm as orm
+from llama.orm import ORM
+
+
+CHUNK = 10_000
+REPORT_EVERY = 1_000_000
+EVENT = '{"num": 42}'
+
+SCHEMES = {
+    "uuid4 str": (False, lambda n: [uuid.uuid4() for _ in range(n)]),
+    "uuid7 str": (False, ids.uuid7.allocate),
+    "uuid7 blob": (True, ids.uuid7.allocate),
+}
+
+
+def run(scheme: str, rows: int, directory: str):
+    binary_ids, make_ids = SCHEMES[scheme]
+    path = os.path.join(directory, f"{scheme.replace(' ', '_')}_{rows}.sqlite")
+    eng = orm.engine(db_uri=f"sqlite+pysqlite:///{path}", echo=False)
+    ori = ORM(eng=eng, binary_ids=binary_ids)
+    table = ori.add_table(EventHandler)
+    ori.bootstrap_db()
+
+    done = 0
+    window_start = time.perf_counter()
+    total_start = window_start
+    while done < rows:
+        n = min(CHUNK, rows - done)
+        values = [{"id": ori.id_value(u), "event": EVENT} for u in make_ids(n)]
+        with eng.begin() as conn:
+            conn.execute(insert(table), values)
+        done += n
+        if done % REPORT_EVERY == 0 or done == rows:
+            now = time.perf_counter()
+            window = done % REPORT_EVERY or REPORT_EVERY
+            print(f"{scheme:>11} {rows:>10} rows: at {done:>10} {window / (now - window_start) / 1e3:>8.1f}k rows/s")
+            window_start = now
+
+    elapsed = time.perf_counter() - total_start
+    size = os.path.getsize(path)
+    print(f"{scheme:>11} {rows:>10} rows: overall {rows / elapsed / 1e3:.1f}k rows/s, {size / rows:.1f} bytes/row")
+    eng.dispose()
+    os.remove(path)
+
+
+def main(*sizes: int):
+    sizes = sizes or (1_000_000, 10_000_000, 50_000_000)
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            for scheme in SCHEMES:
+                run(scheme, rows, directory)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
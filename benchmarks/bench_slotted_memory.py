@@ -0,0 +1,47 @@
+"""
+Memory held by N live llamas: dict-backed LlamaBase vs. @slotted CompactLlamaBase.
+
+Run with: ENV=TEST python -m benchmarks.bench_slotted_memory [N]   (N defaults to 1M)
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from llama.base import CompactLlamaBase, LlamaBase, slotted
+
+
+class DictQuote(LlamaBase):
+    @classmethod
+    def has_timestamp(cls) -> bool:
+        return True
+
+
+@slotted("symbol", "bid", "ask")
+class SlottedQuote(CompactLlamaBase):
+    @classmethod
+    def has_timestamp(cls) -> bool:
+        return True
+
+
+def measure(cls: type, n: int):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    llamas = [cls(symbol="IBM", bid=128.71, ask=128.73) for _ in range(n)]
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del llamas
+    return current, elapsed
+
+
+def main(n: int = 1_000_000):
+    print(f"{'layout':>14} {'N':>10} {'MiB':>9} {'bytes/obj':>10} {'build s':>8}")
+    for cls in (DictQuote, SlottedQuote):
+        current, elapsed = measure(cls, n)
+        print(f"{cls.__name__:>14} {n:>10} {current / 2**20:>9.1f} {current / n:>10.1f} {elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
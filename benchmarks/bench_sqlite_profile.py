@@ -0,0 +1,81 @@
+"""
+Concurrent reads and writes on a file-backed database: default settings vs. SQLiteProfile.
+
+One writer thread inserts (and commits) small groups of llamas while reader threads retrieve random ids.
+Run with: ENV=TEST python -m benchmarks.bench_sqlite_profile [SECONDS] [READERS]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from llama.event_handler import EventHandler
+from llama.orm import ORM, SQLiteProfile
+
+
+PREFILL = 20_000
+
+
+def run(label: str, path: str, profile: SQLiteProfile, seconds: float, readers: int):
+    ori = ORM(db_uri=f"sqlite+pysqlite:///{path}", echo=False, profile=profile)
+    ori.add_table(EventHandler)
+    ori.bootstrap_db()
+
+    ids = []
+    for chunk in range(0, PREFILL, 1_000):
+        events = [EventHandler(num=i) for i in range(chunk, chunk + 1_000)]
+        ori.insert(EventHandler, *events)
+        ids.extend(e.table_id for e in events)
+
+    stop = threading.Event()
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def bump(key: str, n: int = 1):
+        with lock:
+            counts[key] += n
+
+    def write():
+        while not stop.is_set():
+            try:
+                ori.insert(EventHandler, *(EventHandler(num=-1) for _ in range(10)))
+                bump("writes", 10)
+            except OperationalError:
+                bump("errors")
+
+    def read():
+        while not stop.is_set():
+            try:
+                ori.retrieve(EventHandler, *random.sample(ids, 20))
+                bump("reads", 20)
+            except OperationalError:
+                bump("errors")
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    ori.dispose()
+
+    print(
+        f"{label:>10}: {counts['writes'] / seconds:>9.0f} rows written/s "
+        f"{counts['reads'] / seconds:>9.0f} rows read/s {counts['errors']:>6} lock errors"
+    )
+
+
+def main(seconds: float = 10, readers: int = 4):
+    with tempfile.TemporaryDirectory() as directory:
+        run("default", os.path.join(directory, "default.sqlite"), None, seconds, readers)
+        run("profiled", os.path.join(directory, "profiled.sqlite"), SQLiteProfile(readers=readers), seconds, readers)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(float(args[0]) if args else 10, int(args[1]) if len(args) > 1 else 4)
@@ -16,14 +16,28 @@ def abstract_attribute(obj=None):
 class ABCMeta(NativeABCMeta):
     """
     copied from: https://stackoverflow.com/questions/23831510/abstract-attribute-not-property/23833055
+
+    Except that the class is only scanned once, on first instantiation. After that, an instance only has
+    its class's abstract attribute names looked up (none at all for the usual concrete class).
     """
 
+    def _abstract_attribute_names(cls) -> frozenset:
+        names = cls.__dict__.get("__abstract_attribute_names__")
+        if names is None:
+            names = frozenset(
+                name
+                for name in dir(cls)
+                if getattr(getattr(cls, name, None), "__is_abstract_attribute__", False)
+            )
+            type.__setattr__(cls, "__abstract_attribute_names__", names)
+        return names
+
     def __call__(cls, *args, **kwargs):
         instance = NativeABCMeta.__call__(cls, *args, **kwargs)
         abstract_attributes = {
             name
-            for name in dir(instance)
-            if getattr(getattr(instance, name), "__is_abstract_attribute__", False)
+            for name in cls._abstract_attribute_names()
+            if getattr(getattr(instance, name, None), "__is_abstract_attribute__", False)
         }
         if abstract_attributes:
             raise NotImplementedError(
@@ -34,6 +48,8 @@ class ABCMeta(NativeABCMeta):
 
 
 class LlamaABC(metaclass=ABCMeta):
+    __slots__ = ()
+
     @abstractclassmethod
     def from_event_json(cls, j: str, debug: bool = False):
         pass
@@ -0,0 +1,271 @@
+"""
+An asyncio flavour of ORM, on SQLAlchemy's async engine and the aiosqlite driver.
+
+Table definitions, transforms and hydration are the ORM's own (an AsyncORM wraps one), so both see the
+same storage modes, codecs and partitions. What changes is the I/O:
+* reads (retrieve) each get their own connection, so concurrent ones don't wait on each other
+* writes from concurrent insert() calls are group-committed by a single writer task: whatever has queued
+  up while the previous transaction was committing goes into the next one
+"""
+import asyncio
+import itertools
+import os
+from typing import Dict, List, Optional, Sequence, Tuple, Type, Union
+from uuid import UUID
+
+from sqlalchemy import event, select as sqla_select
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from llama.abstract_base import LlamaABC
+from llama.batch import LlamaBatch
+from llama.codec import Codec, CompressedCodec
+from llama.orm import ON_CONFLICT_FAIL, InsertReport, ORM, SQLiteProfile
+
+
+def async_engine(db_uri: str = None, echo: bool = None, profile: SQLiteProfile = None) -> AsyncEngine:
+    """
+    A plain sqlite:// URI gets the aiosqlite driver. echo defaults as for orm.engine()
+    """
+    if db_uri is None:
+        db_uri = os.environ.get("DB_URI")
+    if echo is None:
+        echo = profile is None
+    if db_uri.startswith("sqlite://"):
+        db_uri = "sqlite+aiosqlite://" + db_uri[len("sqlite://") :]
+
+    eng = create_async_engine(db_uri, echo=echo)
+
+    if profile is not None:
+        assert ":memory:" not in db_uri, "SQLiteProfile needs a file-backed database"
+
+        @event.listens_for(eng.sync_engine, "connect")
+        def apply_profile(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in profile.pragmas():
+                cursor.execute(pragma)
+            cursor.close()
+
+    return eng
+
+
+class AsyncORM:
+    def __init__(
+        self,
+        eng: AsyncEngine = None,
+        db_uri: str = None,
+        echo: bool = None,
+        codec: Codec = None,
+        binary_ids: bool = False,
+        profile: SQLiteProfile = None,
+        cache_size: int = 0,
+        dedup_size: int = 0,
+        max_batch: int = 10_000,
+    ):
+        """
+        max_batch - the most rows the writer task puts in one transaction
+        The other arguments are as for ORM. NB: an in-memory database is a single shared connection,
+        so reads only run concurrently against a file-backed one.
+        """
+        assert not (eng and db_uri), "If you specify the engine, please don't give a DB URI"
+        assert not (eng and profile), "If you specify the engine, please configure it yourself"
+        assert max_batch > 0, "max_batch must be positive"
+
+        self.engine = async_engine(db_uri=db_uri, echo=echo, profile=profile) if eng is None else eng
+        self.orm = ORM(
+            eng=self.engine.sync_engine,
+            codec=codec,
+            binary_ids=binary_ids,
+            cache_size=cache_size,
+            dedup_size=dedup_size,
+        )
+        self.max_batch = max_batch
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+        self.commits = 0
+        self.committed = 0
+
+    @property
+    def tables(self):
+        return self.orm.tables
+
+    def add_table(self, model: Type, *columns, **kwargs):
+        """
+        As ORM.add_table() - no I/O, so not a coroutine
+        """
+        table = self.orm.add_table(model, *columns, **kwargs)
+        codec = self.orm.codecs[model]
+        if isinstance(codec, CompressedCodec):
+            # its loader would query through the sync engine, which can't run on the event loop:
+            # retrieve() fetches the dictionaries it meets up front instead
+            codec.dictionary_loader = None
+        return table
+
+    async def bootstrap_db(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(self.orm.create_tables)
+
+    async def dispose(self):
+        """
+        Commit whatever is queued, stop the writer task and close the engine's connections
+        """
+        if self._writer is not None:
+            await self._queue.put(None)
+            await self._writer
+            self._queue = self._writer = None
+        await self.engine.dispose()
+
+    async def insert(
+        self, model: Type, *objs: Union[Sequence[LlamaABC], LlamaBatch], on_conflict: str = ON_CONFLICT_FAIL
+    ) -> InsertReport:
+        """
+        Insert llamas of type `model`, given either one by one or as a single LlamaBatch (see ORM.insert()).
+        Returns once they've been committed (along with any other inserts that were waiting).
+        """
+        assert issubclass(model, LlamaABC), f"Don't know how to model a non-Llama type {model}"
+        assert (
+            model in self.tables
+        ), f"Model {model} never got added as an ORM table (don't forget 'add_table()')"
+        assert objs, "Gotta have at least one object to insert"
+
+        is_batch = len(objs) == 1 and isinstance(objs[0], LlamaBatch)
+        if is_batch:
+            batch = objs[0]
+            assert batch.model is model, f"batch is of {batch.model} but should be of {model}"
+            assert len(batch), "Gotta have at least one object to insert"
+            rows = self.orm.transform_batch(batch)
+        else:
+            for obj in objs:
+                assert isinstance(obj, model), f"obj is of type {type(obj)} but should be of type {model}"
+            rows = [self.orm.transform(obj) for obj in objs]
+
+        keep = self.orm.unseen(model, rows, on_conflict)
+        filtered = len(rows) - len(keep)
+        if filtered:
+            rows = [rows[i] for i in keep]
+            objs = objs if is_batch else [objs[i] for i in keep]
+
+        written = 0
+        if rows:
+            done = asyncio.get_running_loop().create_future()
+            await self._writer_queue().put((model, rows, on_conflict, done))
+            written = await done
+
+        if not is_batch:
+            self.orm.remember(model, objs, on_conflict, written)
+        return InsertReport(inserted=written, skipped=len(rows) - written + filtered, filtered=filtered)
+
+    async def retrieve(self, model: Type, *ids: Sequence[UUID], lazy: bool = False) -> Dict[UUID, LlamaABC]:
+        assert issubclass(model, LlamaABC), f"Don't know how to model a non-Llama type {model}"
+        assert (
+            model in self.tables
+        ), f"Model {model} never got added as an ORM table (don't forget 'add_table()')"
+        assert ids, "Gotta have at least one id to select"
+        for id in ids:
+            assert isinstance(id, UUID), f"id is of type {type(id)} but should be of type {UUID}"
+
+        cache = self.orm.cache
+        if cache is not None and model.is_immutable():
+            out, ids = cache.get_many(model, ids)
+            if not ids:
+                return out
+        else:
+            out = {}
+
+        ids = iter(ids)
+        async with self.engine.connect() as conn:
+            while True:
+                chunk = list(itertools.islice(ids, self.orm.max_ids_per_select))
+                if not chunk:
+                    break
+                values = [self.orm.id_value(id) for id in chunk]
+                for table in self.orm.read_tables(model):
+                    result = await conn.execute(sqla_select(table).where(table.c.id.in_(values)))
+                    rows = result.mappings().all()
+                    if rows and isinstance(self.orm.codecs[model], CompressedCodec):
+                        await conn.run_sync(
+                            self.orm.load_missing_dictionaries, model, [d["event"] for d in rows]
+                        )
+                    found = [self.orm.hydrate(model, d, lazy=lazy) for d in rows]
+                    for obj in found:
+                        out[obj.table_id] = obj
+                    self.orm.remember(model, found)
+        return out
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "commits": self.commits,
+            "committed": self.committed,
+        }
+
+    def _writer_queue(self) -> asyncio.Queue:
+        if self._writer is None:
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+        return self._queue
+
+    async def _write_loop(self):
+        stopping = False
+        group = []
+        try:
+            while not stopping:
+                item = await self._queue.get()
+                if item is None:
+                    return
+                group = [item]
+                rows = len(item[1])
+                while rows < self.max_batch and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stopping = True
+                        break
+                    group.append(item)
+                    rows += len(item[1])
+                await self._commit(group)
+        except BaseException as e:
+            # nobody else would settle them: fail every insert still waiting (they get the error),
+            # and let the next insert start a new writer task
+            error = e if isinstance(e, Exception) else RuntimeError("AsyncORM's writer task was stopped")
+            pending = list(group)
+            while not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+            for item in pending:
+                if item is not None:
+                    _settle(item[-1], error=error)
+            self._queue = self._writer = None
+            if not isinstance(e, Exception):
+                raise
+
+    async def _commit(self, group: List[Tuple[Type, List[dict], str, asyncio.Future]]):
+        try:
+            async with self.engine.begin() as conn:
+                written = await conn.run_sync(self._write_group, group)
+        except Exception as e:
+            if len(group) == 1:
+                _settle(group[0][-1], error=e)
+                return
+            # one bad insert shouldn't fail the others it happened to be grouped with
+            for item in group:
+                await self._commit([item])
+            return
+
+        self.commits += 1
+        for (model, rows, _, done), n in zip(group, written):
+            self.committed += len(rows)
+            self.orm.mark_stored(model, rows)
+            _settle(done, result=n)
+
+    def _write_group(self, conn, group: List[Tuple[Type, List[dict], str, asyncio.Future]]) -> List[int]:
+        return [self.orm.write_rows(conn, model, rows, on_conflict) for model, rows, on_conflict, _ in group]
+
+
+def _settle(done: asyncio.Future, result: int = None, error: Exception = None):
+    # the inserting task may have been cancelled while it waited
+    if done.done():
+        return
+    if error is None:
+        done.set_result(result)
+    else:
+        done.set_exception(error)
@@ -1,23 +1,37 @@
 import logging
 import datetime
-import json
+import threading
 import uuid
-from typing import Callable
+from typing import Callable, Union
 
 import llama.logger as logger
 import llama.env as env
 
 
 from llama.abstract_base import LlamaABC
+from llama.codec import Codec, CompressedCodec, TEXT_CODEC, get_codec
+from llama.schema import declared_fields, schema_of
 
 
-class LlamaMixin:
+_UNSET = object()
+
+# guards lazy hydration, so a llama shared between threads (EG through an IdentityMap) is only ever seen
+# either before it or after it
+_hydrate_lock = threading.RLock()
+
+
+class LlamaCore:
     """
     To achieve "immutability" we are only allowing settattr
     through the parent class.
     CF: https://stackoverflow.com/questions/42452953/python-3-user-defined-immutable-class-objects
+
+    LlamaCore declares empty __slots__ so that @slotted llamas end up without a __dict__.
+    Regular llamas get their __dict__ from LlamaMixin.
     """
 
+    __slots__ = ()
+
     @classmethod
     def is_immutable(cls) -> bool:
         return True
@@ -40,52 +54,163 @@ class LlamaMixin:
 
     def add_timestamp(self):
         ts = datetime.datetime.now(datetime.timezone.utc)
-        super(LlamaMixin, self).__setattr__("created_at", ts)
+        super(LlamaCore, self).__setattr__("created_at", ts)
 
     json_excludes = ["json_excludes"]
 
+    # lazy hydration state - see from_event_json(lazy=True)
+    _event_pending = False
+    _event_raw = None
+    _event_codec = None
+
     def __setattr__(self, k, v):
         if self.is_immutable():
             raise AttributeError(f"{type(self)} cannot be modified")
 
-        super(LlamaMixin, self).__setattr__(k, v)
+        self._hydrate_lazy_event()
+        super(LlamaCore, self).__setattr__(k, v)
+
+    def __getattr__(self, k):
+        # only reached when regular lookup fails, which is when a lazily kept event may still hold k
+        if k.startswith("_") or not self._hydrate_lazy_event():
+            raise AttributeError(f"{type(self).__qualname__!r} object has no attribute {k!r}")
+        return getattr(self, k)
 
-    def __init__(self, event_json: str = None, env: str = None, **kwargs):
+    def __init__(
+        self, event_json: Union[str, bytes] = None, env: str = None, event_codec: Codec = None, **kwargs
+    ):
         if self.has_timestamp():
             self.add_timestamp()
 
-        super(LlamaMixin, self).__setattr__("table_id", self.table_id_maker()())
+        super(LlamaCore, self).__setattr__("table_id", self.table_id_maker()())
 
         for k, v in kwargs.items():
-            super(LlamaMixin, self).__setattr__(k, v)
+            super(LlamaCore, self).__setattr__(k, v)
 
         if event_json:
-            self._hydrate_from_event_json(event_json)
+            self._hydrate_from_event_json(event_json, codec=event_codec)
 
         self.log(msg="initialized")
 
-    def _hydrate_from_event_json(self, j: str):
-        for k, v in json.loads(j).items():
+    def _hydrate_from_event_json(self, j: Union[str, bytes], codec: Codec = None):
+        for k, v in (codec or TEXT_CODEC).loads(j).items():
             if k == "table_id":
                 v = uuid.UUID(v)
-            super(LlamaMixin, self).__setattr__(k, v)
+            super(LlamaCore, self).__setattr__(k, v)
+
+    def _hydrate_lazy_event(self) -> bool:
+        if not self._event_pending:
+            return False
+
+        with _hydrate_lock:
+            if self._event_pending:
+                self._hydrate_from_event_json(self._event_raw, codec=self._event_codec)
+                if not self.is_immutable():
+                    # a mutable llama can drift away from its original event, so don't keep serving it
+                    super(LlamaCore, self).__setattr__("_event_raw", None)
+                # only now that every field is there
+                super(LlamaCore, self).__setattr__("_event_pending", False)
+        return True
+
+    def _original_event(self, codec: Codec):
+        raw = self._event_raw
+        if raw is None:
+            return None
+        if codec is self._event_codec:
+            return raw
+        # another instance of the same backend makes the same bytes (EG orjson's compact output isn't
+        # as_event_json()'s) - unless it compresses: the bytes name a dictionary only that codec has
+        if codec.name == self._event_codec.name and not isinstance(codec, CompressedCodec):
+            return raw
+        return None
 
     def as_dict(self) -> dict:
-        return {
-            k: getattr(self, k)
-            for k in set(dir(self)) - set(LlamaMixin.json_excludes)
-            if not (k.startswith("_") or callable(getattr(self, k)))
-            # if not (k.startswith("_") or callable(v := getattr(self, k)))
-        }
+        self._hydrate_lazy_event()
+        schema = schema_of(type(self), LlamaCore.json_excludes)
+        d = {}
+        for k in schema.fields(self):
+            v = getattr(self, k, _UNSET)
+            if not (v is _UNSET or callable(v)):
+                d[k] = v
+        return d
 
     @classmethod
-    def from_event_json(cls, j: str):
+    def from_event_json(cls, j: Union[str, bytes], lazy: bool = False, table_id: uuid.UUID = None):
+        """
+        lazy - keep the raw event and only decode it on first access of a field that isn't table_id.
+               The event must be complete, as made by as_event_json(): nothing (id, timestamp) gets added to it.
+               If table_id isn't given the event is decoded right away to find it. So it is if the class has
+               class level fields (EG defaults): those would hide the event's values until it's decoded.
+        """
+        if lazy:
+            return cls._lazy(j, TEXT_CODEC, table_id)
+
         llama = cls.__new__(cls)
         super(cls, llama).__init__(event_json=j)
         return llama
 
+    @classmethod
+    def _lazy(cls, raw: Union[str, bytes], codec: Codec, table_id: uuid.UUID = None):
+        llama = cls.__new__(cls)
+        if not hasattr(llama, "__dict__"):
+            raise TypeError(f"{cls.__qualname__} has no __dict__ so can't be hydrated lazily")
+
+        llama.__dict__.update(_event_raw=raw, _event_codec=codec, _event_pending=True)
+        if table_id is None or schema_of(cls, LlamaCore.json_excludes).class_fields:
+            llama._hydrate_lazy_event()
+        else:
+            super(LlamaCore, llama).__setattr__("table_id", table_id)
+
+        llama.log(msg="initialized")
+        return llama
+
+    @classmethod
+    def from_fields(cls, fields: dict):
+        """
+        Like from_event_json(), but from already decoded fields (table_id included): __init__ isn't run, so
+        no throwaway table_id or timestamp and no log line per llama.
+        """
+        return cls._assemble(fields)
+
+    @classmethod
+    def _assemble(cls, fields: dict):
+        """
+        Build a llama straight from its fields: no new table_id, no clock read and no log line.
+        """
+        llama = cls.__new__(cls)
+        for k, v in fields.items():
+            super(LlamaCore, llama).__setattr__(k, v)
+        return llama
+
+    @classmethod
+    def from_event_bytes(cls, data: bytes, codec: Codec = None, lazy: bool = False, table_id: uuid.UUID = None):
+        """
+        Inverse of as_event_bytes() - the codec must be the one the bytes were made with.
+        lazy and table_id are as for from_event_json()
+        """
+        codec = codec or get_codec()
+        if lazy:
+            return cls._lazy(data, codec, table_id)
+
+        llama = cls.__new__(cls)
+        super(cls, llama).__init__(event_json=data, event_codec=codec)
+        return llama
+
     def as_event_json(self) -> str:
-        return json.dumps(self.as_dict(), sort_keys=True, default=str)
+        raw = self._original_event(TEXT_CODEC)
+        if raw is not None:
+            return raw if isinstance(raw, str) else raw.decode()
+        return TEXT_CODEC.dumps_str(self.as_dict())
+
+    def as_event_bytes(self, codec: Codec = None) -> bytes:
+        """
+        Serialized with the given codec, defaulting to the fastest installed JSON backend
+        """
+        codec = codec or get_codec()
+        raw = self._original_event(codec)
+        if raw is not None:
+            return raw if isinstance(raw, bytes) else raw.encode()
+        return codec.dumps(self.as_dict())
 
     def __str__(self) -> str:
         return self.as_event_json()
@@ -93,12 +218,74 @@ class LlamaMixin:
     def __eq__(self, other: LlamaABC) -> bool:
         return str(self.table_id) == str(other.table_id)
 
-    def log(self, level: int = logging.INFO, msg: str = None):
-        logger.log(self, level=level, msg=msg)
+    def log(self, level: int = logging.INFO, msg: str = None, payload: bool = False):
+        logger.log(self, level=level, msg=msg, payload=payload)
+
+
+class LlamaMixin(LlamaCore):
+    """
+    Dict-backed llama: any attribute can be set at construction / hydration time.
+    """
 
 
 class LlamaBase(LlamaMixin, LlamaABC):
     pass
 
 
+class CompactLlamaBase(LlamaCore, LlamaABC):
+    """
+    Base for @slotted llamas. Subclasses must keep declaring __slots__ (which @slotted does for you).
+    """
+
+    __slots__ = ()
+
+
+def slotted(*fields: str) -> Callable[[type], type]:
+    """
+    Class decorator which rebuilds a CompactLlamaBase subclass with __slots__ for the declared fields,
+    plus table_id (and created_at when the class has_timestamp()). The resulting instances have no __dict__,
+    so setting (or hydrating) an undeclared field raises AttributeError.
+    With no fields given, the class annotations are the declaration (see schema.declared_fields).
+
+    EG:
+        @slotted("symbol", "price")
+        class Quote(CompactLlamaBase):
+            ...
+    """
+
+    def wrap(cls: type) -> type:
+        for base in cls.__mro__[1:-1]:
+            if "__slots__" not in base.__dict__:
+                raise TypeError(
+                    f"Can't slot {cls.__qualname__}: its base {base.__qualname__} has a __dict__"
+                    " (derive from CompactLlamaBase instead)"
+                )
+
+        slots = ["table_id"]
+        if cls.has_timestamp():
+            slots.append("created_at")
+        slots.extend(fields or declared_fields(cls))
+
+        skip = ("__dict__", "__weakref__", "__abstract_attribute_names__")
+        namespace = {k: v for k, v in cls.__dict__.items() if k not in skip}
+        namespace["__slots__"] = tuple(dict.fromkeys(slots))
+        # type() would make these cls.__name__ and the caller's module: db_table_name() goes by __qualname__
+        namespace["__qualname__"] = cls.__qualname__
+        namespace["__module__"] = cls.__module__
+        slotted_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+
+        # zero-arg super() in the class body closes over the original class, so re-point it
+        for v in namespace.values():
+            v = getattr(v, "__func__", v)
+            closure = getattr(v, "__closure__", None)
+            if closure:
+                for name, cell in zip(v.__code__.co_freevars, closure):
+                    if name == "__class__" and cell.cell_contents is cls:
+                        cell.cell_contents = slotted_cls
+
+        return slotted_cls
+
+    return wrap
+
+
 env.setup()
@@ -0,0 +1,182 @@
+from array import array
+import datetime
+import logging
+import time
+from typing import Dict, Iterable, Iterator, List, Sequence, Type, Union
+import uuid
+
+import llama.logger as logger
+from llama.abstract_base import LlamaABC
+from llama.codec import Codec, TEXT_CODEC, get_codec
+
+
+UUID_SIZE = 16
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class _Absent:
+    """
+    Column filler for rows that don't have a field at all (as opposed to having it set to None)
+    """
+
+    def __repr__(self):
+        return "ABSENT"
+
+
+ABSENT = _Absent()
+
+
+def datetime_to_ns(dt: datetime.datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return (dt - EPOCH) // _ONE_MICROSECOND * 1000
+
+
+def ns_to_datetime(ns: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=ns // 1000)
+
+
+class LlamaBatch:
+    """
+    N llamas of one class, stored as columns instead of N Python objects:
+    * table_ids - one bytearray holding N 16-byte UUIDs
+    * created_at - int64 epoch nanoseconds (only when the model has_timestamp())
+    * every other field - one list per field, ABSENT where a row doesn't have it
+
+    Building a batch reads the clock once and logs once, rather than once per llama.
+    Rows can still be materialized as llamas (`batch[i]`, `iter(batch)`) when needed.
+    """
+
+    def __init__(
+        self,
+        model: Type,
+        table_ids: bytearray,
+        created_at: array = None,
+        columns: Dict[str, list] = None,
+    ):
+        assert issubclass(model, LlamaABC), f"Don't know how to batch a non-Llama type {model}"
+        assert len(table_ids) % UUID_SIZE == 0, "table_ids must be a whole number of 16-byte UUIDs"
+
+        self.model = model
+        self.table_ids = table_ids
+        self.created_at = created_at
+        self.columns = columns if columns is not None else {}
+
+        n = len(self)
+        assert created_at is None or len(created_at) == n, "created_at column is the wrong length"
+        for name, column in self.columns.items():
+            assert len(column) == n, f"column {name} is the wrong length"
+
+        logger.log(self, msg="initialized")
+
+    @classmethod
+    def build(cls, model: Type, rows: Sequence[dict]) -> "LlamaBatch":
+        """
+        Bulk equivalent of `model(**row)` for every row: fresh table_ids and a single shared created_at.
+        """
+        n = len(rows)
+        make_id = model.table_id_maker()
+        allocate_bytes = getattr(make_id, "allocate_bytes", None)
+        if allocate_bytes is not None:
+            table_ids = bytearray(allocate_bytes(n))
+        else:
+            table_ids = bytearray(b"".join(make_id().bytes for _ in range(n)))
+
+        created_at = None
+        if model.has_timestamp():
+            created_at = array("q", [time.time_ns() // 1000 * 1000]) * n
+
+        return cls(model, table_ids, created_at, cls._columnize(rows))
+
+    @classmethod
+    def from_llamas(cls, model: Type, llamas: Sequence[LlamaABC]) -> "LlamaBatch":
+        rows = [llama.as_dict() for llama in llamas]
+        return cls._from_dicts(model, rows)
+
+    @classmethod
+    def from_event_json(cls, model: Type, events: Iterable[Union[str, bytes]], codec: Codec = None) -> "LlamaBatch":
+        codec = codec or TEXT_CODEC
+        return cls._from_dicts(model, [codec.loads(j) for j in events])
+
+    @classmethod
+    def _from_dicts(cls, model: Type, rows: List[dict]) -> "LlamaBatch":
+        table_ids = bytearray()
+        created_at = array("q") if model.has_timestamp() else None
+        for row in rows:
+            table_id = row.pop("table_id")
+            if not isinstance(table_id, uuid.UUID):
+                table_id = uuid.UUID(table_id)
+            table_ids += table_id.bytes
+
+            if created_at is not None:
+                ts = row.pop("created_at")
+                if isinstance(ts, str):
+                    ts = datetime.datetime.fromisoformat(ts)
+                created_at.append(datetime_to_ns(ts))
+
+        return cls(model, table_ids, created_at, cls._columnize(rows))
+
+    @staticmethod
+    def _columnize(rows: Sequence[dict]) -> Dict[str, list]:
+        names = {}
+        for row in rows:
+            names.update(dict.fromkeys(row))
+        return {name: [row.get(name, ABSENT) for row in rows] for name in names}
+
+    def __len__(self) -> int:
+        return len(self.table_ids) // UUID_SIZE
+
+    def __str__(self) -> str:
+        return f"LlamaBatch[{self.model.__qualname__} x {len(self)}]"
+
+    def table_id(self, i: int) -> uuid.UUID:
+        return uuid.UUID(bytes=bytes(self.table_ids[i * UUID_SIZE : (i + 1) * UUID_SIZE]))
+
+    def iter_table_ids(self) -> Iterator[uuid.UUID]:
+        view = memoryview(self.table_ids)
+        for start in range(0, len(view), UUID_SIZE):
+            yield uuid.UUID(bytes=view[start : start + UUID_SIZE].tobytes())
+
+    def row(self, i: int) -> dict:
+        """
+        Row i as the dict `as_dict()` would give for the equivalent llama
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"batch index {i} out of range")
+
+        d = {"table_id": self.table_id(i)}
+        if self.created_at is not None:
+            d["created_at"] = ns_to_datetime(self.created_at[i])
+        for name, column in self.columns.items():
+            v = column[i]
+            if v is not ABSENT:
+                d[name] = v
+        return d
+
+    def iter_dicts(self) -> Iterator[dict]:
+        return (self.row(i) for i in range(len(self)))
+
+    def as_dicts(self) -> List[dict]:
+        return list(self.iter_dicts())
+
+    def as_event_json(self) -> List[str]:
+        return [TEXT_CODEC.dumps_str(d) for d in self.iter_dicts()]
+
+    def as_event_bytes(self, codec: Codec = None) -> List[bytes]:
+        dumps = (codec or get_codec()).dumps
+        return [dumps(d) for d in self.iter_dicts()]
+
+    def __getitem__(self, i: int) -> LlamaABC:
+        return self.model._assemble(self.row(i))
+
+    def __iter__(self) -> Iterator[LlamaABC]:
+        for d in self.iter_dicts():
+            yield self.model._assemble(d)
+
+    def log(self, level: int = logging.INFO, msg: str = None, payload: bool = False):
+        logger.log(self, level=level, msg=msg, payload=payload)
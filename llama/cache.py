@@ -0,0 +1,128 @@
+from collections import OrderedDict
+import itertools
+import threading
+from typing import Dict, Hashable, Iterable, Optional, Tuple, Type
+from uuid import UUID
+
+from llama.abstract_base import LlamaABC
+
+
+class IdentityMap:
+    """
+    Size-bounded LRU of llamas keyed by (model, table_id).
+
+    Only immutable llamas belong here: a stored immutable llama never changes, so a cached copy never goes stale.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        assert max_size > 0, "max_size must be positive"
+        self.max_size = max_size
+        self._items: "OrderedDict[Tuple[Type, Hashable], LlamaABC]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __str__(self) -> str:
+        return f"IdentityMap[{len(self)}/{self.max_size}, hits={self.hits}, misses={self.misses}]"
+
+    def get(self, model: Type, table_id: UUID) -> Optional[LlamaABC]:
+        key = (model, table_id)
+        with self._lock:
+            obj = self._items.get(key)
+            if obj is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return obj
+
+    def get_many(self, model: Type, table_ids: Iterable[UUID]) -> Tuple[Dict[UUID, LlamaABC], list]:
+        """
+        Returns (hits by table_id, the table_ids that missed)
+        """
+        found, missing = {}, []
+        for table_id in table_ids:
+            obj = self.get(model, table_id)
+            if obj is None:
+                missing.append(table_id)
+            else:
+                found[table_id] = obj
+        return found, missing
+
+    def put(self, model: Type, obj: LlamaABC):
+        key = (model, obj.table_id)
+        with self._lock:
+            self._items[key] = obj
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def put_many(self, model: Type, objs: Iterable[LlamaABC]):
+        for obj in objs:
+            self.put(model, obj)
+
+    def discard(self, model: Type, table_id: UUID):
+        with self._lock:
+            self._items.pop((model, table_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SeenSet:
+    """
+    Size-bounded set of recently stored keys, the least recently seen forgotten first.
+
+    Exact rather than a Bloom filter: a false positive would silently drop a row that was never stored.
+    """
+
+    def __init__(self, max_size: int = 1_000_000):
+        assert max_size > 0, "max_size must be positive"
+        self.max_size = max_size
+        self._keys: Dict[Hashable, None] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __str__(self) -> str:
+        return f"SeenSet[{len(self)}/{self.max_size}, hits={self.hits}]"
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self.hits += 1
+            return True
+
+    def add_many(self, keys: Iterable[Hashable]):
+        with self._lock:
+            for key in keys:
+                self._keys.pop(key, None)
+                self._keys[key] = None
+            overflow = len(self._keys) - self.max_size
+            if overflow > 0:
+                for key in list(itertools.islice(self._keys, overflow)):
+                    del self._keys[key]
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self), "max_size": self.max_size, "hits": self.hits}
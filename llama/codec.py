@@ -0,0 +1,289 @@
+"""
+Event (de)serialization shared by llamas and the ORM.
+
+Every codec turns an `as_dict()` into bytes and back. Values json can't represent natively go through
+`encode_default()`, which keeps a per-type cache of encoders (datetimes and UUIDs are pre-registered)
+and otherwise falls back to `str` - the same thing `json.dumps(..., default=str)` always did.
+
+Backends:
+* "json" - stdlib, always available. Its text output is what `as_event_json()` has always produced.
+* "orjson" - when installed. Compact separators, otherwise the same values as "json".
+* "msgpack" - when installed. A compact binary encoding of the same events.
+
+`get_codec()` with no name gives the fastest JSON backend that is installed.
+
+`CompressedCodec` wraps any of them in zlib (or zstd, when installed) compression, optionally with a
+shared dictionary trained on sample events - which is what lets small events compress well.
+"""
+import datetime
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Union
+import uuid
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+# what register_encoder() was told
+_registered: Dict[type, Callable[[Any], Any]] = {
+    datetime.datetime: str,
+    datetime.date: str,
+    datetime.time: str,
+    uuid.UUID: str,
+}
+# every type seen so far, resolved through its MRO against _registered
+_encoders: Dict[type, Callable[[Any], Any]] = dict(_registered)
+
+
+def register_encoder(typ: type, encoder: Callable[[Any], Any]):
+    _registered[typ] = encoder
+    # types which resolved to a base's encoder may now resolve differently
+    _encoders.clear()
+    _encoders.update(_registered)
+
+
+def encode_default(obj: Any) -> Any:
+    typ = type(obj)
+    encoder = _encoders.get(typ)
+    if encoder is None:
+        encoder = next((_registered[base] for base in typ.__mro__[1:] if base in _registered), str)
+        _encoders[typ] = encoder
+    return encoder(obj)
+
+
+class Codec:
+    name: str = None
+    is_binary: bool = False
+
+    def dumps(self, d: dict) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: Union[bytes, str]) -> dict:
+        raise NotImplementedError
+
+    def __str__(self):
+        return f"Codec[{self.name}]"
+
+
+class JsonCodec(Codec):
+    name = "json"
+
+    def dumps_str(self, d: dict) -> str:
+        return json.dumps(d, sort_keys=True, default=encode_default)
+
+    def dumps(self, d: dict) -> bytes:
+        return self.dumps_str(d).encode()
+
+    def loads(self, data: Union[bytes, str]) -> dict:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def __init__(self):
+        assert orjson is not None, "orjson isn't installed"
+        # pass datetimes through to encode_default so they come out like the stdlib codec's
+        self.options = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, d: dict) -> bytes:
+        return orjson.dumps(d, default=self._default, option=self.options)
+
+    @staticmethod
+    def _default(obj: Any) -> Any:
+        # orjson serializes UUIDs natively (same text as str()), so only the passthrough types land here
+        return encode_default(obj)
+
+    def loads(self, data: Union[bytes, str]) -> dict:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    is_binary = True
+
+    def __init__(self):
+        assert msgpack is not None, "msgpack isn't installed"
+
+    def dumps(self, d: dict) -> bytes:
+        return msgpack.packb(dict(sorted(d.items())), default=encode_default, use_bin_type=True)
+
+    def loads(self, data: bytes) -> dict:
+        return msgpack.unpackb(data, raw=False)
+
+
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+
+# zlib only ever looks back 32KB, so a longer dictionary would be wasted
+_ZLIB_MAX_DICTIONARY = 32 * 1024
+
+
+class CompressedCodec(Codec):
+    """
+    Another codec's output, compressed.
+
+    Every payload starts with 2 bytes naming the dictionary it was compressed with (0 for none), so payloads
+    stay readable after a new dictionary is trained, as long as the older ones are still added.
+
+    EG: codec = CompressedCodec(COMPRESSION_ZSTD)
+        codec.add_dictionary(1, codec.train(sample_dicts))
+    """
+
+    is_binary = True
+
+    def __init__(self, algorithm: str = COMPRESSION_ZLIB, inner: Codec = None, level: int = None):
+        assert algorithm in (COMPRESSION_ZLIB, COMPRESSION_ZSTD), f"Unknown compression {algorithm}"
+        assert algorithm != COMPRESSION_ZSTD or zstandard is not None, "zstandard isn't installed"
+
+        self.algorithm = algorithm
+        self.inner = inner or get_codec()
+        self.level = level if level is not None else (6 if algorithm == COMPRESSION_ZLIB else 3)
+        self.name = f"{algorithm}+{self.inner.name}"
+
+        self.dictionaries: Dict[int, bytes] = {}
+        self.dictionary_id = 0
+        # asked for a dictionary this codec hasn't been given (EG one trained by another process)
+        self.dictionary_loader: Optional[Callable[[int], Optional[bytes]]] = None
+        # zstd (de)compressors mustn't be shared between threads
+        self._local = threading.local()
+
+    def add_dictionary(self, dictionary_id: int, dictionary: bytes, use: bool = True):
+        """
+        Make a dictionary available for decompression and, with `use`, compress with it from now on
+        """
+        assert 0 < dictionary_id < 2**16, "Dictionary ids go from 1 to 65535"
+        assert (
+            self.dictionaries.get(dictionary_id, dictionary) == dictionary
+        ), f"Dictionary {dictionary_id} is already something else"
+        self.dictionaries[dictionary_id] = dictionary
+        if use:
+            self.dictionary_id = dictionary_id
+
+    def train(self, samples: Iterable[dict], size: int = 16 * 1024) -> bytes:
+        """
+        A dictionary for events like `samples`
+        """
+        encoded = [self.inner.dumps(d) for d in samples]
+        assert encoded, "Need some samples to train a dictionary"
+        if self.algorithm == COMPRESSION_ZSTD:
+            try:
+                return zstandard.train_dictionary(size, encoded).as_bytes()
+            except zstandard.ZstdError:
+                # too few samples for zstd's trainer - the raw samples still make a usable dictionary
+                pass
+        else:
+            size = min(size, _ZLIB_MAX_DICTIONARY)
+        # plain content, where the strings nearest the end are the cheapest to refer to
+        return b"".join(encoded)[-size:]
+
+    def dumps(self, d: dict) -> bytes:
+        return self.dictionary_id.to_bytes(2, "big") + self._compress(self.dictionary_id, self.inner.dumps(d))
+
+    def loads(self, data: bytes) -> dict:
+        return self.inner.loads(self._decompress(self.dictionary_of(data), data[2:]))
+
+    @staticmethod
+    def dictionary_of(data: bytes) -> int:
+        """
+        The id of the dictionary a payload was compressed with (0 for none)
+        """
+        return int.from_bytes(data[:2], "big")
+
+    def _compress(self, dictionary_id: int, data: bytes) -> bytes:
+        if self.algorithm == COMPRESSION_ZSTD:
+            compressors = self._thread_cache("compressors")
+            compressor = compressors.get(dictionary_id)
+            if compressor is None:
+                compressor = compressors[dictionary_id] = zstandard.ZstdCompressor(
+                    level=self.level, dict_data=self._zstd_dictionary(dictionary_id)
+                )
+            return compressor.compress(data)
+
+        if dictionary_id == 0:
+            return zlib.compress(data, self.level)
+        # loading the dictionary is most of the work for a small event, so do it once and copy the result
+        compressors = self._thread_cache("compressors")
+        primed = compressors.get(dictionary_id)
+        if primed is None:
+            primed = compressors[dictionary_id] = zlib.compressobj(self.level, zdict=self.dictionaries[dictionary_id])
+        compressor = primed.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, dictionary_id: int, data: bytes) -> bytes:
+        if dictionary_id and dictionary_id not in self.dictionaries and self.dictionary_loader is not None:
+            dictionary = self.dictionary_loader(dictionary_id)
+            if dictionary is not None:
+                self.add_dictionary(dictionary_id, dictionary, use=False)
+        assert (
+            dictionary_id == 0 or dictionary_id in self.dictionaries
+        ), f"{self} doesn't have dictionary {dictionary_id}"
+        if self.algorithm == COMPRESSION_ZSTD:
+            decompressors = self._thread_cache("decompressors")
+            decompressor = decompressors.get(dictionary_id)
+            if decompressor is None:
+                decompressor = decompressors[dictionary_id] = zstandard.ZstdDecompressor(
+                    dict_data=self._zstd_dictionary(dictionary_id)
+                )
+            return decompressor.decompress(data)
+
+        if dictionary_id == 0:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj(zdict=self.dictionaries[dictionary_id])
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def _thread_cache(self, kind: str) -> dict:
+        cache = getattr(self._local, kind, None)
+        if cache is None:
+            cache = {}
+            setattr(self._local, kind, cache)
+        return cache
+
+    def _zstd_dictionary(self, dictionary_id: int):
+        if dictionary_id == 0:
+            return None
+        return zstandard.ZstdCompressionDict(self.dictionaries[dictionary_id])
+
+
+_codecs: Dict[str, Codec] = {"json": JsonCodec()}
+if orjson is not None:
+    _codecs["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    _codecs["msgpack"] = MsgpackCodec()
+
+
+def available_codecs() -> Dict[str, Codec]:
+    return dict(_codecs)
+
+
+_default_name = "orjson" if "orjson" in _codecs else "json"
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    if name is None:
+        name = _default_name
+    assert name in _codecs, f"Unknown or uninstalled codec {name} (have: {', '.join(_codecs)})"
+    return _codecs[name]
+
+
+def set_default_codec(name: str):
+    global _default_name
+    get_codec(name)
+    _default_name = name
+
+
+TEXT_CODEC = _codecs["json"]
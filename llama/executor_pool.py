@@ -0,0 +1,276 @@
+"""
+A pool of RemoteTradeExecutor actors for one broker, so remote orders aren't all funneled through one process.
+
+Orders are routed by consistent hashing on their symbol: every order for a symbol goes to the same actor, which
+places them in the order they were given. When an actor dies, only its symbols move (to the other actors, or
+to a replacement). Its unfinished orders are first looked up at the broker by their client_order_id, as some
+may have gone out before it died, and only the rest are resent there.
+
+Orders bound for the same actor go in one actor call (up to max_batch at a time) rather than one call each.
+"""
+import bisect
+from collections import defaultdict
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Sequence
+import uuid
+
+import ray
+from ray.exceptions import GetTimeoutError, RayActorError
+
+import llama.logger as logger
+from llama.trader import Broker, RemoteTradeExecutor
+
+
+def _hash(key: str) -> int:
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing: each node gets `replicas` points on a ring, and a key belongs to the first node point at
+    or after the key's own. Adding or removing a node only moves the keys next to its points.
+    """
+
+    def __init__(self, replicas: int = 64):
+        assert replicas > 0, "replicas must be positive"
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._nodes: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._points) // self.replicas
+
+    def add(self, node: str):
+        for r in range(self.replicas):
+            point = _hash(f"{node}#{r}")
+            i = bisect.bisect_left(self._points, point)
+            self._points.insert(i, point)
+            self._nodes.insert(i, node)
+
+    def remove(self, node: str):
+        keep = [(p, n) for p, n in zip(self._points, self._nodes) if n != node]
+        self._points = [p for p, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def node(self, key: str) -> str:
+        assert self._points, "The ring has no nodes"
+        i = bisect.bisect_left(self._points, _hash(key))
+        return self._nodes[i % len(self._nodes)]
+
+
+def _waves(indices: List[int], orders: Sequence[dict]) -> List[List[int]]:
+    """
+    Split orders so no wave has two for the same symbol: a wave's orders go out concurrently, the waves one after
+    the other, so each symbol's orders keep their order.
+    """
+    waves: List[List[int]] = []
+    seen: Dict[str, int] = defaultdict(int)
+    for i in indices:
+        symbol = orders[i]["symbol"]
+        if seen[symbol] == len(waves):
+            waves.append([])
+        waves[seen[symbol]].append(i)
+        seen[symbol] += 1
+    return waves
+
+
+class ExecutorPool:
+    """
+    EG:
+        ray.init(num_cpus=4)
+        pool = ExecutorPool(broker, size=4)
+        results = pool.order_batch([{"side": "buy", "symbol": "IBM", "qty": 10}, ...])
+
+    size - how many actors to start
+    max_batch - most orders in one actor call
+    actor_workers - how many of a call's orders an actor sends at once (see TradeExecutor.order_batch())
+    replace_dead - start a new actor when one dies, rather than leave its symbols to the others
+    actor_options - for RemoteTradeExecutor.options(), EG {"num_cpus": 0}
+    """
+
+    def __init__(
+        self,
+        broker: Broker,
+        size: int = 4,
+        max_batch: int = 32,
+        actor_workers: int = 4,
+        replicas: int = 64,
+        replace_dead: bool = True,
+        actor_options: dict = None,
+    ):
+        assert size > 0, "size must be positive"
+        assert max_batch > 0, "max_batch must be positive"
+        self.broker = broker
+        self.max_batch = max_batch
+        self.actor_workers = actor_workers
+        self.replace_dead = replace_dead
+        self.actor_options = actor_options or {}
+
+        self.ring = HashRing(replicas)
+        self.actors: Dict[str, "ray.actor.ActorHandle"] = {}
+        self.depths: Dict[str, int] = {}
+        self.deaths = 0
+        self._started = 0
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._start_actor()
+
+    def __str__(self) -> str:
+        return f"ExecutorPool[{self.broker.name}, {len(self.actors)} actors]"
+
+    def _start_actor(self):
+        name = f"{self.broker.name}#{self._started}"
+        self._started += 1
+        self.actors[name] = RemoteTradeExecutor.options(**self.actor_options).remote(self.broker)
+        self.depths[name] = 0
+        self.ring.add(name)
+
+    def _died(self, name: str):
+        with self._lock:
+            if name not in self.actors:
+                # someone else already dealt with it
+                return
+            actor = self.actors.pop(name)
+            del self.depths[name]
+            self.ring.remove(name)
+            self.deaths += 1
+            if self.replace_dead or not self.actors:
+                self._start_actor()
+        # in case it's hung rather than dead
+        ray.kill(actor)
+
+    def actor_for(self, symbol: str) -> str:
+        with self._lock:
+            return self.ring.node(symbol)
+
+    def queue_depths(self) -> Dict[str, int]:
+        """
+        Orders sent to each actor that it hasn't finished with yet
+        """
+        with self._lock:
+            return dict(self.depths)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"actors": len(self.actors), "deaths": self.deaths, "queue_depths": dict(self.depths)}
+
+    def order(self, side: str, symbol: str, qty: int) -> dict:
+        return self.order_batch([{"side": side, "symbol": symbol, "qty": qty}])[0]
+
+    def order_batch(self, orders: Sequence[dict], retries: int = 1) -> List[dict]:
+        """
+        Like TradeExecutor.order_batch(), spread over the actors.
+
+        Orders whose call didn't come back are looked up at the broker (see TradeExecutor.placed()): those it
+        has get their result from there. The rest of those an actor took down with it are resent, up to
+        `retries` times; if that isn't enough their result is
+        {"external_order_id": None, "order": ..., "actor_error": ...}
+        Those whose call failed any other way (EG a RayTaskError) aren't resent into the same failure:
+        {"external_order_id": None, "order": ..., "error": ...}
+        """
+        orders = [dict(o, client_order_id=o.get("client_order_id") or str(uuid.uuid4())) for o in orders]
+        results: List[dict] = [None] * len(orders)
+        todo = list(range(len(orders)))
+        error = None
+        for _ in range(retries + 1):
+            calls = []
+            with self._lock:
+                by_actor = defaultdict(list)
+                for i in todo:
+                    by_actor[self.ring.node(orders[i]["symbol"])].append(i)
+                for name, indices in by_actor.items():
+                    for wave in _waves(indices, orders):
+                        for start in range(0, len(wave), self.max_batch):
+                            chunk = wave[start : start + self.max_batch]
+                            ref = self.actors[name].order_batch.remote(
+                                [orders[i] for i in chunk], max_workers=self.actor_workers
+                            )
+                            self.depths[name] += len(chunk)
+                            calls.append((name, chunk, ref))
+
+            lost: List[int] = []
+            failed: Dict[int, str] = {}
+            for name, chunk, ref in calls:
+                try:
+                    for i, result in zip(chunk, ray.get(ref)):
+                        results[i] = result
+                except RayActorError as e:
+                    error = e
+                    lost.extend(chunk)
+                    self._died(name)
+                except Exception as e:
+                    for i in chunk:
+                        failed[i] = str(e)
+                finally:
+                    with self._lock:
+                        if name in self.depths:
+                            self.depths[name] -= len(chunk)
+
+            # some of them may have reached the broker before the call failed
+            if lost or failed:
+                for i, result in self._placed(orders, lost + list(failed)).items():
+                    results[i] = result
+            for i, e in failed.items():
+                if results[i] is None:
+                    results[i] = {"external_order_id": None, "order": orders[i], "error": e}
+            # resend in the order they were given
+            todo = sorted(i for i in lost if results[i] is None)
+            if not todo:
+                break
+
+        for i in todo:
+            results[i] = {"external_order_id": None, "order": orders[i], "actor_error": str(error)}
+        return results
+
+    def _placed(self, orders: List[dict], indices: List[int]) -> Dict[int, dict]:
+        """
+        The results of those orders the broker already has, asked through the actors now responsible for them.
+        An actor that can't answer leaves its orders out: resending one of them that was placed after all only
+        gets the broker's 422 for a client_order_id it has already seen.
+        """
+        calls = []
+        with self._lock:
+            by_actor = defaultdict(list)
+            for i in indices:
+                by_actor[self.ring.node(orders[i]["symbol"])].append(i)
+            for name, chunk in by_actor.items():
+                calls.append((name, chunk, self.actors[name].placed.remote([orders[i] for i in chunk])))
+
+        found = {}
+        for name, chunk, ref in calls:
+            try:
+                for i, result in zip(chunk, ray.get(ref)):
+                    if result is not None:
+                        found[i] = result
+            except RayActorError:
+                self._died(name)
+            except Exception as e:
+                logger.log(self, level=logging.WARNING, msg=f"couldn't look up {len(chunk)} orders: {e!r}")
+        return found
+
+    def check(self, timeout: float = 10.0) -> List[str]:
+        """
+        Ping every actor, and rebalance away from any that are dead. Returns the dead ones.
+        """
+        with self._lock:
+            pings = {name: actor.__ray_ready__.remote() for name, actor in self.actors.items()}
+        dead = []
+        for name, ref in pings.items():
+            try:
+                ray.get(ref, timeout=timeout)
+            except (RayActorError, GetTimeoutError):
+                dead.append(name)
+                self._died(name)
+        return dead
+
+    def shutdown(self):
+        with self._lock:
+            actors = list(self.actors.values())
+            self.actors.clear()
+            self.depths.clear()
+            self.ring = HashRing(self.ring.replicas)
+        for actor in actors:
+            ray.kill(actor)
@@ -0,0 +1,95 @@
+"""
+Time-ordered (UUIDv7 layout) table ids.
+
+Random uuid4 keys land all over the primary key B-tree. These sort by creation time instead, so inserts
+append to the right-hand edge of the index. Layout, most significant bits first:
+* 48 bits - unix epoch milliseconds
+* 4 bits - version (7)
+* 12 bits - counter, so ids made within the same millisecond still increase
+* 2 bits - variant
+* 62 bits - random
+
+To have a llama class use them:
+
+    @classmethod
+    def table_id_maker(cls) -> Callable:
+        return ids.uuid7
+"""
+import os
+import threading
+import time
+from typing import List
+import uuid
+
+
+_COUNTER_BITS = 12
+_COUNTER_MAX = (1 << _COUNTER_BITS) - 1
+_RANDOM_BITS = 62
+
+
+class UUID7Generator:
+    """
+    Thread-safe, strictly increasing uuid7 source. Calling it gives one id; allocate(n) reserves a block.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ms = 0
+        self._counter = 0
+
+    def _reserve(self, n: int):
+        """
+        Returns the (ms, counter) of the first of n consecutive slots
+        """
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now > self._ms:
+                self._ms, self._counter = now, 0
+            else:
+                # same millisecond (or the clock went backwards) - keep counting from where we were,
+                # carrying into the next millisecond once the counter is used up
+                self._counter += 1
+                if self._counter > _COUNTER_MAX:
+                    self._ms, self._counter = self._ms + 1, 0
+            start = (self._ms, self._counter)
+
+            # the last slot of the block becomes the new high water mark
+            last = self._counter + n - 1
+            self._ms += last >> _COUNTER_BITS
+            self._counter = last & _COUNTER_MAX
+            return start
+
+    @staticmethod
+    def _as_int(ms: int, counter: int, rand: int) -> int:
+        return (ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | rand
+
+    def __call__(self) -> uuid.UUID:
+        ms, counter = self._reserve(1)
+        rand = int.from_bytes(os.urandom(8), "big") >> 2
+        return uuid.UUID(int=self._as_int(ms, counter, rand))
+
+    def allocate_bytes(self, n: int) -> bytes:
+        """
+        n increasing ids as one block of n * 16 bytes (the layout LlamaBatch keeps its table_ids in)
+        """
+        ms, counter = self._reserve(n)
+        randoms = os.urandom(8 * n)
+        out = bytearray(16 * n)
+        for i in range(n):
+            rand = int.from_bytes(randoms[8 * i : 8 * i + 8], "big") >> 2
+            out[16 * i : 16 * i + 16] = self._as_int(ms, counter, rand).to_bytes(16, "big")
+            counter += 1
+            if counter > _COUNTER_MAX:
+                ms, counter = ms + 1, 0
+        return bytes(out)
+
+    def allocate(self, n: int) -> List[uuid.UUID]:
+        block = self.allocate_bytes(n)
+        return [uuid.UUID(bytes=block[i : i + 16]) for i in range(0, len(block), 16)]
+
+
+uuid7 = UUID7Generator()
+
+
+def uuid7_time_ms(u: uuid.UUID) -> int:
+    return u.int >> 80
@@ -1,6 +1,175 @@
+"""
+Logging for llamas (and anything else that wants the same one-line format).
+
+* The level is checked before any work is done.
+* By default a llama is logged by its cheap identity - class name and table_id. Full payloads
+  (which serialize the whole object) are only logged with `payload=True` or after `log_payloads(True)`.
+* `start_background_logging()` moves handler I/O onto a QueueListener thread. The calling thread only
+  enqueues the (unformatted) record, and drops it rather than block when the queue is full.
+* `throttle()` samples and/or rate limits high frequency qualifiers (usually class names).
+"""
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+
+FORMAT = "%s:[%s]<msg:%s>"
+
+_logger = logging.getLogger("llama")
+
+_log_payloads = False
+
+
+def log_payloads(on: bool = True):
+    global _log_payloads
+    _log_payloads = on
+
+
+class _Identity:
+    """
+    Lazily formatted stand-in for an object: only table_id (or the object itself if it has none) is rendered
+    """
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj: object):
+        self.obj = obj
+
+    def __str__(self) -> str:
+        table_id = getattr(self.obj, "table_id", None)
+        if table_id is None or callable(table_id):
+            return str(self.obj)
+        return str(table_id)
+
+
+class _Throttle:
+    def __init__(self, every: int = 1, per_second: Optional[float] = None):
+        assert every >= 1, "Can only sample every 1 or more records"
+        self.every = every
+        self.per_second = per_second
+        self.seen = 0
+        self.suppressed = 0
+        self.tokens = per_second
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            self.seen += 1
+            ok = (self.seen - 1) % self.every == 0
+            if ok and self.per_second is not None:
+                now = time.monotonic()
+                self.tokens = min(self.per_second, self.tokens + (now - self.last) * self.per_second)
+                self.last = now
+                ok = self.tokens >= 1
+                if ok:
+                    self.tokens -= 1
+            if not ok:
+                self.suppressed += 1
+            return ok
+
+
+_throttles: Dict[str, _Throttle] = {}
+
+
+def throttle(qualifier: str, every: int = 1, per_second: Optional[float] = None):
+    """
+    Keep only every `every`th record for `qualifier`, and at most `per_second` of those per second.
+    EG: throttle("Quote", every=100) or throttle("Quote", per_second=10)
+    """
+    _throttles[qualifier] = _Throttle(every=every, per_second=per_second)
+
+
+def unthrottle(qualifier: str = None):
+    if qualifier is None:
+        _throttles.clear()
+    else:
+        _throttles.pop(qualifier, None)
+
+
+def suppressed(qualifier: str) -> int:
+    t = _throttles.get(qualifier)
+    return t.suppressed if t else 0
+
+
+def log(obj_or_info: object, level: int = logging.INFO, msg: str = None, payload: bool = False):
+    if not _logger.isEnabledFor(level):
+        return
+
+    is_info = isinstance(obj_or_info, str)
+    qualifier = obj_or_info if is_info else type(obj_or_info).__qualname__
+
+    t = _throttles.get(qualifier)
+    if t is not None and not t.allow():
+        return
+
+    shown = obj_or_info if (is_info or payload or _log_payloads) else _Identity(obj_or_info)
+    _logger.log(level, FORMAT, qualifier, shown, msg)
+
+
+class _NonFormattingQueueHandler(logging.handlers.QueueHandler):
+    """
+    The stdlib QueueHandler formats in the calling thread - which would be the trading hot path.
+    Our queue is in-process, so the listener does the formatting. The arguments are snapshotted to text
+    here though: a mutable llama may have changed by the time the listener gets to it.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.args = tuple(a if isinstance(a, (str, int, float)) else str(a) for a in record.args)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[_NonFormattingQueueHandler] = None
+
+
+def start_background_logging(handlers: Sequence[logging.Handler] = None, max_queue: int = 100_000):
+    """
+    Route llama log records through a bounded queue to `handlers` (default: the root logger's) on a
+    background thread. Records which don't fit in the queue are dropped and counted, never waited on.
+    """
+    global _listener, _queue_handler
+    assert _listener is None, "Background logging has already been started"
+
+    if handlers is None:
+        handlers = list(logging.root.handlers)
+
+    q = queue.Queue(maxsize=max_queue)
+    _queue_handler = _NonFormattingQueueHandler(q)
+    _listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+
+    _logger.addHandler(_queue_handler)
+    _logger.propagate = False
+    _listener.start()
+
+
+def stop_background_logging():
+    """
+    Flush whatever is queued to the handlers and go back to logging in the calling thread
+    """
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+
+    _listener.stop()
+    _logger.removeHandler(_queue_handler)
+    _logger.propagate = True
+    _listener = _queue_handler = None
 
 
-def log(obj_or_info: object, level: int = logging.INFO, msg: str = None):
-    qualifier = obj_or_info if isinstance(obj_or_info, str) else type(obj_or_info).__qualname__
-    logging.log(level, "%s:[%s]<msg:%s>", qualifier, obj_or_info, msg)
+def dropped() -> int:
+    return _queue_handler.dropped if _queue_handler else 0
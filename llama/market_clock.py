@@ -0,0 +1,158 @@
+"""
+A cached market clock, so checking whether the market is open doesn't cost a REST round trip every time.
+
+MarketClock fetches the broker's clock (and optionally its trading calendar) once, then works out is_open and
+the time to the next open/close locally. It only fetches again once the cached answer runs out: when the next
+toggle it knew about has passed (or, with a calendar, the last session it knew about has closed), or when the
+TTL expires.
+
+shared() hands out one MarketClock per broker (and settings), so all the TradeExecutor's for an account share
+one cache.
+"""
+from datetime import date, datetime, timedelta, timezone
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+# Alpaca's calendar gives session times in the exchange's local time
+MARKET_TZ = ZoneInfo("America/New_York")
+
+
+class MarketClock:
+    """
+    fetch_clock - returns the broker's clock as a dict with is_open, next_open and next_close
+    fetch_calendar - optional: returns the trading sessions from one date to another as dicts with date, open
+                     and close, EG TradeExecutor._calendar()
+    ttl - seconds before the cache is refreshed even if nothing has run out
+    calendar_days - how far ahead to fetch the calendar
+    now - the current time (timezone aware), for testing
+    """
+
+    def __init__(
+        self,
+        fetch_clock: Callable[[], dict],
+        fetch_calendar: Callable[[date, date], List[dict]] = None,
+        ttl: float = 3_600.0,
+        calendar_days: int = 7,
+        now: Callable[[], datetime] = None,
+    ):
+        assert ttl > 0, "ttl must be positive"
+        assert calendar_days > 0, "calendar_days must be positive"
+        self.fetch_clock = fetch_clock
+        self.fetch_calendar = fetch_calendar
+        self.ttl = timedelta(seconds=ttl)
+        self.calendar_days = calendar_days
+        self.now = now or (lambda: datetime.now(timezone.utc))
+
+        self._lock = threading.Lock()
+        self._clock: Optional[dict] = None
+        self._sessions: List[Tuple[datetime, datetime]] = []
+        self._fetched_at: Optional[datetime] = None
+        self.fetches = 0
+        self.hits = 0
+
+    def __str__(self) -> str:
+        return f"MarketClock[ttl={self.ttl}, calendar={'yes' if self.fetch_calendar else 'no'}]"
+
+    def clock(self) -> Optional[dict]:
+        """
+        The clock as last fetched (None before the first fetch)
+        """
+        with self._lock:
+            return dict(self._clock) if self._clock is not None else None
+
+    def state(self) -> Tuple[bool, datetime]:
+        """
+        Is the market open, and when does that change next
+        """
+        now = self.now()
+        with self._lock:
+            state = None if self._expired(now) else self._local_state(now)
+            if state is not None:
+                self.hits += 1
+                return state
+            self._refresh(now)
+            return self._local_state(now) or self._clock_state()
+
+    def is_open(self) -> bool:
+        return self.state()[0]
+
+    def open_and_toggle_delta(self) -> Tuple[bool, timedelta]:
+        is_open, next_toggle = self.state()
+        return is_open, next_toggle - self.now()
+
+    def invalidate(self):
+        """
+        Drop the cache, EG after a trading halt: the next call fetches again
+        """
+        with self._lock:
+            self._fetched_at = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "fetches": self.fetches,
+                "hits": self.hits,
+                "sessions": len(self._sessions),
+                "fetched_at": self._fetched_at,
+            }
+
+    def _expired(self, now: datetime) -> bool:
+        return self._fetched_at is None or now - self._fetched_at >= self.ttl
+
+    def _clock_state(self) -> Tuple[bool, datetime]:
+        return self._clock["is_open"], min(self._clock["next_open"], self._clock["next_close"])
+
+    def _local_state(self, now: datetime) -> Optional[Tuple[bool, datetime]]:
+        if self._sessions:
+            for open_at, close_at in self._sessions:
+                if now < close_at:
+                    return (True, close_at) if open_at <= now else (False, open_at)
+            # past the last session we know about
+            return None
+
+        is_open, next_toggle = self._clock_state()
+        return (is_open, next_toggle) if now < next_toggle else None
+
+    def _refresh(self, now: datetime):
+        self._clock = self.fetch_clock()
+        if self.fetch_calendar is not None:
+            today = now.astimezone(MARKET_TZ).date()
+            self._sessions = sorted(
+                _session(day) for day in self.fetch_calendar(today, today + timedelta(days=self.calendar_days))
+            )
+        self._fetched_at = now
+        self.fetches += 1
+
+
+def _session(day: dict) -> Tuple[datetime, datetime]:
+    """
+    A calendar day (as AlpacaEntity gives it: date a Timestamp, open and close times) as aware datetimes
+    """
+    d = day["date"].date() if isinstance(day["date"], datetime) else day["date"]
+    return (
+        datetime.combine(d, day["open"], tzinfo=MARKET_TZ),
+        datetime.combine(d, day["close"], tzinfo=MARKET_TZ),
+    )
+
+
+_shared: Dict[tuple, MarketClock] = {}
+_shared_lock = threading.Lock()
+
+
+def shared(broker, make: Callable[[], MarketClock], *settings) -> MarketClock:
+    """
+    The MarketClock for `broker`'s account with these `settings` (EG its ttl), made with `make()` the first time
+    it's asked for: asking with other settings gets another clock rather than one that ignores them.
+    make() (and so the clock) shouldn't hold on to whoever asked, or it would keep them alive.
+    """
+    key = (broker.api_url, broker.api_key, *settings)
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = make()
+        return _shared[key]
+
+
+def clear_shared():
+    with _shared_lock:
+        _shared.clear()
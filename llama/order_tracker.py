@@ -0,0 +1,227 @@
+"""
+Order status from the broker's trade_updates stream, so finding out whether an order filled doesn't mean
+polling the REST API.
+
+An OrderTracker keeps a websocket to the stream open and an in-memory table of the account's orders, indexed by
+client_order_id and by the broker's order id. Callers await the state they're interested in:
+
+    tracker = OrderTracker(broker)
+    await tracker.start()
+    bundle = teena.order("buy", "IBM", 10)
+    order = await tracker.wait_for(client_order_id=bundle["order"]["client_order_id"], timeout=30)
+
+When the connection drops it reconnects (backing off), and every time it (re)connects it resyncs the table from
+the REST API's order list, so updates sent while it was away aren't missed.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import alpaca_trade_api.rest as alpaca_rest
+import pandas as pd
+import websockets
+
+from llama.alpaca_entity import AlpacaEntity
+import llama.logger as logger
+from llama.rest_pool import shared_pool
+from llama.trader import Broker
+
+# an order in one of these won't change again
+FINAL_STATES = frozenset({"filled", "canceled", "expired", "rejected", "replaced", "done_for_day"})
+
+
+def stream_url(api_url: str) -> str:
+    """
+    EG: https://paper-api.alpaca.markets -> wss://paper-api.alpaca.markets/stream
+    """
+    if api_url.startswith("https://"):
+        api_url = "wss://" + api_url[len("https://") :]
+    elif api_url.startswith("http://"):
+        api_url = "ws://" + api_url[len("http://") :]
+    return api_url.rstrip("/") + "/stream"
+
+
+def _timestamp(value) -> pd.Timestamp:
+    """
+    updated_at as an aware timestamp: the stream has it as ISO text, the REST API (through AlpacaEntity) as a
+    Timestamp, and their str()s don't compare
+    """
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts
+
+
+class OrderTracker:
+    """
+    broker - whose orders to track
+    url - the stream's websocket URL (by default worked out from broker.api_url)
+    reconnect_delay, max_reconnect_delay - seconds to wait before reconnecting: doubles on each failure in a row
+    resync_limit - how many of the latest orders to fetch when resyncing
+    """
+
+    def __init__(
+        self,
+        broker: Broker,
+        url: str = None,
+        reconnect_delay: float = 0.5,
+        max_reconnect_delay: float = 30.0,
+        resync_limit: int = 500,
+    ):
+        self.broker = broker
+        self.url = url or stream_url(broker.api_url)
+        self.api = shared_pool.client(broker)
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.resync_limit = resync_limit
+
+        self.orders: Dict[str, dict] = {}
+        self._client_ids: Dict[str, str] = {}
+        self._waiters: List[Tuple[str, str, frozenset, asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._connected: Optional[asyncio.Event] = None
+
+        self.connects = 0
+        self.updates = 0
+        self.resyncs = 0
+
+    def __str__(self) -> str:
+        return f"OrderTracker[{self.broker.name}, {len(self.orders)} orders]"
+
+    async def start(self, timeout: float = 10.0):
+        """
+        Connect and resync, in the background. Waits up to `timeout` for the first connection.
+        """
+        assert self._task is None, "Already started"
+        self._connected = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._connected.clear()
+        for *_, future in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected is not None and self._connected.is_set()
+
+    def get(self, client_order_id: str = None, external_order_id: str = None) -> Optional[dict]:
+        """
+        The order as last heard of (None if it hasn't been)
+        """
+        assert client_order_id or external_order_id, "Which order?"
+        if client_order_id is None:
+            client_order_id = self._client_ids.get(str(external_order_id))
+        return self.orders.get(client_order_id)
+
+    async def wait_for(
+        self,
+        client_order_id: str = None,
+        external_order_id: str = None,
+        states: Sequence[str] = FINAL_STATES,
+        timeout: float = None,
+    ) -> dict:
+        """
+        Wait for the order to reach one of `states` - or a final state, which it won't leave: check the status
+        of what comes back. Raises asyncio.TimeoutError after `timeout` seconds.
+        """
+        assert client_order_id or external_order_id, "Which order?"
+        states = frozenset(states) | FINAL_STATES
+        order = self.get(client_order_id, external_order_id)
+        if order is not None and order["status"] in states:
+            return order
+
+        key = ("client_order_id", client_order_id) if client_order_id else ("id", str(external_order_id))
+        future = asyncio.get_running_loop().create_future()
+        waiter = (*key, states, future)
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _update(self, order: dict) -> bool:
+        """
+        Record `order` unless what we have is newer. Returns whether it was recorded.
+        """
+        client_order_id = order["client_order_id"]
+        # parsed up front, so an order with a bad updated_at raises before it's recorded, not on every later update
+        updated_at = _timestamp(order["updated_at"]) if order.get("updated_at") else None
+        known = self.orders.get(client_order_id)
+        if known is not None and known.get("updated_at") and updated_at is not None:
+            if updated_at < _timestamp(known["updated_at"]):
+                return False
+        self.orders[client_order_id] = order
+        self._client_ids[str(order["id"])] = client_order_id
+        self.updates += 1
+
+        for waiter in list(self._waiters):
+            field, value, states, future = waiter
+            if str(order.get(field)) == value and order["status"] in states and not future.done():
+                future.set_result(order)
+                self._waiters.remove(waiter)
+        return True
+
+    def _handle(self, message):
+        msg = json.loads(message)
+        if msg.get("stream") == "trade_updates":
+            self._update(msg["data"]["order"])
+
+    async def _resync(self):
+        loop = asyncio.get_running_loop()
+        orders = await loop.run_in_executor(
+            None, lambda: self.api.list_orders(status="all", limit=self.resync_limit)
+        )
+        for order in orders:
+            self._update(AlpacaEntity(order).as_dict())
+        self.resyncs += 1
+
+    async def _handshake(self, ws):
+        await ws.send(
+            json.dumps(
+                {
+                    "action": "authenticate",
+                    "data": {"key_id": self.broker.api_key, "secret_key": self.broker.api_secret},
+                }
+            )
+        )
+        reply = json.loads(await ws.recv())
+        if reply.get("data", {}).get("status") != "authorized":
+            raise ConnectionError(f"trade_updates stream didn't authorize us: {reply}")
+        await ws.send(json.dumps({"action": "listen", "data": {"streams": ["trade_updates"]}}))
+        reply = json.loads(await ws.recv())
+        if "trade_updates" not in reply.get("data", {}).get("streams", []):
+            raise ConnectionError(f"trade_updates stream didn't let us listen: {reply}")
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with websockets.connect(self.url) as ws:
+                    await self._handshake(ws)
+                    self.connects += 1
+                    # only once subscribed, so no update can fall between the resync and the stream
+                    await self._resync()
+                    self._connected.set()
+                    delay = self.reconnect_delay
+                    async for message in ws:
+                        # one bad frame shouldn't take the stream down with it
+                        try:
+                            self._handle(message)
+                        except Exception as e:
+                            logger.log(self, level=logging.WARNING, msg=f"bad trade_updates message: {e!r}")
+            except (OSError, websockets.WebSocketException, alpaca_rest.APIError) as e:
+                logger.log(self, level=logging.WARNING, msg=f"trade_updates connection lost: {e!r}")
+            self._connected.clear()
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, self.max_reconnect_delay)
@@ -1,28 +1,317 @@
+from dataclasses import dataclass
+import datetime
+import functools
+import itertools
 import os
+import threading
+import time
 from sqlalchemy import (
     create_engine,
+    event,
+    inspect,
     MetaData,
     Table,
     Column,
+    Computed,
+    Index,
     String,
+    Text,
+    Integer,
+    Float,
+    Boolean,
     JSON,
     DateTime,
+    LargeBinary,
+    TypeDecorator,
 )
-from sqlalchemy import insert as sqla_insert, select as sqla_select
+from sqlalchemy import (
+    insert as sqla_insert,
+    select as sqla_select,
+    union_all,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.future import Engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import func
-from typing import Sequence, Type, Dict
+from sqlalchemy.sql.functions import FunctionElement
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 from uuid import UUID
 
 import llama.env as env
 from llama.abstract_base import LlamaABC
+from llama.batch import LlamaBatch
+from llama.cache import IdentityMap, SeenSet
+from llama.codec import Codec, CompressedCodec
+from llama.schema import declared_fields
+
+
+@dataclass
+class SQLiteProfile:
+    """
+    Opt-in performance settings for a file-backed SQLite database: WAL (so readers don't block the writer
+    or each other), a relaxed-but-safe-in-WAL synchronous level, a bigger page cache and mmap'ed reads.
+    """
+
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    cache_size: int = -64_000  # negative means KiB, so ~64MB
+    mmap_size: int = 256 * 2**20
+    temp_store: str = "MEMORY"
+    busy_timeout: int = 5_000  # ms
+    # reader connections kept open, and how many more may be opened when they're all busy (EG by nested or
+    # concurrent stream() calls). Past readers + reader_overflow, a read waits for a free connection.
+    readers: int = 4
+    reader_overflow: int = 8
+
+    def pragmas(self, read_only: bool = False) -> List[str]:
+        pragmas = [
+            f"PRAGMA journal_mode={self.journal_mode}",
+            f"PRAGMA synchronous={self.synchronous}",
+            f"PRAGMA cache_size={self.cache_size}",
+            f"PRAGMA mmap_size={self.mmap_size}",
+            f"PRAGMA temp_store={self.temp_store}",
+            f"PRAGMA busy_timeout={self.busy_timeout}",
+        ]
+        if read_only:
+            pragmas.append("PRAGMA query_only=ON")
+        return pragmas
 
 
-def engine(db_uri: str = None, echo: bool = True) -> Engine:
+def engine(
+    db_uri: str = None,
+    echo: bool = None,
+    profile: SQLiteProfile = None,
+    read_only: bool = False,
+) -> Engine:
+    """
+    echo - log every SQL statement. Defaults to on, except with a profile: echoing costs more than it tunes.
+    profile - tune a file-backed SQLite database. The engine is then either the single writer
+              (a one connection pool) or, with read_only, a pool of `profile.readers` reader connections
+              (plus up to `profile.reader_overflow` more).
+    """
     if db_uri is None:
         db_uri = os.environ.get("DB_URI")
+    if echo is None:
+        echo = profile is None
+
+    if profile is None:
+        return create_engine(db_uri, echo=echo, future=True)
+
+    assert (
+        ":memory:" not in db_uri
+    ), "SQLiteProfile needs a file-backed database"
+
+    eng = create_engine(
+        db_uri,
+        echo=echo,
+        future=True,
+        poolclass=QueuePool,
+        pool_size=profile.readers if read_only else 1,
+        max_overflow=profile.reader_overflow if read_only else 0,
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(eng, "connect")
+    def apply_profile(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in profile.pragmas(read_only=read_only):
+            cursor.execute(pragma)
+        cursor.close()
+
+    return eng
+
+
+STORAGE_JSON = "json"
+STORAGE_GENERATED = "generated"
+STORAGE_COLUMNAR = "columnar"
+
+
+class UTCDateTime(TypeDecorator):
+    """
+    Timezone aware datetimes on SQLite: stored as naive UTC, handed back as UTC
+    """
+
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        return _utc_naive(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return value.replace(tzinfo=datetime.timezone.utc)
+
+
+class UUIDText(TypeDecorator):
+    """
+    UUID fields: stored (and compared) as their 36-char text, handed back as UUIDs
+    """
+
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else str(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else UUID(value)
+
+
+class GeneratedDateTime(TypeDecorator):
+    """
+    Datetime fields of a STORAGE_GENERATED table: json_extract() hands back str(datetime) of the aware UTC
+    datetime in the event, so that's what gets compared against - and parsed back into a datetime.
+    """
+
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if not isinstance(value, datetime.datetime):
+            return value
+        return str(_as_utc(value))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else datetime.datetime.fromisoformat(value)
+
+
+def _column_type(typ: type, generated: bool = False):
+    if typ is bool:
+        return Boolean
+    if typ is int:
+        return Integer
+    if typ is float:
+        return Float
+    if typ is str:
+        return String
+    if typ is UUID:
+        return UUIDText
+    if typ is datetime.datetime:
+        return GeneratedDateTime if generated else UTCDateTime
+    return JSON
+
+
+def _json_path(field: str) -> str:
+    return f"json_extract(event, '$.{field}')"
+
+
+def declared_columns(model: Type) -> Dict[str, type]:
+    """
+    The columns a model's declared fields get, by field (created_at included for a timestamped model)
+    """
+    declared = {
+        k: v for k, v in declared_fields(model).items() if k != "table_id"
+    }
+    if model.has_timestamp():
+        declared.setdefault("created_at", datetime.datetime)
+    return declared
+
+
+class utc_now(FunctionElement):
+    """
+    saved_at's server default. On SQLite, CURRENT_TIMESTAMP has no fraction of a second, so it wouldn't
+    compare (as text) against the microsecond datetimes SQLAlchemy binds: the same format is used instead.
+    """
+
+    type = DateTime(timezone=True)
+    name = "utc_now"
+    inherit_cache = True
+
+
+@compiles(utc_now)
+def _compile_utc_now(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utc_now, "sqlite")
+def _compile_utc_now_sqlite(element, compiler, **kw):
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+def _utc_naive(dt: datetime.datetime) -> datetime.datetime:
+    # SQLite keeps saved_at as naive UTC text, so compare against the same
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _as_utc(dt: Union[datetime.datetime, str]) -> datetime.datetime:
+    if isinstance(dt, str):
+        dt = datetime.datetime.fromisoformat(dt)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.astimezone(datetime.timezone.utc)
+
+
+PARTITION_DAY = "day"
+PARTITION_WEEK = "week"
+
+_PARTITION_SPANS = {
+    PARTITION_DAY: datetime.timedelta(days=1),
+    PARTITION_WEEK: datetime.timedelta(weeks=1),
+}
+
+
+def _partition_start(
+    period: str, dt: Union[datetime.datetime, str]
+) -> datetime.datetime:
+    """
+    Midnight UTC starting the day (or Monday starting the week) that `dt` falls in
+    """
+    start = _as_utc(dt).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == PARTITION_WEEK:
+        start -= datetime.timedelta(days=start.weekday())
+    return start
+
+
+ON_CONFLICT_FAIL = "fail"
+ON_CONFLICT_IGNORE = "ignore"
+ON_CONFLICT_REPLACE = "replace"
 
-    return create_engine(db_uri, echo=echo, future=True)
+
+@dataclass
+class InsertReport:
+    # rows written: new ones, plus (with ON_CONFLICT_REPLACE) the ones replacing a stored row
+    inserted: int
+    # duplicates of stored rows that were left alone
+    skipped: int
+    # how many of the skipped never reached SQL, thanks to the seen-set
+    filtered: int = 0
+
+
+@dataclass
+class ChunkReport:
+    index: int
+    inserted: int
+    total_inserted: int
+    # (stream position, error) for rows that failed to transform;
+    # (id, error) for rows that failed to insert
+    skipped: List[Tuple[Any, Exception]]
+    seconds: float
+    # rows already stored (ON_CONFLICT_IGNORE only)
+    duplicates: int = 0
+
+
+_ON_CONFLICTS = (ON_CONFLICT_FAIL, ON_CONFLICT_IGNORE, ON_CONFLICT_REPLACE)
 
 
 class ORM:
@@ -31,57 +320,513 @@ class ORM:
         eng: Engine = None,
         db_uri: str = None,
         variant="sqlite",
-        echo: bool = True,
+        echo: bool = None,
+        codec: Codec = None,
+        binary_ids: bool = False,
+        profile: SQLiteProfile = None,
+        cache_size: int = 0,
+        dedup_size: int = 0,
     ):
+        """
+        dedup_size - when positive, remember up to that many stored ids so that inserts with
+                     ON_CONFLICT_IGNORE drop known duplicates before they reach SQL
+        cache_size - when positive, keep an identity map (LRU) of up to that many immutable llamas:
+                     retrieve() serves hits from it and only queries for misses, insert() warms it.
+        profile - SQLite performance settings (see SQLiteProfile). Writes then go through a single writer
+                  connection while reads (retrieve, stream) get a pool of their own connections.
+                  SQL echo defaults to off with a profile (see engine()).
+        codec - when given, events are stored as that codec's bytes in a binary column.
+                When None, events go in a JSON column as as_event_json() text, as they always have.
+                A CompressedCodec here is copied for every table, each keeping its own dictionaries.
+        binary_ids - store ids as 16-byte BLOBs rather than 36-char strings
+        """
         assert variant == "sqlite", "Currently can only handle SQLite"
 
         assert not (
-            engine and db_uri
+            eng and db_uri
         ), "If you specify the engine, please don't give a DB URI"
+        assert not (
+            eng and profile
+        ), "If you specify the engine, please configure it yourself"
 
-        self.engine = engine(db_uri=db_uri, echo=echo) if eng is None else eng
+        self.engine = (
+            engine(db_uri=db_uri, echo=echo, profile=profile)
+            if eng is None
+            else eng
+        )
+        self.read_engine = (
+            engine(db_uri=db_uri, echo=echo, profile=profile, read_only=True)
+            if profile is not None
+            else self.engine
+        )
 
         self.metadata = MetaData()
+        # partitioned models' tables are only templates for their partitions, so never get created
+        self._templates = MetaData()
 
         self.tables = {}
+        self.storage = {}
+        self._optional_columns = {}
+        self._insert_columns = {}
+        self._insert_statements = {}
+
+        self.partitioning = {}
+        self._partitions = {}
+        self._partition_lock = threading.RLock()
+
+        self.codec = codec
+        self.codecs = {}
+        self._dictionaries = None
 
-    def add_table(self, model: Type, *columns: Sequence[Column]) -> Table:
+        self.binary_ids = binary_ids
+
+        self.cache = IdentityMap(cache_size) if cache_size else None
+        self.seen = SeenSet(dedup_size) if dedup_size else None
+
+    def add_table(
+        self,
+        model: Type,
+        *columns: Sequence[Column],
+        storage: str = STORAGE_JSON,
+        indexes: Sequence[Union[str, Sequence[str]]] = (),
+        partition: str = None,
+        codec: Codec = None,
+    ) -> Table:
+        """
+        storage - how the event itself is kept:
+            STORAGE_JSON - the whole event in the `event` column, plus whatever `columns` are given (the default)
+            STORAGE_GENERATED - the event as JSON text, plus a virtual generated column per declared field
+                                (see schema.declared_fields) so those can be indexed without storing them twice
+            STORAGE_COLUMNAR - no event column at all: one typed column per declared field.
+                               Every field a llama has must then be declared.
+        indexes - columns to index: a name, or a tuple of names for a composite index
+                  (EG: "saved_at", ("symbol", "created_at"))
+        partition - PARTITION_DAY or PARTITION_WEEK: keep rows in one table per day (or week) of created_at,
+                    EG quotes_p20210301, each created on its first write. Range queries on created_at only
+                    touch the partitions they overlap, and drop_partitions() retires old ones a table at a time.
+        codec - this table's event codec, instead of the ORM's. EG CompressedCodec(COMPRESSION_ZSTD),
+                and then train_dictionary() once there are some events to learn from.
+        """
         assert issubclass(
             model, LlamaABC
         ), f"Don't know how to model a non-Llama type {model}"
+        assert storage in (
+            STORAGE_JSON,
+            STORAGE_GENERATED,
+            STORAGE_COLUMNAR,
+        ), f"Unknown storage {storage}"
+        codec = codec or self.codec
+        if isinstance(codec, CompressedCodec) and codec is self.codec:
+            codec = CompressedCodec(codec.algorithm, codec.inner, codec.level)
+        assert not (
+            storage == STORAGE_GENERATED and codec is not None
+        ), "Generated columns need events stored as JSON text, not codec bytes"
+        assert not (
+            isinstance(codec, CompressedCodec)
+            and any(c is codec for c in self.codecs.values())
+        ), "Each table needs a CompressedCodec of its own (for its own dictionaries)"
+        assert (
+            partition is None or partition in _PARTITION_SPANS
+        ), f"Unknown partition {partition}"
+        assert (
+            partition is None or model.has_timestamp()
+        ), "Partitions are by created_at, so the llama needs a timestamp"
+
+        name = model.db_table_name()
+        declared = declared_columns(model) if storage != STORAGE_JSON else {}
+
+        if storage == STORAGE_JSON:
+            event = [
+                Column(
+                    "event",
+                    JSON if codec is None else LargeBinary,
+                    nullable=False,
+                )
+            ]
+        elif storage == STORAGE_GENERATED:
+            event = [Column("event", Text, nullable=False)]
+        else:
+            # NULL is both "unset" and "set to None": this tells them apart
+            event = [Column("unset_fields", JSON)]
 
-        self.tables[model] = Table(
-            model.db_table_name(),
-            self.metadata,
+        projected = [
             Column(
-                "id", String(36), primary_key=True
+                field,
+                _column_type(typ, generated=storage == STORAGE_GENERATED),
+                *(
+                    [Computed(_json_path(field), persisted=False)]
+                    if storage == STORAGE_GENERATED
+                    else []
+                ),
+            )
+            for field, typ in declared.items()
+            if not (partition and field == "created_at")
+        ]
+        # the routing key is always a real column of a partitioned table
+        routing = (
+            [Column("created_at", UTCDateTime, nullable=False)]
+            if partition
+            else []
+        )
+
+        table = Table(
+            name,
+            self._templates if partition else self.metadata,
+            Column(
+                "id",
+                LargeBinary(16) if self.binary_ids else String(36),
+                primary_key=True,
             ),  # should use native uuid type for postgres
             Column(
-                "saved_at", DateTime(timezone=True), server_default=func.now()
+                "saved_at", DateTime(timezone=True), server_default=utc_now()
             ),
-            Column("event", JSON, nullable=False),
+            *event,
+            *projected,
+            *routing,
             *columns,
         )
-        return self.tables[model]
+        for index in indexes:
+            index = (index,) if isinstance(index, str) else tuple(index)
+            Index(
+                f"ix_{name}_{'_'.join(index)}", *(table.c[col] for col in index)
+            )
+
+        self.tables[model] = table
+        self.storage[model] = storage
+        self.codecs[model] = codec
+        if isinstance(codec, CompressedCodec):
+            self._dictionary_table()
+            codec.dictionary_loader = functools.partial(
+                self._load_dictionary, name
+            )
+        if partition:
+            self.partitioning[model] = partition
+            self._partitions[model] = {}
+        self._optional_columns[model] = (
+            frozenset(declared) if storage == STORAGE_COLUMNAR else frozenset()
+        )
+        self._insert_columns[model] = [
+            col.name
+            for col in table.columns
+            if col.name not in ORM.exclude_columns and col.computed is None
+        ]
+        return table
 
     def bootstrap_db(self):
-        self.metadata.create_all(self.engine, checkfirst=True)
+        with self.engine.begin() as conn:
+            self.create_tables(conn)
+
+    def create_tables(self, conn):
+        """
+        Create the tables, and pick up the partitions already in the database
+        """
+        self.metadata.create_all(conn, checkfirst=True)
+        if self._dictionaries is not None:
+            self._load_dictionaries(conn)
+        if not self.partitioning:
+            return
+
+        existing = inspect(conn).get_table_names()
+        for model in self.partitioning:
+            prefix = f"{self.tables[model].name}_p"
+            for name in existing:
+                suffix = name[len(prefix) :]
+                if not (
+                    name.startswith(prefix)
+                    and len(suffix) == 8
+                    and suffix.isdigit()
+                ):
+                    continue
+                start = datetime.datetime.strptime(suffix, "%Y%m%d").replace(
+                    tzinfo=datetime.timezone.utc
+                )
+                self._partitions[model][start] = self._partition_table(
+                    model, start
+                )
+
+    def _dictionary_table(self) -> Table:
+        if self._dictionaries is None:
+            self._dictionaries = Table(
+                "llama_dictionaries",
+                self.metadata,
+                Column("table_name", String, primary_key=True),
+                Column("dictionary_id", Integer, primary_key=True),
+                Column("algorithm", String, nullable=False),
+                Column("dictionary", LargeBinary, nullable=False),
+                Column(
+                    "saved_at",
+                    DateTime(timezone=True),
+                    server_default=utc_now(),
+                ),
+            )
+        return self._dictionaries
+
+    def _compressed_codecs(self) -> Dict[str, CompressedCodec]:
+        return {
+            self.tables[model].name: codec
+            for model, codec in self.codecs.items()
+            if isinstance(codec, CompressedCodec)
+        }
+
+    def _load_dictionaries(self, conn):
+        """
+        Give every compressed table's codec its stored dictionaries, compressing with the newest
+        """
+        table = self._dictionaries
+        codecs = self._compressed_codecs()
+        rows = conn.execute(
+            sqla_select(table)
+            .where(table.c.table_name.in_(list(codecs)))
+            .order_by(table.c.dictionary_id)
+        ).mappings()
+        for row in rows:
+            codec = codecs[row["table_name"]]
+            assert (
+                row["algorithm"] == codec.algorithm
+            ), f"{row['table_name']} dictionaries are for {row['algorithm']}, not {codec.algorithm}"
+            codec.add_dictionary(row["dictionary_id"], row["dictionary"])
+
+    def _load_dictionary(
+        self, table_name: str, dictionary_id: int, conn=None
+    ) -> Optional[bytes]:
+        if conn is None:
+            with self.read_engine.connect() as conn:
+                return self._load_dictionary(table_name, dictionary_id, conn)
+        table = self._dictionaries
+        return conn.execute(
+            sqla_select(table.c.dictionary).where(
+                table.c.table_name == table_name,
+                table.c.dictionary_id == dictionary_id,
+            )
+        ).scalar()
+
+    def load_missing_dictionaries(
+        self, conn, model: Type, events: Iterable[bytes]
+    ):
+        """
+        Give `model`'s codec, through `conn`, the dictionaries `events` were compressed with that it hasn't
+        got yet (EG trained by another process) - for when its own dictionary_loader can't run.
+        """
+        codec = self.codecs[model]
+        if not isinstance(codec, CompressedCodec):
+            return
+        missing = {codec.dictionary_of(event) for event in events}
+        missing -= codec.dictionaries.keys() | {0}
+        name = self.tables[model].name
+        for dictionary_id in sorted(missing):
+            dictionary = self._load_dictionary(name, dictionary_id, conn)
+            if dictionary is not None:
+                codec.add_dictionary(dictionary_id, dictionary, use=False)
+
+    def train_dictionary(
+        self,
+        model: Type,
+        samples: Iterable[LlamaABC] = None,
+        size: int = 16 * 1024,
+        sample_size: int = 1_000,
+    ) -> int:
+        """
+        Train a compression dictionary for a table stored with a CompressedCodec, save it alongside the
+        tables and compress new events with it. Events stored before keep decompressing with their own.
+
+        samples - llamas to learn from. By default: the `sample_size` most recently saved ones.
+
+        Returns the new dictionary's id.
+        """
+        codec = self.codecs.get(model)
+        assert isinstance(
+            codec, CompressedCodec
+        ), f"{model} isn't stored with a CompressedCodec"
+
+        if samples is None:
+            samples = itertools.chain.from_iterable(
+                self.query(
+                    model,
+                    order_by="saved_at",
+                    descending=True,
+                    limit=sample_size,
+                )
+            )
+        dictionary = codec.train((obj.as_dict() for obj in samples), size)
+
+        table = self._dictionaries
+        name = self.tables[model].name
+        with self.engine.begin() as conn:
+            latest = conn.execute(
+                sqla_select(func.max(table.c.dictionary_id)).where(
+                    table.c.table_name == name
+                )
+            ).scalar()
+            dictionary_id = (latest or 0) + 1
+            conn.execute(
+                sqla_insert(table),
+                [
+                    {
+                        "table_name": name,
+                        "dictionary_id": dictionary_id,
+                        "algorithm": codec.algorithm,
+                        "dictionary": dictionary,
+                    }
+                ],
+            )
+        codec.add_dictionary(dictionary_id, dictionary)
+        return dictionary_id
+
+    def partitions(self, model: Type) -> Dict[datetime.datetime, Table]:
+        """
+        A partitioned model's partition tables by their start, oldest first
+        """
+        assert (
+            model in self.partitioning
+        ), f"Model {model} isn't partitioned"
+        return dict(sorted(self._partitions[model].items()))
+
+    def _partition_table(self, model: Type, start: datetime.datetime) -> Table:
+        template = self.tables[model]
+        name = f"{template.name}_p{start:%Y%m%d}"
+        with self._partition_lock:
+            table = self.metadata.tables.get(name)
+            if table is None:
+                table = template.to_metadata(self.metadata, name=name)
+                # index names are per database, not per table
+                for index in table.indexes:
+                    index.name = index.name.replace(
+                        f"ix_{template.name}_", f"ix_{name}_", 1
+                    )
+            return table
+
+    def drop_partitions(
+        self, model: Type, before: datetime.datetime, archive: str = None
+    ) -> List[str]:
+        """
+        Retention: drop each partition of `model` whose rows were all created before `before`.
+        A partition goes as a unit (DROP TABLE), never row by row.
+
+        archive - path of a SQLite file to copy those partitions into first (created if need be)
+
+        Returns the names of the dropped tables.
+        """
+        assert (
+            model in self.partitioning
+        ), f"Model {model} isn't partitioned"
+
+        span = _PARTITION_SPANS[self.partitioning[model]]
+        cutoff = _as_utc(before)
+        doomed = [
+            (start, table)
+            for start, table in self.partitions(model).items()
+            if start + span <= cutoff
+        ]
+        if not doomed:
+            return []
+
+        with self.engine.connect() as conn:
+            if archive is not None:
+                conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (archive,))
+            try:
+                for start, table in doomed:
+                    if archive is not None:
+                        conn.exec_driver_sql(
+                            f'CREATE TABLE archive."{table.name}" AS SELECT * FROM main."{table.name}"'
+                        )
+                    table.drop(conn)
+                    del self._partitions[model][start]
+                    for on_conflict in _ON_CONFLICTS:
+                        self._insert_statements.pop(
+                            (table.name, on_conflict), None
+                        )
+                    self.metadata.remove(table)
+                conn.commit()
+            finally:
+                if archive is not None:
+                    conn.exec_driver_sql("DETACH DATABASE archive")
+
+        if self.cache is not None:
+            self.cache.clear()
+        if self.seen is not None:
+            self.seen.clear()
+        return [table.name for _, table in doomed]
+
+    def dispose(self):
+        self.engine.dispose()
+        if self.read_engine is not self.engine:
+            self.read_engine.dispose()
 
     exclude_columns = ["saved_at"]
 
-    def transform(self, obj: LlamaABC) -> dict:
+    def transform(self, obj: LlamaABC, model: Type = None) -> dict:
+        model = model or type(obj)
         d = obj.as_dict()
-        d["event"] = obj.as_event_json()
-        d["id"] = str(d["table_id"])
+        if self.storage[model] == STORAGE_COLUMNAR:
+            optional = self._optional_columns[model]
+            undeclared = d.keys() - optional - {"table_id"}
+            assert (
+                not undeclared
+            ), f"{model} fields {undeclared} aren't declared, so a columnar table can't store them"
+            d["unset_fields"] = sorted(optional - d.keys()) or None
+        else:
+            optional = ()
+            d["event"] = self.serialize(obj, model)
+        d["id"] = self.id_value(d["table_id"])
 
         return {
-            col.name: d[col.name]
-            for col in self.tables[type(obj)].columns
-            if col.name not in ORM.exclude_columns
-            # name: d[name] for col in self.tables[type(obj)].columns if (name := col.name) not in ORM.exclude_columns
+            name: d.get(name) if name in optional else d[name]
+            for name in self._insert_columns[model]
         }
 
-    def insert(self, model: Type, *objs: Sequence[LlamaABC]):
+    def id_value(self, table_id: UUID) -> Union[str, bytes]:
+        if not self.binary_ids:
+            return str(table_id)
+        if not isinstance(table_id, UUID):
+            table_id = UUID(str(table_id))
+        return table_id.bytes
+
+    def id_from_value(self, value: Union[str, bytes]) -> UUID:
+        if self.binary_ids:
+            return UUID(bytes=bytes(value))
+        return UUID(value)
+
+    def serialize(
+        self, obj: LlamaABC, model: Type = None
+    ) -> Union[str, bytes]:
+        codec = self.codecs[model or type(obj)]
+        if codec is None:
+            return obj.as_event_json()
+        return obj.as_event_bytes(codec)
+
+    def transform_batch(self, batch: LlamaBatch) -> List[dict]:
+        model = batch.model
+        if self.storage[model] == STORAGE_COLUMNAR:
+            return [self.transform(obj, model) for obj in batch]
+
+        columns = self._insert_columns[model]
+        codec = self.codecs[model]
+        events = (
+            batch.as_event_json()
+            if codec is None
+            else batch.as_event_bytes(codec)
+        )
+        rows = []
+        for d, payload in zip(batch.iter_dicts(), events):
+            d["event"] = payload
+            d["id"] = self.id_value(d["table_id"])
+            rows.append({name: d[name] for name in columns})
+        return rows
+
+    def insert(
+        self,
+        model: Type,
+        *objs: Union[Sequence[LlamaABC], LlamaBatch],
+        on_conflict: str = ON_CONFLICT_FAIL,
+    ) -> InsertReport:
+        """
+        Insert llamas of type `model`, given either one by one or as a single LlamaBatch
+
+        on_conflict - what to do with a llama whose id is already stored:
+            ON_CONFLICT_FAIL - raise, rolling back the whole insert (the default)
+            ON_CONFLICT_IGNORE - keep the stored row and skip this one, EG when replaying re-delivered events
+            ON_CONFLICT_REPLACE - overwrite the stored row
+        """
         assert issubclass(
             model, LlamaABC
         ), f"Don't know how to model a non-Llama type {model}"
@@ -89,23 +834,318 @@ class ORM:
             model in self.tables
         ), f"Model {model} never got added as an ORM table (don't forget 'add_table()')"
         assert objs, "Gotta have at least one object to insert"
-        for obj in objs:
-            assert isinstance(
-                obj, model
-            ), f"obj is of type {type(obj)} but should be of type {model}"
+        assert (
+            on_conflict in _ON_CONFLICTS
+        ), f"Unknown on_conflict {on_conflict}"
 
-        with self.engine.begin() as transaction:
-            transaction.execute(
-                sqla_insert(
-                    self.tables[model], [self.transform(obj) for obj in objs]
+        is_batch = len(objs) == 1 and isinstance(objs[0], LlamaBatch)
+        if is_batch:
+            batch = objs[0]
+            assert (
+                batch.model is model
+            ), f"batch is of {batch.model} but should be of {model}"
+            assert len(batch), "Gotta have at least one object to insert"
+            rows = self.transform_batch(batch)
+        else:
+            for obj in objs:
+                assert isinstance(
+                    obj, model
+                ), f"obj is of type {type(obj)} but should be of type {model}"
+            rows = [self.transform(obj) for obj in objs]
+
+        keep = self.unseen(model, rows, on_conflict)
+        filtered = len(rows) - len(keep)
+        if filtered:
+            rows = [rows[i] for i in keep]
+            objs = objs if is_batch else [objs[i] for i in keep]
+
+        written = 0
+        if rows:
+            with self.engine.begin() as transaction:
+                written = self.write_rows(
+                    transaction, model, rows, on_conflict
                 )
+            self.mark_stored(model, rows)
+
+        if not is_batch:
+            self.remember(model, objs, on_conflict, written)
+        return InsertReport(
+            inserted=written,
+            skipped=len(rows) - written + filtered,
+            filtered=filtered,
+        )
+
+    def insert_many(
+        self,
+        model: Type,
+        objs: Iterable[LlamaABC],
+        chunk_size: int = 10_000,
+        progress: Callable[[ChunkReport], None] = None,
+        skip_bad_rows: bool = False,
+        on_conflict: str = ON_CONFLICT_FAIL,
+    ) -> int:
+        """
+        Streaming bulk insert: pulls `chunk_size` llamas at a time from any iterable (generators welcome),
+        and commits each chunk in its own transaction with one executemany of a single insert statement.
+        Only one chunk is ever held in memory.
+
+        progress - called with a ChunkReport after every chunk
+        skip_bad_rows - a row that fails to transform, or a chunk that fails to insert, doesn't stop the load:
+                        a failed chunk is retried row by row and the rows that still fail are reported as skipped.
+                        Otherwise the first failure is raised (chunks already committed stay committed).
+        on_conflict - as for insert(); with ON_CONFLICT_IGNORE a replayed backlog loads at full speed
+
+        Returns the number of rows inserted.
+        """
+        assert issubclass(
+            model, LlamaABC
+        ), f"Don't know how to model a non-Llama type {model}"
+        assert (
+            model in self.tables
+        ), f"Model {model} never got added as an ORM table (don't forget 'add_table()')"
+        assert chunk_size > 0, "chunk_size must be positive"
+        assert (
+            on_conflict in _ON_CONFLICTS
+        ), f"Unknown on_conflict {on_conflict}"
+
+        objs = iter(objs)
+        total = 0
+        position = 0
+        for index in itertools.count():
+            chunk = list(itertools.islice(objs, chunk_size))
+            if not chunk:
+                break
+
+            start = time.perf_counter()
+            good, rows, skipped = [], [], []
+            for obj in chunk:
+                try:
+                    assert isinstance(
+                        obj, model
+                    ), f"obj is of type {type(obj)} but should be of type {model}"
+                    rows.append(self.transform(obj, model))
+                    good.append(obj)
+                except Exception as e:
+                    if not skip_bad_rows:
+                        raise
+                    skipped.append((position, e))
+                position += 1
+
+            keep = self.unseen(model, rows, on_conflict)
+            filtered = len(rows) - len(keep)
+            if filtered:
+                good = [good[i] for i in keep]
+                rows = [rows[i] for i in keep]
+
+            stored, written = self._execute_chunk(
+                model, good, rows, skipped, skip_bad_rows, on_conflict
             )
+            self.remember(model, stored, on_conflict, written)
+            total += written
+            if progress is not None:
+                progress(
+                    ChunkReport(
+                        index=index,
+                        inserted=written,
+                        total_inserted=total,
+                        skipped=skipped,
+                        seconds=time.perf_counter() - start,
+                        duplicates=len(stored) - written + filtered,
+                    )
+                )
+        return total
+
+    def write_rows(
+        self,
+        conn,
+        model: Type,
+        rows: List[dict],
+        on_conflict: str = ON_CONFLICT_FAIL,
+    ) -> int:
+        """
+        Insert transformed rows within `conn`'s transaction.
+        Rows of a partitioned model go to their partitions, which get created as needed.
+        (An id is only unique within its partition, which is where a re-delivered event lands again.)
+
+        Returns the number of rows written (see InsertReport.inserted).
+        """
+        period = self.partitioning.get(model)
+        if period is None:
+            stmt = self._insert_statement(self.tables[model], on_conflict)
+            return conn.execute(stmt, rows).rowcount
 
-    def hydrate(self, model: Type, d: dict) -> LlamaABC:
-        return model.from_event_json(d["event"])
+        by_start = {}
+        for row in rows:
+            start = _partition_start(period, row["created_at"])
+            by_start.setdefault(start, []).append(row)
+
+        known = self._partitions[model]
+        created = []
+        written = 0
+        try:
+            for start, partition_rows in by_start.items():
+                # without a profile each insert has a connection of its own:
+                # only one of them may create a given partition
+                with self._partition_lock:
+                    table = known.get(start)
+                    if table is None:
+                        table = self._partition_table(model, start)
+                        table.create(conn, checkfirst=True)
+                        known[start] = table
+                        created.append(start)
+                stmt = self._insert_statement(table, on_conflict)
+                written += conn.execute(stmt, partition_rows).rowcount
+        except Exception:
+            # the CREATE TABLE gets rolled back along with the rows
+            with self._partition_lock:
+                for start in created:
+                    known.pop(start, None)
+            raise
+        return written
+
+    def _insert_statement(
+        self, table: Table, on_conflict: str = ON_CONFLICT_FAIL
+    ):
+        key = (table.name, on_conflict)
+        stmt = self._insert_statements.get(key)
+        if stmt is not None:
+            return stmt
+
+        if on_conflict == ON_CONFLICT_FAIL:
+            stmt = sqla_insert(table)
+        elif on_conflict == ON_CONFLICT_IGNORE:
+            stmt = sqlite_insert(table).on_conflict_do_nothing(
+                index_elements=["id"]
+            )
+        else:
+            # an upsert rather than INSERT OR REPLACE: the row keeps its saved_at
+            stmt = sqlite_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["id"],
+                set_={
+                    col.name: stmt.excluded[col.name]
+                    for col in table.columns
+                    if not (
+                        col.primary_key
+                        or col.computed is not None
+                        or col.name in ORM.exclude_columns
+                    )
+                },
+            )
+        self._insert_statements[key] = stmt
+        return stmt
+
+    def unseen(
+        self, model: Type, rows: List[dict], on_conflict: str
+    ) -> Sequence[int]:
+        """
+        Positions of the rows which the seen-set doesn't already know to be stored
+        """
+        if self.seen is None or on_conflict != ON_CONFLICT_IGNORE:
+            return range(len(rows))
+        seen = self.seen
+        return [
+            i for i, row in enumerate(rows) if (model, row["id"]) not in seen
+        ]
+
+    def mark_stored(self, model: Type, rows: List[dict]):
+        """
+        Tell the seen-set (if any) about freshly committed rows
+        """
+        if self.seen is not None:
+            self.seen.add_many((model, row["id"]) for row in rows)
+
+    def _execute_chunk(
+        self,
+        model: Type,
+        objs: List[LlamaABC],
+        rows: List[dict],
+        skipped: list,
+        skip_bad_rows: bool,
+        on_conflict: str = ON_CONFLICT_FAIL,
+    ) -> Tuple[List[LlamaABC], int]:
+        """
+        Returns the llamas that are now stored, and how many rows were written
+        """
+        if not rows:
+            return [], 0
+        try:
+            with self.engine.begin() as transaction:
+                written = self.write_rows(
+                    transaction, model, rows, on_conflict
+                )
+            self.mark_stored(model, rows)
+            return objs, written
+        except DBAPIError:
+            if not skip_bad_rows:
+                raise
+
+        stored, written = [], 0
+        for obj, row in zip(objs, rows):
+            try:
+                with self.engine.begin() as transaction:
+                    written += self.write_rows(
+                        transaction, model, [row], on_conflict
+                    )
+                self.mark_stored(model, [row])
+                stored.append(obj)
+            except DBAPIError as e:
+                skipped.append((row["id"], e))
+        return stored, written
+
+    def remember(
+        self,
+        model: Type,
+        objs: Sequence[LlamaABC],
+        on_conflict: str = ON_CONFLICT_FAIL,
+        written: int = None,
+    ):
+        """
+        Warm the identity map (if any) with freshly stored llamas.
+        After an insert, pass its on_conflict and how many rows it wrote (see InsertReport.inserted):
+        * ON_CONFLICT_REPLACE may have changed stored rows under the map, so their ids are evicted instead
+        * ON_CONFLICT_IGNORE kept the stored row for the skipped ones, and there's no telling which those
+          were: if any were skipped, nothing is cached
+        """
+        if self.cache is None or not model.is_immutable():
+            return
+        if on_conflict == ON_CONFLICT_REPLACE:
+            for obj in objs:
+                self.cache.discard(model, obj.table_id)
+        elif not (
+            on_conflict == ON_CONFLICT_IGNORE
+            and written is not None
+            and written < len(objs)
+        ):
+            self.cache.put_many(model, objs)
+
+    def hydrate(self, model: Type, d: dict, lazy: bool = False) -> LlamaABC:
+        """
+        lazy - keep the stored event undecoded until a field other than table_id is read
+               (columnar tables are always hydrated eagerly)
+        """
+        if self.storage[model] == STORAGE_COLUMNAR:
+            unset = frozenset(d["unset_fields"] or ())
+            fields = {
+                name: d[name]
+                for name in self._optional_columns[model]
+                if name not in unset
+            }
+            fields["table_id"] = self.id_from_value(d["id"])
+            return model.from_fields(fields)
+
+        table_id = self.id_from_value(d["id"]) if lazy else None
+        codec = self.codecs[model]
+        if codec is None:
+            return model.from_event_json(
+                d["event"], lazy=lazy, table_id=table_id
+            )
+        return model.from_event_bytes(
+            d["event"], codec, lazy=lazy, table_id=table_id
+        )
 
     def retrieve(
-        self, model: Type, *ids: Sequence[UUID]
+        self, model: Type, *ids: Sequence[UUID], lazy: bool = False
     ) -> Dict[UUID, LlamaABC]:
         assert issubclass(
             model, LlamaABC
@@ -119,19 +1159,203 @@ class ORM:
                 id, UUID
             ), f"id is of type {type(id)} but should be of type {UUID}"
 
-        with self.engine.begin() as transaction:
-            table = self.tables[model]
-            results = transaction.execute(
-                sqla_select(table).where(
-                    table.c.id.in_([str(id) for id in ids])
-                )
-            )
-            # return {(obj := self.hydrate(model, d)).table_id: obj for d in results.mappings()}
+        if self.cache is not None and model.is_immutable():
+            out, ids = self.cache.get_many(model, ids)
+            if not ids:
+                return out
+        else:
             out = {}
-            for d in results.mappings():
-                obj = self.hydrate(model, d)
+
+        for batch in self.stream(model, ids=ids, lazy=lazy):
+            for obj in batch:
                 out[obj.table_id] = obj
-            return out
+            self.remember(model, batch)
+        return out
+
+    # comfortably under SQLite's bound parameter limit (999 before 3.32)
+    max_ids_per_select = 900
+
+    def stream(
+        self,
+        model: Type,
+        ids: Iterable[UUID] = None,
+        saved_from: datetime.datetime = None,
+        saved_to: datetime.datetime = None,
+        batch_size: int = 1_000,
+        lazy: bool = False,
+    ) -> Iterator[List[LlamaABC]]:
+        """
+        Yield hydrated llamas in lists of up to `batch_size`, holding only one batch in memory at a time.
+
+        ids - only these ids, selected `max_ids_per_select` at a time (so any number of them is fine)
+        saved_from / saved_to - only rows with saved_from <= saved_at < saved_to
+        Neither - a full table scan, in storage order
+
+        A partitioned model is read one partition at a time, oldest first.
+        """
+        assert issubclass(
+            model, LlamaABC
+        ), f"Don't know how to model a non-Llama type {model}"
+        assert (
+            model in self.tables
+        ), f"Model {model} never got added as an ORM table (don't forget 'add_table()')"
+        assert batch_size > 0, "batch_size must be positive"
+
+        def select(table: Table):
+            query = sqla_select(table)
+            if saved_from is not None:
+                query = query.where(table.c.saved_at >= _utc_naive(saved_from))
+            if saved_to is not None:
+                query = query.where(table.c.saved_at < _utc_naive(saved_to))
+            return query
+
+        tables = self.read_tables(model)
+        if ids is None:
+            for table in tables:
+                yield from self._stream_query(
+                    model, select(table), batch_size, lazy
+                )
+            return
+
+        ids = iter(ids)
+        while True:
+            chunk = list(itertools.islice(ids, self.max_ids_per_select))
+            if not chunk:
+                return
+            for id in chunk:
+                assert isinstance(
+                    id, UUID
+                ), f"id is of type {type(id)} but should be of type {UUID}"
+            values = [self.id_value(id) for id in chunk]
+            for table in tables:
+                yield from self._stream_query(
+                    model,
+                    select(table).where(table.c.id.in_(values)),
+                    batch_size,
+                    lazy,
+                )
+
+    def query(
+        self,
+        model: Type,
+        equals: Dict[str, Any] = None,
+        between: Dict[str, Tuple[Any, Any]] = None,
+        order_by: str = None,
+        descending: bool = False,
+        limit: int = None,
+        batch_size: int = 1_000,
+        lazy: bool = False,
+    ) -> Iterator[List[LlamaABC]]:
+        """
+        Stream the llamas matching every condition, in lists of up to `batch_size`.
+        Conditions are on table columns (saved_at, extra/declared columns), so declare indexes on those you query.
+
+        equals - {column: value}
+        between - {column: (low, high)} for low <= column < high; either end can be None
+        order_by - column to sort on (an index on it keeps this from sorting in memory)
+
+        For a partitioned model, a created_at range in `between` prunes the partitions read.
+
+        EG: every IBM event from t0 to t1
+            ori.query(Quote, equals={"symbol": "IBM"}, between={"created_at": (t0, t1)}, order_by="created_at")
+        """
+        assert issubclass(
+            model, LlamaABC
+        ), f"Don't know how to model a non-Llama type {model}"
+        assert (
+            model in self.tables
+        ), f"Model {model} never got added as an ORM table (don't forget 'add_table()')"
+        assert batch_size > 0, "batch_size must be positive"
+
+        template = self.tables[model]
+        equals = equals or {}
+        between = between or {}
+        for name in itertools.chain(
+            equals, between, [order_by] if order_by else []
+        ):
+            self._query_column(template, name)
+
+        def select(table: Table):
+            q = sqla_select(table)
+            for name, value in equals.items():
+                col = table.c[name]
+                q = q.where(col == self._bind_value(col, value))
+            for name, (low, high) in between.items():
+                col = table.c[name]
+                if low is not None:
+                    q = q.where(col >= self._bind_value(col, low))
+                if high is not None:
+                    q = q.where(col < self._bind_value(col, high))
+            return q
+
+        tables = self.read_tables(model, *between.get("created_at", ()))
+        if not tables:
+            return
+        if len(tables) == 1:
+            q = select(tables[0])
+            columns = tables[0].c
+        else:
+            q = union_all(*(select(table) for table in tables))
+            columns = q.selected_columns
+        if order_by is not None:
+            col = columns[order_by]
+            q = q.order_by(col.desc() if descending else col)
+        if limit is not None:
+            q = q.limit(limit)
+
+        yield from self._stream_query(model, q, batch_size, lazy)
+
+    def read_tables(
+        self,
+        model: Type,
+        created_from: datetime.datetime = None,
+        created_to: datetime.datetime = None,
+    ) -> List[Table]:
+        """
+        The tables to read for rows created in [created_from, created_to): the model's table or,
+        when it's partitioned, only the partitions overlapping that range
+        """
+        period = self.partitioning.get(model)
+        if period is None:
+            return [self.tables[model]]
+        low = (
+            _partition_start(period, created_from)
+            if created_from is not None
+            else None
+        )
+        high = _as_utc(created_to) if created_to is not None else None
+        return [
+            table
+            for start, table in self.partitions(model).items()
+            if (low is None or start >= low)
+            and (high is None or start < high)
+        ]
+
+    @staticmethod
+    def _query_column(table: Table, name: str) -> Column:
+        assert (
+            name in table.c
+        ), f"{table.name} has no column {name} (declare it to query on it)"
+        return table.c[name]
+
+    @staticmethod
+    def _bind_value(col: Column, value: Any) -> Any:
+        if not isinstance(value, datetime.datetime):
+            return value
+        if isinstance(col.type, (UTCDateTime, GeneratedDateTime)):
+            # converted by the column type itself
+            return value
+        return _utc_naive(value)
+
+    def _stream_query(
+        self, model: Type, query, batch_size: int, lazy: bool
+    ) -> Iterator[List[LlamaABC]]:
+        with self.read_engine.connect() as conn:
+            results = conn.execution_options(stream_results=True).execute(
+                query
+            )
+            for partition in results.mappings().partitions(batch_size):
+                yield [self.hydrate(model, d, lazy=lazy) for d in partition]
 
 
 env.setup()
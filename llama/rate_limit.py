@@ -0,0 +1,62 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills at `rate` tokens per second and holds at most `capacity` of them.
+    Each request takes a token, so bursts of up to `capacity` go straight out and the long run average
+    never exceeds `rate`.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        assert rate > 0, "rate must be positive"
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        assert self.capacity >= 1, "capacity must hold at least one token"
+
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    @classmethod
+    def per_minute(cls, requests: int, burst: int = None) -> "TokenBucket":
+        """
+        EG: Alpaca allows 200 requests a minute per account - TokenBucket.per_minute(200)
+        """
+        return cls(rate=requests / 60, capacity=burst if burst is not None else max(1, requests // 10))
+
+    def __str__(self) -> str:
+        return f"TokenBucket[{self.rate:.2f}/s, capacity={self.capacity}]"
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        """
+        Block until `tokens` are available (and take them). Returns False if that takes longer than `timeout`.
+        """
+        assert tokens <= self.capacity, f"Can never have {tokens} tokens at once"
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    self.waited += now - start
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if timeout is not None and now + wait - start > timeout:
+                return False
+            time.sleep(wait)
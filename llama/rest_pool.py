@@ -0,0 +1,191 @@
+"""
+Shared Alpaca REST clients, so every TradeExecutor for a broker uses the same keep-alive connections.
+
+A RestPool hands out one tradeapi.REST client (and one rate limiter) per broker account, the client with a
+requests session that:
+* keeps up to `pool_size` connections to the broker open for reuse
+* applies default connect/read timeouts (the Alpaca SDK doesn't set any)
+* times every request, for stats()
+
+Connections can be warmed up when a client is first made, so the first order doesn't pay for the TCP/TLS
+handshake. Each process has its own pool: EG every Ray worker keeps its own connections.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+import alpaca_trade_api as tradeapi
+import requests
+from requests.adapters import HTTPAdapter
+
+import llama.logger as logger
+from llama.rate_limit import TokenBucket
+
+
+class _TimedSession(requests.Session):
+    def __init__(self, timeout: Tuple[float, float], samples: int):
+        super().__init__()
+        self.timeout = timeout
+        self.latencies = deque(maxlen=samples)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        failed = True
+        try:
+            resp = super().request(method, url, **kwargs)
+            failed = resp.status_code >= 500
+            return resp
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.requests += 1
+                self.errors += failed
+                self.latencies.append(elapsed)
+
+
+class RestPool:
+    """
+    pool_size - most connections kept open per broker, EG enough for TradeExecutor.order_batch()'s max_workers
+    connect_timeout, read_timeout - seconds, for requests that don't set their own
+    warm_up - connections to open as soon as a broker's client is made
+    samples - how many of the latest request latencies stats() works from
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10.0,
+        warm_up: int = 0,
+        samples: int = 1_000,
+    ):
+        assert pool_size > 0, "pool_size must be positive"
+        assert 0 <= warm_up <= pool_size, "can only warm up as many connections as the pool holds"
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.warm_up = warm_up
+        self.samples = samples
+
+        self._clients: Dict[Tuple[str, str], tradeapi.REST] = {}
+        # (requests per minute, bucket) per broker account
+        self._limiters: Dict[Tuple[str, str], Tuple[int, TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    def __str__(self) -> str:
+        return f"RestPool[{len(self._clients)} brokers, pool_size={self.pool_size}]"
+
+    @staticmethod
+    def _key(broker) -> Tuple[str, str]:
+        return broker.api_url, broker.api_key
+
+    def client(self, broker) -> tradeapi.REST:
+        """
+        The REST client for `broker`, made the first time it's asked for
+        """
+        key = self._key(broker)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+            client = tradeapi.REST(
+                key_id=broker.api_key,
+                secret_key=broker.api_secret,
+                base_url=broker.api_url,
+            )
+            session = _TimedSession(self.timeout, self.samples)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            # REST() opened a session of its own, which ours replaces
+            client._session.close()
+            client._session = session
+            self._clients[key] = client
+
+        if self.warm_up:
+            self._warm_up(session, broker.api_url)
+        return client
+
+    def limiter(self, broker, requests_per_minute: int) -> TokenBucket:
+        """
+        The rate limiter for `broker`'s account, made the first time it's asked for. The broker's limit is per
+        account, so every executor in the process that trades the account takes its tokens from this one.
+        """
+        key = self._key(broker)
+        with self._lock:
+            if key not in self._limiters:
+                self._limiters[key] = (requests_per_minute, TokenBucket.per_minute(requests_per_minute))
+            rate, limiter = self._limiters[key]
+        assert (
+            rate == requests_per_minute
+        ), f"Broker {broker.name} is already limited to {rate} requests a minute, not {requests_per_minute}"
+        return limiter
+
+    def _warm_up(self, session: _TimedSession, url: str):
+        """
+        Open `warm_up` connections at once (one after the other they'd all reuse the first). Any answer will do,
+        and failing is fine too: the connection just gets made later.
+        """
+
+        def touch(_):
+            try:
+                session.head(url, allow_redirects=False).close()
+            except requests.RequestException as e:
+                logger.log(self, level=logging.WARNING, msg=f"couldn't warm up a connection to {url}: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.warm_up) as pool:
+            list(pool.map(touch, range(self.warm_up)))
+
+    def stats(self, broker) -> dict:
+        """
+        Connection reuse and request latency (in seconds) for `broker`'s client
+        """
+        with self._lock:
+            client = self._clients.get(self._key(broker))
+        assert client is not None, f"No client for broker {broker.name} yet"
+        session = client._session
+
+        connections = 0
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                connections += pools[key].num_connections
+
+        with session._lock:
+            latencies = sorted(session.latencies)
+            requests_ = session.requests
+            errors = session.errors
+
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return {
+            "requests": requests_,
+            "errors": errors,
+            "connections": connections,
+            "reused": max(0, requests_ - connections),
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": percentile(0.5),
+            "p99": percentile(0.99),
+            "max": latencies[-1] if latencies else 0.0,
+        }
+
+    def close(self):
+        """
+        Close every connection and forget the clients (and rate limiters)
+        """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._limiters.clear()
+        for client in clients:
+            client._session.close()
+
+
+shared_pool = RestPool()
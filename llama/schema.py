@@ -0,0 +1,93 @@
+import typing
+from typing import ClassVar, Dict, FrozenSet, Iterable, Tuple
+import weakref
+
+
+def declared_fields(cls: type) -> Dict[str, type]:
+    """
+    A llama's declared schema: its public class annotations (and its bases'), EG
+
+        class Quote(LlamaBase):
+            symbol: str
+            price: float
+
+    ClassVar annotations are skipped, and Optional[X] is reported as X.
+    """
+    fields = {}
+    for name, typ in typing.get_type_hints(cls).items():
+        if name.startswith("_") or typ is ClassVar or typing.get_origin(typ) is ClassVar:
+            continue
+        args = [a for a in typing.get_args(typ) if a is not type(None)]
+        if typing.get_origin(typ) is typing.Union and len(args) == 1:
+            typ = args[0]
+        fields[name] = typ
+    return fields
+
+
+def slot_names(cls: type) -> Tuple[str, ...]:
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        names.extend(s for s in slots if s not in ("__dict__", "__weakref__"))
+    return tuple(dict.fromkeys(names))
+
+
+class FieldSchema:
+    """
+    The attribute names that `LlamaMixin.as_dict()` walks for one Llama class.
+
+    Scanning `dir()` of the class happens once, here. Instance attributes vary
+    (kwargs, hydrated events, mutable llamas) so the field tuple is memoized per
+    instance layout, i.e. per tuple of `__dict__` keys. A layout we haven't seen
+    before - a new instance attribute showed up - gets a fresh field tuple. At most
+    `max_layouts` layouts are memoized; past that, fields are worked out per call.
+
+    Slots are always listed; it's up to the caller to skip the ones never set.
+    """
+
+    max_layouts = 64
+
+    def __init__(self, cls: type, excludes: Iterable[str]):
+        # weak, or the _schemas entry would keep its own key alive
+        self.cls = weakref.ref(cls)
+        self.excludes = frozenset(excludes)
+        self.slots = slot_names(cls)
+        self.class_fields: FrozenSet[str] = frozenset(
+            name
+            for name in dir(cls)
+            if not (self._is_hidden(name) or name in self.slots or callable(getattr(cls, name)))
+        )
+        self.fixed_fields = self.class_fields.union(s for s in self.slots if not self._is_hidden(s))
+        self._layouts: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+    def _is_hidden(self, name: str) -> bool:
+        return name.startswith("_") or name in self.excludes
+
+    def fields(self, obj: object) -> Tuple[str, ...]:
+        layout = tuple(getattr(obj, "__dict__", ()))
+        fields = self._layouts.get(layout)
+        if fields is None:
+            fields = tuple(sorted(self.fixed_fields.union(k for k in layout if not self._is_hidden(k))))
+            if len(self._layouts) < self.max_layouts:
+                self._layouts[layout] = fields
+        return fields
+
+
+# weak, so dynamically made classes can still be garbage collected
+_schemas: "weakref.WeakKeyDictionary[type, FieldSchema]" = weakref.WeakKeyDictionary()
+
+
+def schema_of(cls: type, excludes: Iterable[str]) -> FieldSchema:
+    schema = _schemas.get(cls)
+    if schema is None:
+        schema = _schemas[cls] = FieldSchema(cls, excludes)
+    return schema
+
+
+def clear_schemas():
+    """
+    Forget every compiled schema. Only needed if class attributes get patched at runtime.
+    """
+    _schemas.clear()
@@ -1,17 +1,40 @@
-import alpaca_trade_api as tradeapi
 import alpaca_trade_api.rest as alpaca_rest
 
 import ray
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import date, timedelta
+import functools
 import os
+import queue
 import uuid
-from typing import Tuple
+from typing import Callable, List, Optional, Sequence, Tuple
 
 from llama.base import LlamaBase
 from llama.alpaca_entity import AlpacaEntity, AlpacaError
 import llama.env as env
+from llama import market_clock
+from llama.market_clock import MarketClock
+from llama.rate_limit import TokenBucket
+from llama.rest_pool import RestPool, shared_pool
+
+
+def _fetch_clock(api, limiter: TokenBucket) -> dict:
+    limiter.acquire()
+    return AlpacaEntity(api.get_clock()).as_dict()
+
+
+def _fetch_calendar(api, limiter: TokenBucket, start: date, end: date) -> List[dict]:
+    limiter.acquire()
+    return [AlpacaEntity(day).as_dict() for day in api.get_calendar(start.isoformat(), end.isoformat())]
+
+
+def _pooled(fetch: Callable, pool: RestPool, broker: "Broker", requests_per_minute: int, *args):
+    """
+    fetch() with the pool's client and limiter as they are now: EG a closed pool makes a new client
+    """
+    return fetch(pool.client(broker), pool.limiter(broker, requests_per_minute), *args)
 
 
 @dataclass
@@ -26,13 +49,26 @@ class Broker:
 
 
 class TradeExecutor:
-    def __init__(self, broker: Broker):
+    # Alpaca's limit per account
+    requests_per_minute = 200
+    # seconds before the shared market clock is fetched again, even if the market hasn't opened or closed
+    clock_ttl = 3_600.0
+    # days of trading calendar to cache along with the clock (0 to only use the clock's next_open/next_close)
+    clock_calendar_days = 0
+
+    def __init__(self, broker: Broker, pool: RestPool = None):
+        """
+        pool - where the REST client comes from: executors for the same broker share a client and its
+               connections. Defaults to the process wide shared_pool.
+        """
         self.broker = broker
         assert self.broker.broker_type == "alpaca"
-        self.api = tradeapi.REST(
-            key_id=self.broker.api_key,
-            secret_key=self.broker.api_secret,
-            base_url=self.broker.api_url,
+        self.pool = pool or shared_pool
+        self.api = self.pool.client(self.broker)
+        # shared by every executor for the account (in this process), as the broker's limit is
+        self.limiter = self.pool.limiter(self.broker, self.requests_per_minute)
+        self.clock = market_clock.shared(
+            self.broker, self._make_clock, self.pool, self.clock_ttl, self.clock_calendar_days
         )
 
     def __str__(self):
@@ -43,7 +79,64 @@ class TradeExecutor:
         Basing off of: https://alpaca.markets/docs/api-documentation/api-v2/orders/
         """
         assert self.broker.broker_type == "alpaca"
-        order = {
+        return self._submit(self._order_request(side, symbol, qty))
+
+    def order_batch(self, orders: Sequence[dict], max_workers: int = 8) -> List[dict]:
+        """
+        Submit many orders concurrently, EG when rebalancing a basket.
+
+        orders - dicts with side, symbol, qty and optionally a priority: lower is sent first (the default is 0).
+                 That's only the order they're sent in: with several workers, a later order can still reach
+                 the broker before an earlier one has been filled, or even accepted. A client_order_id can be
+                 given too, so resending an order can't place it twice.
+        max_workers - how many requests can be in flight at once
+
+        Like order(), every submission first takes a token from self.limiter, so the batch stays within the
+        broker's rate limit.
+        Returns one result per order, in the order given: what order() returns or, for an order the broker
+        rejected, {"external_order_id": None, "order": ..., "api_error": ...} - and for one that failed any
+        other way (EG a timeout), {"external_order_id": None, "order": ..., "error": ...}. Either way the rest
+        of the batch still goes out.
+        """
+        assert self.broker.broker_type == "alpaca"
+        assert max_workers > 0, "max_workers must be positive"
+
+        pending = queue.PriorityQueue()
+        for i, o in enumerate(orders):
+            order = self._order_request(o["side"], o["symbol"], o["qty"], o.get("client_order_id"))
+            pending.put((o.get("priority", 0), i, order))
+
+        results = [None] * len(orders)
+
+        def work():
+            while True:
+                try:
+                    _, i, order = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[i] = self._submit(order)
+                except alpaca_rest.APIError as e:
+                    results[i] = {
+                        "external_order_id": None,
+                        "order": order,
+                        "api_error": AlpacaError(e).as_dict(),
+                    }
+                except Exception as e:
+                    results[i] = {"external_order_id": None, "order": order, "error": repr(e)}
+
+        n = min(max_workers, len(orders))
+        if not n:
+            return results
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            workers = [pool.submit(work) for _ in range(n)]
+        for worker in workers:
+            worker.result()
+        return results
+
+    @staticmethod
+    def _order_request(side: str, symbol: str, qty: int, client_order_id: str = None) -> dict:
+        return {
             "symbol": symbol,
             "qty": qty,
             "side": side,
@@ -51,20 +144,46 @@ class TradeExecutor:
             "time_in_force": "gtc",
             "limit_price": None,
             "stop_price": None,
-            "client_order_id": str(uuid.uuid4()),
+            "client_order_id": client_order_id or str(uuid.uuid4()),
             "order_class": None,
             "take_profit": None,
             "stop_loss": None,
             "trail_price": None,
             "trail_percent": None,
         }
-        resp_order = AlpacaEntity(self.api.submit_order(**order)).as_dict()
+
+    def _submit(self, order: dict) -> dict:
+        self.limiter.acquire()
+        return self._bundle(order, self.api.submit_order(**order))
+
+    @staticmethod
+    def _bundle(order: dict, resp) -> dict:
+        resp_order = AlpacaEntity(resp).as_dict()
         return {
             "external_order_id": uuid.UUID(resp_order["id"]),
             "order": order,
             "response": resp_order,
         }
 
+    def placed(self, orders: Sequence[dict]) -> List[Optional[dict]]:
+        """
+        Look orders (dicts with side, symbol, qty and client_order_id) up at the broker, EG before resending ones
+        whose outcome got lost. For each: what order() returns had it been placed, or None if the broker
+        hasn't got it.
+        """
+        out = []
+        for o in orders:
+            self.limiter.acquire()
+            try:
+                resp = self.api.get_order_by_client_order_id(o["client_order_id"])
+            except alpaca_rest.APIError as e:
+                if e.status_code != 404:
+                    raise
+                out.append(None)
+                continue
+            out.append(self._bundle(self._order_request(o["side"], o["symbol"], o["qty"], o["client_order_id"]), resp))
+        return out
+
     def cancel(self, external_order_id: uuid.UUID = None, order_bundle: dict = None) -> dict:
         assert (
             external_order_id or order_bundle
@@ -72,6 +191,7 @@ class TradeExecutor:
         if not external_order_id:
             external_order_id = order_bundle["external_order_id"]
         order_id = str(external_order_id)
+        self.limiter.acquire()
         try:
             self.api.cancel_order(order_id)
             return {
@@ -86,14 +206,33 @@ class TradeExecutor:
             }
 
     def market_clock(self) -> dict:
-        return AlpacaEntity(self.api.get_clock()).as_dict()
+        """
+        The broker's clock, fresh from the API
+        """
+        return _fetch_clock(self.api, self.limiter)
+
+    def _calendar(self, start: date, end: date) -> List[dict]:
+        return _fetch_calendar(self.api, self.limiter, start, end)
+
+    def _make_clock(self) -> MarketClock:
+        # the shared clock outlives this executor: it goes through the pool, not self
+        return MarketClock(
+            functools.partial(_pooled, _fetch_clock, self.pool, self.broker, self.requests_per_minute),
+            fetch_calendar=(
+                functools.partial(_pooled, _fetch_calendar, self.pool, self.broker, self.requests_per_minute)
+                if self.clock_calendar_days
+                else None
+            ),
+            ttl=self.clock_ttl,
+            calendar_days=self.clock_calendar_days or 1,
+        )
 
     def market_open_and_toggle_delta(self) -> Tuple[bool, timedelta]:
-        clock = self.market_clock()
-        is_open = clock["is_open"]
-        next_toggle = min(clock["next_close"], clock["next_open"])
-        window = next_toggle - datetime.now(next_toggle.tz)
-        return is_open, window
+        """
+        From self.clock, which is shared by all the executors for this broker: only goes to the API when the
+        market has opened or closed since the last fetch, or the cache is older than clock_ttl
+        """
+        return self.clock.open_and_toggle_delta()
 
 
 @ray.remote
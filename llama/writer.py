@@ -0,0 +1,213 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+import llama.logger as logger
+from llama.abstract_base import LlamaABC
+from llama.orm import ON_CONFLICT_FAIL, ORM
+
+
+_FLUSH = object()
+_STOP = object()
+
+
+class WriteBehindWriter:
+    """
+    Group-commits llamas into an ORM from a background thread.
+
+    enqueue() returns as soon as the llama is queued. The writer thread gathers up to `max_batch` llamas,
+    waiting at most `max_latency` seconds after the first one arrives, and commits them (any mix of models)
+    in a single transaction - one commit (and fsync) per group instead of one per llama.
+
+    The queue holds at most `max_queue` llamas. When it's full, enqueue() blocks (backpressure) for up to its
+    `timeout` and then raises queue.Full.
+
+    on_conflict - as for ORM.insert(). With ON_CONFLICT_IGNORE a re-delivered llama can't fail its whole group.
+
+    NB: the writer thread gets its own connection, so an in-memory SQLite engine won't be shared with it.
+    """
+
+    def __init__(
+        self,
+        orm: ORM,
+        max_batch: int = 1_000,
+        max_latency: float = 0.05,
+        max_queue: int = 100_000,
+        on_error: Callable[[Exception, List[LlamaABC]], None] = None,
+        on_conflict: str = ON_CONFLICT_FAIL,
+    ):
+        assert max_batch > 0, "max_batch must be positive"
+        assert max_latency >= 0, "max_latency can't be negative"
+
+        self.orm = orm
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.on_error = on_error
+        self.on_conflict = on_conflict
+
+        self._queue = queue.Queue(maxsize=max_queue)
+
+        self._cond = threading.Condition()
+        self._enqueued = 0
+        self._processed = 0
+        self._closed = False
+        # enqueue() calls past the closed check but not yet in the queue: close() waits for them
+        self._putting = 0
+
+        self.commits = 0
+        self.committed = 0
+        self.failed = 0
+        self.last_error: Optional[Exception] = None
+        self._latency_total = 0.0
+        self._latency_last = 0.0
+        self._latency_max = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="WriteBehindWriter", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __str__(self) -> str:
+        return f"WriteBehindWriter[queued={self._queue.qsize()}, committed={self.committed}]"
+
+    def enqueue(self, obj: LlamaABC, block: bool = True, timeout: float = None):
+        assert type(obj) in self.orm.tables, f"{type(obj)} never got added as an ORM table"
+        with self._cond:
+            assert not self._closed, "Can't enqueue into a closed writer"
+            self._enqueued += 1
+            self._putting += 1
+        try:
+            self._queue.put(obj, block=block, timeout=timeout)
+        except queue.Full:
+            with self._cond:
+                self._enqueued -= 1
+            raise
+        finally:
+            with self._cond:
+                self._putting -= 1
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until everything enqueued before this call has been committed (or failed).
+        Returns False if that didn't happen within `timeout` seconds.
+        """
+        with self._cond:
+            target = self._enqueued
+            if self._processed >= target:
+                return True
+        try:
+            # only a nudge so the writer doesn't wait out max_latency: if the queue is full it's busy anyway
+            self._queue.put_nowait(_FLUSH)
+        except queue.Full:
+            pass
+        with self._cond:
+            return self._cond.wait_for(lambda: self._processed >= target, timeout=timeout)
+
+    def close(self, timeout: float = None):
+        """
+        Stop taking new llamas, commit whatever is queued and stop the writer thread
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            # so nothing can land behind the stop and be lost
+            self._cond.wait_for(lambda: self._putting == 0)
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "commits": self.commits,
+            "committed": self.committed,
+            "failed": self.failed,
+            "commit_latency_last": self._latency_last,
+            "commit_latency_avg": self._latency_total / self.commits if self.commits else 0.0,
+            "commit_latency_max": self._latency_max,
+        }
+
+    def _gather(self) -> Tuple[List[LlamaABC], bool]:
+        """
+        Block for the first llama, then take more until max_batch, max_latency, a flush or a stop
+        """
+        batch = []
+        item = self._queue.get()
+        if item is _STOP:
+            return batch, True
+        if item is not _FLUSH:
+            batch.append(item)
+
+        deadline = time.monotonic() + self.max_latency
+        while batch and len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            if item is _FLUSH:
+                break
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._gather()
+            if stopping:
+                # drain whatever got queued ahead of the stop
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _FLUSH and item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch: List[LlamaABC]):
+        by_model: Dict[Type, List[LlamaABC]] = {}
+        for obj in batch:
+            by_model.setdefault(type(obj), []).append(obj)
+
+        start = time.perf_counter()
+        rows, written = {}, {}
+        try:
+            with self.orm.engine.begin() as transaction:
+                for model, objs in by_model.items():
+                    rows[model] = [self.orm.transform(obj) for obj in objs]
+                    written[model] = self.orm.write_rows(transaction, model, rows[model], self.on_conflict)
+        except Exception as e:
+            self.failed += len(batch)
+            self.last_error = e
+            logger.log(self, level=logging.ERROR, msg=f"failed to commit {len(batch)} llamas: {e}")
+            if self.on_error is not None:
+                try:
+                    self.on_error(e, batch)
+                except Exception as callback_error:
+                    # the writer thread has to outlive a broken callback
+                    logger.log(self, level=logging.ERROR, msg=f"on_error raised: {callback_error}")
+        else:
+            elapsed = time.perf_counter() - start
+            for model, objs in by_model.items():
+                self.orm.mark_stored(model, rows[model])
+                self.orm.remember(model, objs, self.on_conflict, written[model])
+            self.commits += 1
+            self.committed += len(batch)
+            self._latency_last = elapsed
+            self._latency_total += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+        finally:
+            with self._cond:
+                self._processed += len(batch)
+                self._cond.notify_all()
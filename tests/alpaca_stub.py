@@ -0,0 +1,233 @@
+"""
+A local stand-in for the Alpaca REST endpoints we use, so TradeExecutor can be tested over real HTTP.
+"""
+import asyncio
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+import urllib.parse
+import uuid
+
+import websockets
+
+from llama.trader import Broker
+
+
+class AlpacaStub:
+    """
+    EG:
+        with AlpacaStub(latency=0.01) as stub:
+            teena = TradeExecutor(stub.broker())
+            ...
+            assert len(stub.orders) == 3
+
+    Orders for a symbol in `reject` get a 403 like an order Alpaca turns down, and a client_order_id that's
+    already been used a 422.
+    """
+
+    def __init__(self, latency: float = 0.0, reject=("REJECT",)):
+        self.latency = latency
+        self.reject = set(reject)
+        self.orders = []
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.clock = {
+            "timestamp": "2021-03-01T10:00:00-05:00",
+            "is_open": True,
+            "next_open": "2021-03-02T09:30:00-05:00",
+            "next_close": "2021-03-01T16:00:00-05:00",
+        }
+        self.calendar = [
+            {"date": "2021-03-01", "open": "09:30", "close": "16:00"},
+            {"date": "2021-03-02", "open": "09:30", "close": "16:00"},
+        ]
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, like the real thing
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._handle(self, "GET")
+
+            def do_HEAD(self):
+                stub._handle(self, "HEAD")
+
+            def do_POST(self):
+                stub._handle(self, "POST")
+
+            def do_DELETE(self):
+                stub._handle(self, "DELETE")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def broker(self, name: str = "stub") -> Broker:
+        return Broker(name, self.url, self.url, "key", "secret", False)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, method: str, path: str) -> int:
+        with self.lock:
+            return sum(1 for r in self.requests if r[0] == method and r[1].split("?")[0] == path)
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.requests.append((method, handler.path, time.monotonic()))
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            length = int(handler.headers.get("Content-Length") or 0)
+            body = json.loads(handler.rfile.read(length)) if length else None
+            path, _, query = handler.path.partition("?")
+            status, reply = self._route(method, path, body, urllib.parse.parse_qs(query))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        data = json.dumps(reply).encode() if reply is not None else b""
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        if method != "HEAD":
+            handler.wfile.write(data)
+
+    def _route(self, method: str, path: str, body: dict, query: dict):
+        if method == "POST" and path == "/v2/orders":
+            if body["symbol"] in self.reject:
+                return 403, {"code": 40310000, "message": "insufficient buying power"}
+            order = dict(body, id=str(uuid.uuid4()), status="accepted", updated_at=_now())
+            with self.lock:
+                if any(o["client_order_id"] == order["client_order_id"] for o in self.orders):
+                    return 422, {"code": 40010001, "message": "client_order_id must be unique"}
+                self.orders.append(order)
+            return 200, order
+        if method == "GET" and path == "/v2/orders:by_client_order_id":
+            with self.lock:
+                for order in self.orders:
+                    if order["client_order_id"] == query["client_order_id"][0]:
+                        return 200, order
+            return 404, {"code": 40410000, "message": "order not found"}
+        if method == "GET" and path == "/v2/orders":
+            with self.lock:
+                return 200, list(reversed(self.orders))
+        if method == "DELETE" and path.startswith("/v2/orders/"):
+            return 204, None
+        if method == "GET" and path == "/v2/clock":
+            return 200, self.clock
+        if method == "GET" and path == "/v2/calendar":
+            return 200, self.calendar
+        return 404, {"code": 40410000, "message": f"no route for {method} {path}"}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class TradeUpdatesStub:
+    """
+    A local stand-in for Alpaca's trade_updates websocket stream. EG:
+        with AlpacaStub() as stub, TradeUpdatesStub(stub) as stream:
+            tracker = OrderTracker(stub.broker(), url=stream.url)
+            ...
+            stream.push("fill", stub.orders[0])
+    """
+
+    def __init__(self, rest: AlpacaStub):
+        self.rest = rest
+        self.clients = set()
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/stream"
+
+    def __enter__(self):
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def __exit__(self, *exc):
+        self._call(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def _serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(websockets.serve(self._session, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _session(self, ws, path=None):
+        auth = json.loads(await ws.recv())
+        broker = self.rest.broker()
+        if auth["data"] != {"key_id": broker.api_key, "secret_key": broker.api_secret}:
+            await ws.send(json.dumps({"stream": "authorization", "data": {"status": "unauthorized"}}))
+            return
+        await ws.send(json.dumps({"stream": "authorization", "data": {"status": "authorized"}}))
+        listen = json.loads(await ws.recv())
+        await ws.send(json.dumps({"stream": "listening", "data": {"streams": listen["data"]["streams"]}}))
+        self.connections += 1
+        self.clients.add(ws)
+        try:
+            await ws.wait_closed()
+        finally:
+            self.clients.discard(ws)
+
+    def push(self, event: str, order: dict, status: str = None):
+        """
+        Move `order` (one of the REST stub's) to `status` (by default, named after the event) and stream it
+        """
+        with self.rest.lock:
+            order.update(status=status or event, updated_at=_now())
+            message = json.dumps({"stream": "trade_updates", "data": {"event": event, "order": dict(order)}})
+        self._call(self._broadcast(message))
+
+    async def _broadcast(self, message: str):
+        for ws in list(self.clients):
+            await ws.send(message)
+
+    def drop(self):
+        """
+        Cut every client off, as a flaky network would
+        """
+        self._call(self._close_clients())
+
+    async def _close_clients(self):
+        for ws in list(self.clients):
+            await ws.close()
+
+    async def _close(self):
+        await self._close_clients()
+        self.server.close()
+        await self.server.wait_closed()
@@ -0,0 +1,197 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import Column, Integer
+from sqlalchemy.exc import IntegrityError
+
+from llama.async_orm import AsyncORM
+from llama.base import LlamaBase
+from llama.codec import CompressedCodec
+from llama.event_handler import EventHandler
+import llama.orm as orm
+from llama.orm import InsertReport
+
+
+class Number(LlamaBase):
+    pass
+
+
+class Tick(LlamaBase):
+    symbol: str
+    price: float
+
+    @classmethod
+    def has_timestamp(cls):
+        return True
+
+    @classmethod
+    def db_table_name(cls):
+        return "ticks"
+
+
+def make_orm(tmp_path, **kwargs) -> AsyncORM:
+    ori = AsyncORM(db_uri=f"sqlite:///{tmp_path / 'async.sqlite'}", echo=False, **kwargs)
+    ori.add_table(Number, Column("num", Integer))
+    ori.add_table(EventHandler)
+    return ori
+
+
+def test_insert_and_retrieve(tmp_path):
+    async def go():
+        ori = make_orm(tmp_path)
+        await ori.bootstrap_db()
+
+        numbers = [Number(num=i) for i in range(10)]
+        await ori.insert(Number, *numbers)
+        event = EventHandler()
+        await ori.insert(EventHandler, event)
+
+        assert await ori.retrieve(Number, *(n.table_id for n in numbers)) == {n.table_id: n for n in numbers}
+        assert await ori.retrieve(EventHandler, event.table_id) == {event.table_id: event}
+        await ori.dispose()
+
+    asyncio.run(go())
+
+
+def test_concurrent_inserts_are_group_committed(tmp_path):
+    async def go():
+        ori = make_orm(tmp_path)
+        await ori.bootstrap_db()
+
+        numbers = [Number(num=i) for i in range(200)]
+        await asyncio.gather(*(ori.insert(Number, n) for n in numbers))
+        assert ori.metrics()["committed"] == 200
+        assert ori.metrics()["commits"] < 200
+
+        # reads run side by side, each on its own connection
+        halves = await asyncio.gather(
+            ori.retrieve(Number, *(n.table_id for n in numbers[:100])),
+            ori.retrieve(Number, *(n.table_id for n in numbers[100:])),
+        )
+        assert {**halves[0], **halves[1]} == {n.table_id: n for n in numbers}
+        await ori.dispose()
+
+    asyncio.run(go())
+
+
+def test_failed_insert_only_fails_its_caller(tmp_path):
+    async def go():
+        ori = make_orm(tmp_path)
+        await ori.bootstrap_db()
+
+        dupe = Number(num=1)
+        await ori.insert(Number, dupe)
+
+        fresh = [Number(num=i) for i in range(5)]
+        results = await asyncio.gather(
+            *(ori.insert(Number, n) for n in fresh[:3]),
+            ori.insert(Number, dupe),
+            *(ori.insert(Number, n) for n in fresh[3:]),
+            return_exceptions=True,
+        )
+        assert [type(r) for r in results] == [InsertReport] * 3 + [IntegrityError] + [InsertReport] * 2
+        assert len(await ori.retrieve(Number, *(n.table_id for n in fresh))) == 5
+        await ori.dispose()
+
+    asyncio.run(go())
+
+
+def test_writer_task_dying_fails_waiting_inserts(tmp_path):
+    async def go():
+        ori = make_orm(tmp_path)
+        await ori.bootstrap_db()
+
+        def broken(model, rows):
+            raise RuntimeError("boom")
+
+        ori.orm.mark_stored = broken
+        numbers = [Number(num=i) for i in range(3)]
+        results = await asyncio.wait_for(
+            asyncio.gather(*(ori.insert(Number, n) for n in numbers), return_exceptions=True), timeout=5
+        )
+        assert [str(r) for r in results] == ["boom"] * 3
+
+        # the next insert gets a new writer task
+        del ori.orm.mark_stored
+        assert (await ori.insert(Number, Number(num=3))).inserted == 1
+        await ori.dispose()
+
+    asyncio.run(go())
+
+
+def test_dictionary_trained_elsewhere(tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'compressed.sqlite'}"
+
+    async def go():
+        ori = AsyncORM(db_uri=db_uri, echo=False)
+        ori.add_table(EventHandler, codec=CompressedCodec())
+        await ori.bootstrap_db()
+
+        # another process trains a dictionary after this one started
+        other = orm.ORM(db_uri=db_uri, echo=False)
+        other.add_table(EventHandler, codec=CompressedCodec())
+        other.bootstrap_db()
+        events = [EventHandler(symbol="IBM", qty=i) for i in range(50)]
+        other.insert(EventHandler, *events)
+        other.train_dictionary(EventHandler)
+        newest = EventHandler(symbol="MSFT")
+        other.insert(EventHandler, newest)
+        other.dispose()
+
+        assert await ori.retrieve(EventHandler, newest.table_id) == {newest.table_id: newest}
+        lazy = await ori.retrieve(EventHandler, newest.table_id, lazy=True)
+        assert lazy[newest.table_id].symbol == "MSFT"
+        # only read with, not compressed with
+        assert ori.orm.codecs[EventHandler].dictionary_id == 0
+        await ori.dispose()
+
+    asyncio.run(go())
+
+
+def test_replay_ignores_duplicates(tmp_path):
+    async def go():
+        ori = make_orm(tmp_path, dedup_size=100)
+        await ori.bootstrap_db()
+
+        numbers = [Number(num=i) for i in range(10)]
+        assert await ori.insert(Number, *numbers[:6]) == InsertReport(inserted=6, skipped=0)
+        report = await ori.insert(Number, *numbers, on_conflict=orm.ON_CONFLICT_IGNORE)
+        assert report == InsertReport(inserted=4, skipped=6, filtered=6)
+        await ori.dispose()
+
+    asyncio.run(go())
+
+
+def test_partitioned_cached(tmp_path):
+    async def go():
+        ori = AsyncORM(db_uri=f"sqlite:///{tmp_path / 'ticks.sqlite'}", echo=False, cache_size=100)
+        ori.add_table(Tick, storage=orm.STORAGE_COLUMNAR, partition=orm.PARTITION_DAY)
+        await ori.bootstrap_db()
+
+        t0 = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+        ticks = [Tick(symbol="IBM", price=float(d), created_at=t0 + datetime.timedelta(days=d)) for d in range(3)]
+        await ori.insert(Tick, *ticks)
+        assert len(ori.orm.partitions(Tick)) == 3
+
+        ori.orm.cache.clear()
+        assert await ori.retrieve(Tick, *(t.table_id for t in ticks)) == {t.table_id: t for t in ticks}
+        assert len(ori.orm.cache) == 3
+        await ori.dispose()
+
+    asyncio.run(go())
+
+
+def test_asserts(tmp_path):
+    with pytest.raises(AssertionError):
+        AsyncORM(db_uri="sqlite://", eng=object())
+
+    async def go():
+        ori = make_orm(tmp_path)
+        with pytest.raises(AssertionError):
+            await ori.insert(Number, EventHandler())
+        with pytest.raises(AssertionError):
+            await ori.retrieve(Tick, Number().table_id)
+        await ori.dispose()
+
+    asyncio.run(go())
@@ -0,0 +1,82 @@
+import datetime
+import json
+import uuid
+
+from sqlalchemy import Column, DateTime, Integer, text
+
+import pytest
+
+from llama.base import LlamaBase
+from llama.batch import LlamaBatch, ABSENT, datetime_to_ns, ns_to_datetime
+from llama.event_handler import EventHandler
+import llama.orm as orm
+from llama.orm import ORM
+
+
+class Tick(LlamaBase):
+    pass
+
+
+def test_ns_roundtrip():
+    now = datetime.datetime.now(datetime.timezone.utc)
+    assert ns_to_datetime(datetime_to_ns(now)) == now
+
+
+def test_build():
+    batch = LlamaBatch.build(EventHandler, [{"symbol": "IBM", "price": 1.5}, {"symbol": "AAPL"}])
+
+    assert len(batch) == 2
+    assert len(batch.table_ids) == 32
+    assert batch.created_at[0] == batch.created_at[1]
+    assert batch.columns["price"] == [1.5, ABSENT]
+    assert batch.table_id(0) != batch.table_id(1)
+
+    evan = batch[1]
+    assert isinstance(evan, EventHandler)
+    assert evan.as_dict() == batch.row(1)
+    assert "price" not in evan.as_dict()
+
+    with pytest.raises(IndexError):
+        batch[2]
+
+
+def test_no_timestamp():
+    batch = LlamaBatch.build(Tick, [{"num": 1}])
+    assert batch.created_at is None
+    assert set(batch.row(0).keys()) == {"num", "table_id"}
+
+
+def test_event_json_roundtrip():
+    events = [EventHandler(symbol="IBM", num=i) for i in range(3)]
+    batch = LlamaBatch.from_llamas(EventHandler, events)
+
+    assert batch.as_event_json() == [evan.as_event_json() for evan in events]
+    assert [llama.table_id for llama in batch] == [evan.table_id for evan in events]
+
+    again = LlamaBatch.from_event_json(EventHandler, batch.as_event_json())
+    assert again.as_event_json() == batch.as_event_json()
+    assert json.loads(again.as_event_json()[2])["num"] == 2
+
+
+def test_orm_insert_batch():
+    eng = orm.engine()
+    try:
+        ori = ORM(eng=eng)
+        ori.add_table(EventHandler, Column("created_at", DateTime(timezone=True)), Column("num", Integer))
+        ori.bootstrap_db()
+
+        batch = LlamaBatch.build(EventHandler, [{"num": i} for i in range(5)])
+        ori.insert(EventHandler, batch)
+
+        with eng.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM events")).scalar() == 5
+            assert conn.execute(text("SELECT sum(num) FROM events")).scalar() == 10
+
+        retrieved = ori.retrieve(EventHandler, *batch.iter_table_ids())
+        assert set(retrieved.keys()) == set(batch.iter_table_ids())
+        assert all(isinstance(k, uuid.UUID) for k in retrieved)
+
+        with pytest.raises(AssertionError):
+            ori.insert(EventHandler, LlamaBatch.build(Tick, [{"num": 1}]))
+    finally:
+        eng.dispose()
@@ -0,0 +1,107 @@
+import uuid
+
+import unittest.mock as mock
+from sqlalchemy import Column, Integer
+
+from llama.base import LlamaBase
+from llama.cache import IdentityMap, SeenSet
+from llama.trader import Trader
+import llama.orm as orm
+from llama.orm import ORM
+
+
+class Number(LlamaBase):
+    pass
+
+
+def test_lru():
+    cache = IdentityMap(max_size=2)
+    a, b, c = Number(num=1), Number(num=2), Number(num=3)
+    cache.put(Number, a)
+    cache.put(Number, b)
+    assert cache.get(Number, a.table_id) is a  # a is now the most recent
+    cache.put(Number, c)
+
+    assert len(cache) == 2
+    assert cache.get(Number, b.table_id) is None
+    assert cache.get(Number, c.table_id) is c
+    assert cache.get(Trader, c.table_id) is None
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 2, "misses": 2, "hit_rate": 0.5}
+
+
+def test_orm_cache():
+    eng = orm.engine(echo=False)
+    try:
+        ori = ORM(eng=eng, cache_size=100)
+        ori.add_table(Number, Column("num", Integer))
+        ori.bootstrap_db()
+
+        numbers = [Number(num=i) for i in range(3)]
+        ori.insert(Number, *numbers)
+        assert len(ori.cache) == 3
+
+        with mock.patch.object(ori, "stream") as stream:
+            assert ori.retrieve(Number, *(n.table_id for n in numbers)) == {n.table_id: n for n in numbers}
+        stream.assert_not_called()
+        assert ori.cache.hits == 3
+
+        ori.cache.clear()
+        ori.insert_many(Number, [Number(num=9)])
+        assert len(ori.cache) == 1
+
+        unknown = uuid.uuid4()
+        roundtrip = ori.retrieve(Number, numbers[0].table_id, unknown)
+        assert roundtrip == {numbers[0].table_id: numbers[0]}
+        assert ori.cache.misses == 2
+        assert ori.cache.get(Number, numbers[0].table_id) == numbers[0]
+    finally:
+        eng.dispose()
+
+
+def test_orm_cache_on_conflict():
+    eng = orm.engine(echo=False)
+    try:
+        ori = ORM(eng=eng, cache_size=100)
+        ori.add_table(Number, Column("num", Integer))
+        ori.bootstrap_db()
+
+        stored = Number(num=1)
+        ori.insert(Number, stored)
+        ori.cache.clear()
+
+        # skipped by DO NOTHING: the stored row is the one to come back, not this
+        replay = Number(num=2, table_id=stored.table_id)
+        fresh = Number(num=3)
+        report = ori.insert(Number, replay, fresh, on_conflict=orm.ON_CONFLICT_IGNORE)
+        assert report.inserted == 1
+        assert len(ori.cache) == 0
+        assert ori.retrieve(Number, stored.table_id)[stored.table_id].num == 1
+
+        # replaced underneath the map: evicted rather than cached
+        assert ori.cache.get(Number, stored.table_id) is not None
+        changed = Number(num=4, table_id=stored.table_id)
+        ori.insert(Number, changed, on_conflict=orm.ON_CONFLICT_REPLACE)
+        assert ori.cache.get(Number, stored.table_id) is None
+        assert ori.retrieve(Number, stored.table_id)[stored.table_id].num == 4
+
+        ori.retrieve(Number, fresh.table_id)
+        ori.insert_many(Number, [Number(num=5, table_id=fresh.table_id)], on_conflict=orm.ON_CONFLICT_IGNORE)
+        assert ori.cache.get(Number, fresh.table_id).num == 3
+    finally:
+        eng.dispose()
+
+
+def test_seen_set():
+    seen = SeenSet(max_size=3)
+    seen.add_many(["a", "b", "c"])
+    assert "a" in seen and "z" not in seen
+
+    # "a" was just seen again, so "b" is the oldest
+    seen.add_many(["a", "d"])
+    assert len(seen) == 3
+    assert "b" not in seen
+    assert all(k in seen for k in "acd")
+    assert seen.stats() == {"size": 3, "max_size": 3, "hits": 4}
+
+    seen.clear()
+    assert len(seen) == 0
@@ -0,0 +1,203 @@
+import datetime
+import json
+import uuid
+
+import pytest
+from sqlalchemy import Column, DateTime
+
+from llama.base import LlamaBase
+import llama.codec as codec
+from llama.codec import encode_default, get_codec, available_codecs
+from llama.event_handler import EventHandler
+import llama.orm as orm
+from llama.orm import ORM
+
+
+def sample() -> dict:
+    return {
+        "table_id": uuid.uuid4(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+        "symbol": "IBM",
+        "qty": 400,
+        "price": 128.7324,
+        "tags": ["a", "b"],
+    }
+
+
+class Number(LlamaBase):
+    pass
+
+
+class Weird:
+    def __str__(self):
+        return "weird"
+
+
+def test_encode_default():
+    d = sample()
+    assert encode_default(d["table_id"]) == str(d["table_id"])
+    assert encode_default(d["created_at"]) == str(d["created_at"])
+    assert encode_default(Weird()) == "weird"
+    assert Weird in codec._encoders
+
+
+def test_register_encoder_keeps_other_registrations():
+    class Day(datetime.date):
+        pass
+
+    try:
+        codec.register_encoder(datetime.datetime, lambda dt: "datetime")
+        assert encode_default(datetime.datetime(2021, 3, 1)) == "datetime"
+        codec.register_encoder(datetime.date, lambda d: "date")
+        assert encode_default(datetime.datetime(2021, 3, 1)) == "datetime"
+        assert encode_default(Day(2021, 3, 1)) == "date"
+    finally:
+        codec.register_encoder(datetime.datetime, str)
+        codec.register_encoder(datetime.date, str)
+    assert encode_default(Day(2021, 3, 1)) == "2021-03-01"
+
+
+def test_json_codec_matches_legacy_output():
+    d = sample()
+    assert get_codec("json").dumps(d) == json.dumps(d, sort_keys=True, default=str).encode()
+
+
+@pytest.mark.parametrize("name", list(available_codecs()))
+def test_roundtrip(name):
+    c = get_codec(name)
+    d = sample()
+    data = c.dumps(d)
+    assert isinstance(data, bytes)
+    assert c.loads(data) == json.loads(json.dumps(d, default=str))
+
+
+def test_default_codec():
+    assert get_codec().name in ("orjson", "json")
+    with pytest.raises(AssertionError):
+        get_codec("nope")
+
+
+@pytest.mark.parametrize("name", list(available_codecs()))
+def test_llama_event_bytes(name):
+    c = get_codec(name)
+    evan = EventHandler(symbol="IBM", qty=400)
+    again = EventHandler.from_event_bytes(evan.as_event_bytes(c), c)
+    assert again == evan
+    assert again.table_id == evan.table_id
+    assert again.as_event_json() == evan.as_event_json()
+
+
+@pytest.mark.parametrize("name", list(available_codecs()))
+def test_orm_with_codec(name):
+    eng = orm.engine(echo=False)
+    try:
+        ori = ORM(eng=eng, codec=get_codec(name))
+        ori.add_table(EventHandler, Column("created_at", DateTime(timezone=True)))
+        ori.bootstrap_db()
+
+        events = [EventHandler(symbol="IBM"), EventHandler(symbol="AAPL")]
+        ori.insert(EventHandler, *events)
+        roundtrip = ori.retrieve(EventHandler, *(e.table_id for e in events))
+        assert roundtrip == {e.table_id: e for e in events}
+        assert roundtrip[events[1].table_id].symbol == "AAPL"
+    finally:
+        eng.dispose()
+
+
+COMPRESSIONS = [codec.COMPRESSION_ZLIB] + ([codec.COMPRESSION_ZSTD] if codec.zstandard is not None else [])
+
+
+@pytest.mark.parametrize("algorithm", COMPRESSIONS)
+def test_compressed_codec(algorithm):
+    c = codec.CompressedCodec(algorithm)
+    assert c.name == f"{algorithm}+{get_codec().name}"
+    samples = [sample() for _ in range(300)]
+    d = sample()
+
+    plain = c.dumps(d)
+    assert c.loads(plain) == json.loads(json.dumps(d, default=str))
+
+    c.add_dictionary(1, c.train(samples))
+    trained = c.dumps(d)
+    assert trained[:2] == b"\x00\x01"
+    assert len(trained) < len(plain) < len(c.inner.dumps(d))
+    # older payloads still decompress
+    assert c.loads(plain) == c.loads(trained)
+
+    other = codec.CompressedCodec(algorithm)
+    with pytest.raises(AssertionError):
+        other.loads(trained)
+    other.dictionary_loader = {1: c.dictionaries[1]}.get
+    assert other.loads(trained) == c.loads(trained)
+    assert other.dictionary_id == 0
+
+    with pytest.raises(AssertionError):
+        c.add_dictionary(1, b"something else")
+
+
+@pytest.mark.parametrize("algorithm", COMPRESSIONS)
+def test_lazy_bytes_not_reused_across_compressed_codecs(algorithm):
+    source, target = codec.CompressedCodec(algorithm), codec.CompressedCodec(algorithm)
+    source.add_dictionary(1, source.train([sample() for _ in range(300)]))
+    assert source.name == target.name
+
+    event = EventHandler(symbol="IBM", qty=1)
+    raw = event.as_event_bytes(source)
+    lazy = EventHandler.from_event_bytes(raw, source, lazy=True, table_id=event.table_id)
+    assert lazy.as_event_bytes(source) is raw
+    # the target hasn't got dictionary 1: it has to compress the event itself
+    moved = lazy.as_event_bytes(target)
+    assert target.dictionary_of(moved) == 0
+    assert EventHandler.from_event_bytes(moved, target) == event
+
+
+@pytest.mark.parametrize("algorithm", COMPRESSIONS)
+def test_orm_compressed(algorithm, tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'compressed.sqlite'}"
+    ori = ORM(db_uri=db_uri, echo=False)
+    ori.add_table(EventHandler, codec=codec.CompressedCodec(algorithm))
+    ori.bootstrap_db()
+
+    before = [EventHandler(symbol="IBM", qty=i) for i in range(200)]
+    ori.insert(EventHandler, *before)
+    assert ori.train_dictionary(EventHandler, sample_size=100) == 1
+    after = [EventHandler(symbol="AAPL", qty=i) for i in range(10)]
+    ori.insert(EventHandler, *after)
+
+    events = before + after
+    assert ori.retrieve(EventHandler, *(e.table_id for e in events)) == {e.table_id: e for e in events}
+    lazy = ori.retrieve(EventHandler, after[0].table_id, lazy=True)[after[0].table_id]
+    assert lazy.symbol == "AAPL"
+
+    # another ORM on the same database picks up the dictionary on bootstrap...
+    again = ORM(db_uri=db_uri, echo=False)
+    again.add_table(EventHandler, codec=codec.CompressedCodec(algorithm))
+    again.bootstrap_db()
+    assert again.codecs[EventHandler].dictionary_id == 1
+    # ...and later ones when it first meets them
+    assert ori.train_dictionary(EventHandler, samples=after) == 2
+    newest = EventHandler(symbol="MSFT")
+    ori.insert(EventHandler, newest)
+    assert again.retrieve(EventHandler, newest.table_id)[newest.table_id] == newest
+    assert again.codecs[EventHandler].dictionary_id == 1
+
+    ori.dispose()
+    again.dispose()
+
+
+def test_orm_wide_compression():
+    eng = orm.engine(echo=False)
+    try:
+        shared = codec.CompressedCodec()
+        ori = ORM(eng=eng, codec=shared)
+        ori.add_table(EventHandler)
+        ori.add_table(Number)
+        assert ori.codecs[EventHandler] is not ori.codecs[Number]
+        assert shared not in ori.codecs.values()
+
+        with pytest.raises(AssertionError):
+            ori.add_table(Number, codec=ori.codecs[EventHandler])
+        with pytest.raises(AssertionError):
+            ORM(eng=eng).train_dictionary(EventHandler)
+    finally:
+        eng.dispose()
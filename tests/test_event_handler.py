@@ -70,7 +70,7 @@ def test_log():
     print(stream.getvalue())
     assert (
         stream.getvalue().strip()
-        == f'EventHandler:[{{"created_at": "{mocked_now}", "table_id": "{mock_id}"}}]<msg:initialized>'
+        == f"EventHandler:[{mock_id}]<msg:initialized>"
     )
 
     logger.removeHandler(handler)
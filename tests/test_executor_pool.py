@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+import ray
+
+from llama.executor_pool import ExecutorPool, HashRing, _waves
+from tests.alpaca_stub import AlpacaStub
+
+
+@pytest.fixture(scope="module")
+def local_ray():
+    ray.init(num_cpus=2, include_dashboard=False, log_to_driver=False)
+    yield
+    ray.shutdown()
+
+
+def test_hash_ring():
+    ring = HashRing(replicas=32)
+    for node in "abcd":
+        ring.add(node)
+    assert len(ring) == 4
+    symbols = [f"S{i}" for i in range(1_000)]
+    before = {s: ring.node(s) for s in symbols}
+    assert set(before.values()) == set("abcd")
+
+    ring.remove("b")
+    after = {s: ring.node(s) for s in symbols}
+    # only b's symbols moved
+    assert all(after[s] == before[s] for s in symbols if before[s] != "b")
+    assert "b" not in after.values()
+
+
+def test_waves():
+    orders = [{"symbol": s} for s in ["IBM", "AAPL", "IBM", "IBM", "MSFT", "AAPL"]]
+    assert _waves(list(range(6)), orders) == [[0, 1, 4], [2, 5], [3]]
+
+
+def test_executor_pool(local_ray):
+    with AlpacaStub(latency=0.005) as stub:
+        pool = ExecutorPool(stub.broker(), size=3, max_batch=4, actor_options={"num_cpus": 0})
+        symbols = [f"S{i}" for i in range(12)]
+        orders = [{"side": "buy", "symbol": symbols[i % 12], "qty": i + 1} for i in range(48)]
+
+        results = pool.order_batch(orders)
+        assert [r["order"]["qty"] for r in results] == [o["qty"] for o in orders]
+        assert all(r["external_order_id"] for r in results)
+        assert len(stub.orders) == 48
+        # each symbol's orders reached the broker in the order they were given
+        for symbol in symbols:
+            assert [o["qty"] for o in stub.orders if o["symbol"] == symbol] == [
+                o["qty"] for o in orders if o["symbol"] == symbol
+            ]
+        assert set(pool.queue_depths().values()) == {0}
+        assert pool.order("sell", "S0", 1)["order"]["side"] == "sell"
+
+        # during a batch, the depths show what each actor still has to do
+        depths = []
+
+        def watch():
+            for _ in range(20):
+                depths.append(pool.queue_depths())
+                time.sleep(0.01)
+
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+        pool.order_batch(orders)
+        watcher.join()
+        assert any(sum(d.values()) > 0 for d in depths)
+
+        pool.shutdown()
+
+
+def test_executor_pool_rebalance(local_ray):
+    with AlpacaStub() as stub:
+        pool = ExecutorPool(stub.broker(), size=3, replace_dead=False, actor_options={"num_cpus": 0})
+        victim = pool.actor_for("IBM")
+        ray.kill(pool.actors[victim])
+
+        result = pool.order("buy", "IBM", 5)
+        assert result["external_order_id"]
+        assert pool.stats()["deaths"] == 1
+        assert pool.stats()["actors"] == 2
+        assert pool.actor_for("IBM") != victim
+
+        dead = pool.actor_for("MSFT")
+        ray.kill(pool.actors[dead])
+        assert pool.check(timeout=30) == [dead]
+        assert pool.stats()["actors"] == 1
+        assert pool.order("buy", "MSFT", 1)["external_order_id"]
+        pool.shutdown()
+
+
+def test_executor_pool_death_mid_batch(local_ray):
+    with AlpacaStub(latency=0.05) as stub:
+        pool = ExecutorPool(stub.broker(), size=1, actor_workers=2, actor_options={"num_cpus": 0})
+        orders = [{"side": "buy", "symbol": f"S{i}", "qty": i + 1} for i in range(8)]
+        victim = pool.actor_for("S0")
+        actor = pool.actors[victim]
+
+        def kill():
+            while len(stub.orders) < 2:
+                time.sleep(0.005)
+            ray.kill(actor)
+
+        killer = threading.Thread(target=kill)
+        killer.start()
+        results = pool.order_batch(orders)
+        killer.join()
+
+        assert pool.stats()["deaths"] == 1
+        # what went out before the actor died is found, not sent twice
+        assert all(r["external_order_id"] for r in results)
+        assert len(stub.orders) == 8
+        assert {str(r["external_order_id"]) for r in results} == {o["id"] for o in stub.orders}
+        assert stub.count("GET", "/v2/orders:by_client_order_id") > 0
+        pool.shutdown()
+
+
+def test_executor_pool_task_error(local_ray):
+    with AlpacaStub() as stub:
+        pool = ExecutorPool(stub.broker(), size=2, actor_options={"num_cpus": 0})
+        orders = [{"side": "buy", "symbol": f"S{i}", "qty": 1} for i in range(6)] + [{"side": "buy", "symbol": "BAD"}]
+
+        results = pool.order_batch(orders)
+        assert "qty" in results[-1]["error"]
+        assert all(r is not None for r in results)
+        assert {str(r["external_order_id"]) for r in results if r["external_order_id"]} == {
+            o["id"] for o in stub.orders
+        }
+        assert set(pool.queue_depths().values()) == {0}
+        assert pool.stats()["deaths"] == 0
+        pool.shutdown()
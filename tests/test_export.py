@@ -0,0 +1,174 @@
+import datetime
+import uuid
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+from llama.base import LlamaBase
+from llama.codec import CompressedCodec
+from llama.event_handler import EventHandler
+import llama.export as export
+import llama.orm as orm
+from llama.orm import ORM
+
+
+class Fill(LlamaBase):
+    symbol: str
+    qty: int
+    price: float
+
+    @classmethod
+    def has_timestamp(cls):
+        return True
+
+    @classmethod
+    def db_table_name(cls):
+        return "fills"
+
+
+def file_orm(tmp_path, name: str) -> ORM:
+    return ORM(db_uri=f"sqlite:///{tmp_path / name}", echo=False)
+
+
+@pytest.mark.parametrize("format", [export.FORMAT_ARROW, export.FORMAT_PARQUET])
+@pytest.mark.parametrize("storage", [orm.STORAGE_JSON, orm.STORAGE_COLUMNAR])
+def test_roundtrip(tmp_path, format, storage):
+    source = file_orm(tmp_path, "source.sqlite")
+    source.add_table(Fill, storage=storage)
+    source.bootstrap_db()
+    fills = [Fill(symbol="IBM", qty=i, price=100 + i / 4) for i in range(25)]
+    source.insert(Fill, *fills)
+
+    path = str(tmp_path / f"fills.{format}")
+    stats = export.export_table(source, Fill, path, format=format, row_group_size=10)
+    assert stats["rows"] == 25
+    assert stats["row_groups"] == 3
+    assert stats["bytes"] > 0
+
+    table = export.read_export(path)
+    assert table.num_rows == 25
+    assert table.schema.field("qty").type == pa.int64()
+    assert table.schema.field("created_at").type == pa.timestamp("us", tz="UTC")
+    assert table.column("price").to_pylist() == [f.price for f in fills]
+
+    target = file_orm(tmp_path, "target.sqlite")
+    target.add_table(Fill, storage=orm.STORAGE_COLUMNAR)
+    target.bootstrap_db()
+    assert export.import_table(target, Fill, path, chunk_size=7) == 25
+    assert target.retrieve(Fill, *(f.table_id for f in fills)) == {f.table_id: f for f in fills}
+
+    # a second import of the same file only adds what's missing
+    assert export.import_table(target, Fill, path, on_conflict=orm.ON_CONFLICT_IGNORE) == 0
+
+    source.dispose()
+    target.dispose()
+
+
+class Allocation(LlamaBase):
+    order_id: uuid.UUID
+    note: str
+
+    @classmethod
+    def db_table_name(cls):
+        return "allocations"
+
+
+@pytest.mark.parametrize("storage", [orm.STORAGE_JSON, orm.STORAGE_COLUMNAR])
+def test_none_unset_and_uuid_fields(tmp_path, storage):
+    source = file_orm(tmp_path, "source.sqlite")
+    source.add_table(Allocation, storage=storage)
+    source.bootstrap_db()
+    allocations = [Allocation(order_id=uuid.uuid4(), note=None), Allocation(order_id=uuid.uuid4())]
+    source.insert(Allocation, *allocations)
+
+    path = str(tmp_path / "allocations.arrow")
+    export.export_table(source, Allocation, path)
+    assert export.read_export(path).column(export.UNSET_FIELDS).to_pylist() == [None, ["note"]]
+
+    target = file_orm(tmp_path, "target.sqlite")
+    target.add_table(Allocation, storage=orm.STORAGE_COLUMNAR)
+    target.bootstrap_db()
+    assert export.import_table(target, Allocation, path) == 2
+    roundtrip = target.retrieve(Allocation, *(a.table_id for a in allocations))
+    for a in allocations:
+        assert roundtrip[a.table_id].as_dict() == a.as_dict()
+    # set to None and never set stay apart
+    assert "note" in roundtrip[allocations[0].table_id].as_dict()
+    assert "note" not in roundtrip[allocations[1].table_id].as_dict()
+    assert isinstance(roundtrip[allocations[0].table_id].order_id, uuid.UUID)
+
+    source.dispose()
+    target.dispose()
+
+
+def test_undeclared_fields(tmp_path):
+    source = file_orm(tmp_path, "events.sqlite")
+    source.add_table(EventHandler, codec=CompressedCodec())
+    source.bootstrap_db()
+    events = [
+        EventHandler(symbol="IBM", qty=1, price=10, tags=["a"]),
+        EventHandler(symbol="AAPL", qty=2, price=10.5, tags={"b": 1}, note="mixed"),
+        EventHandler(symbol="MSFT", qty="3", price=11),
+    ]
+    source.insert(EventHandler, *events)
+
+    path = str(tmp_path / "events.arrow")
+    export.export_table(source, EventHandler, path)
+    schema = export.read_export(path).schema
+    assert schema.field("price").type == pa.float64()
+    assert schema.field("symbol").type == pa.string()
+    assert schema.field("tags").metadata == export._JSON
+    assert schema.field("qty").metadata == export._JSON
+
+    target = file_orm(tmp_path, "target.sqlite")
+    target.add_table(EventHandler)
+    target.bootstrap_db()
+    export.import_table(target, EventHandler, path)
+    roundtrip = target.retrieve(EventHandler, *(e.table_id for e in events))
+    assert roundtrip[events[1].table_id].tags == {"b": 1}
+    assert roundtrip[events[2].table_id].qty == "3"
+    assert roundtrip[events[0].table_id].price == 10.0
+    assert "note" not in roundtrip[events[0].table_id].as_dict()
+
+    source.dispose()
+    target.dispose()
+
+
+def test_mixed_row_groups(tmp_path):
+    source = file_orm(tmp_path, "events.sqlite")
+    source.add_table(EventHandler)
+    source.bootstrap_db()
+    # the first row group only has int quantities and no venue at all
+    events = [EventHandler(symbol="IBM", qty=i) for i in range(4)]
+    events += [EventHandler(symbol="IBM", qty=1.5, venue="IEX")]
+    source.insert(EventHandler, *events)
+
+    path = str(tmp_path / "events.arrow")
+    assert export.export_table(source, EventHandler, path, row_group_size=2)["row_groups"] == 3
+    table = export.read_export(path)
+    assert table.schema.field("qty").type == pa.float64()
+    assert table.column("qty").to_pylist() == [0, 1, 2, 3, 1.5]
+    assert table.column("venue").to_pylist() == [None] * 4 + ["IEX"]
+    source.dispose()
+
+
+def test_partitioned_and_empty(tmp_path):
+    source = file_orm(tmp_path, "source.sqlite")
+    source.add_table(Fill, storage=orm.STORAGE_COLUMNAR, partition=orm.PARTITION_DAY)
+    source.bootstrap_db()
+
+    empty = str(tmp_path / "empty.arrow")
+    assert export.export_table(source, Fill, empty)["rows"] == 0
+    assert export.read_export(empty).num_rows == 0
+
+    t0 = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+    fills = [Fill(symbol="IBM", qty=d, price=1.0, created_at=t0 + datetime.timedelta(days=d)) for d in range(3)]
+    source.insert(Fill, *fills)
+    path = str(tmp_path / "fills.parquet")
+    assert export.export_table(source, Fill, path, format=export.FORMAT_PARQUET)["row_groups"] == 3
+    assert sorted(export.read_export(path).column("qty").to_pylist()) == [0, 1, 2]
+
+    with pytest.raises(ValueError):
+        export.read_export(str(tmp_path / "source.sqlite"))
+    source.dispose()
@@ -0,0 +1,93 @@
+import time
+from typing import Callable
+import unittest.mock as mock
+import uuid
+
+from sqlalchemy import Column, DateTime, text
+
+from llama import ids
+from llama.batch import LlamaBatch
+from llama.event_handler import EventHandler
+import llama.orm as orm
+from llama.orm import ORM
+
+
+class OrderedEvent(EventHandler):
+    @classmethod
+    def db_table_name(cls) -> str:
+        return "ordered_events"
+
+    @classmethod
+    def table_id_maker(cls) -> Callable:
+        return ids.uuid7
+
+
+def test_uuid7_layout():
+    before = time.time_ns() // 1_000_000
+    u = ids.uuid7()
+    after = time.time_ns() // 1_000_000
+
+    assert u.version == 7
+    assert u.variant == uuid.RFC_4122
+    assert before <= ids.uuid7_time_ms(u) <= after
+
+
+def test_uuid7_increasing():
+    made = [ids.uuid7() for _ in range(10_000)]
+    assert made == sorted(made)
+    assert len(set(made)) == len(made)
+    assert [str(u) for u in made] == sorted(str(u) for u in made)
+
+
+def test_allocate():
+    gen = ids.UUID7Generator()
+    first = gen()
+    block = gen.allocate(5000)  # more than fits in one millisecond's counter
+    last = gen()
+
+    everything = [first] + block + [last]
+    assert everything == sorted(everything)
+    assert len(set(everything)) == len(everything)
+    assert all(u.version == 7 for u in everything)
+    assert len(gen.allocate_bytes(3)) == 48
+
+
+def test_counter_overflow_within_one_millisecond():
+    gen = ids.UUID7Generator()
+    frozen = 1_700_000_000_000 * 1_000_000
+    with mock.patch.object(time, "time_ns", return_value=frozen):
+        made = [gen() for _ in range(5000)]
+        made += gen.allocate(4096)
+        made.append(gen())
+
+    assert made == sorted(made)
+    assert len(set(made)) == len(made)
+    assert all(u.version == 7 for u in made)
+    assert ids.uuid7_time_ms(made[-1]) == frozen // 1_000_000 + 2
+
+
+def test_batch_uses_allocator():
+    batch = LlamaBatch.build(OrderedEvent, [{"num": i} for i in range(100)])
+    table_ids = list(batch.iter_table_ids())
+    assert all(u.version == 7 for u in table_ids)
+    assert table_ids == sorted(table_ids)
+
+
+def test_orm_binary_ids():
+    eng = orm.engine(echo=False)
+    try:
+        ori = ORM(eng=eng, binary_ids=True)
+        ori.add_table(OrderedEvent, Column("created_at", DateTime(timezone=True)))
+        ori.bootstrap_db()
+
+        events = [OrderedEvent(num=i) for i in range(3)]
+        ori.insert(OrderedEvent, *events)
+
+        with eng.connect() as conn:
+            assert conn.execute(text("SELECT length(id) FROM ordered_events")).scalars().all() == [16] * 3
+
+        for lazy in (False, True):
+            roundtrip = ori.retrieve(OrderedEvent, *(e.table_id for e in events), lazy=lazy)
+            assert roundtrip == {e.table_id: e for e in events}
+    finally:
+        eng.dispose()
@@ -1,11 +1,20 @@
+import gc
 from io import StringIO
 import logging
+import queue
+import threading
+import time
 import uuid
+import weakref
 
 import pytest
 import unittest.mock as mock
 
-from llama.base import LlamaABC, LlamaMixin, LlamaBase
+import llama.logger as llama_logger
+from llama.abstract_base import ABCMeta, abstract_attribute
+from llama.base import LlamaABC, LlamaMixin, LlamaBase, CompactLlamaBase, slotted
+from llama.codec import get_codec
+from llama.schema import schema_of
 
 
 def test_abc():
@@ -13,6 +22,33 @@ def test_abc():
         LlamaABC()
 
 
+class WithAbstractAttribute(metaclass=ABCMeta):
+    needed = abstract_attribute()
+
+    def __init__(self, needed=None):
+        if needed is not None:
+            self.needed = needed
+
+
+def test_abstract_attribute():
+    with pytest.raises(NotImplementedError) as nie:
+        WithAbstractAttribute()
+    assert "needed" in str(nie.value)
+
+    assert WithAbstractAttribute("provided").needed == "provided"
+    assert WithAbstractAttribute.__dict__["__abstract_attribute_names__"] == {"needed"}
+
+    LlamaBase()
+    assert LlamaBase.__dict__["__abstract_attribute_names__"] == frozenset()
+
+    # the cached names are what gets checked from then on
+    class Sneaky(WithAbstractAttribute):
+        pass
+
+    type.__setattr__(Sneaky, "__abstract_attribute_names__", frozenset())
+    assert isinstance(Sneaky(), Sneaky)
+
+
 class ImmutableNumber(LlamaMixin):
     def __init__(self, num):
         super(ImmutableNumber, self).__init__(num=num)
@@ -112,80 +148,330 @@ def test_class_hierarchy():
 def test_logging():
     original_logging_level = logging.root.level
 
-    # Under default logging level, as_dict() isn't called even though log() is
+    # Under default logging level, nothing reaches the logger - let alone as_dict()
     assert logging.root.level == logging.WARN, logging.root.level
 
-    with mock.patch.object(logging, "log") as log:
+    with mock.patch.object(llama_logger._logger, "log") as log:
         nas = NumberAndString.from_event_json('{"num": 42, "string": "hiya"}')
     assert isinstance(nas, NumberAndString), type(nas)
-    log.assert_called_once_with(logging.INFO, "%s:[%s]<msg:%s>", "NumberAndString", nas, "initialized")
-
-    with mock.patch.object(LlamaMixin, "as_dict") as as_dict:
-        nas = NumberAndString.from_event_json('{"num": 42, "string": "hiya"}')
-    assert isinstance(nas, NumberAndString), type(nas)
-    as_dict.assert_not_called()
-
-    with mock.patch.object(logging, "log") as log:
-        nas = NumberAndString()
-    assert isinstance(nas, NumberAndString), type(nas)
-    log.assert_called_once_with(logging.INFO, "%s:[%s]<msg:%s>", "NumberAndString", nas, "initialized")
+    log.assert_not_called()
 
     with mock.patch.object(LlamaMixin, "as_dict") as as_dict:
         nas = NumberAndString()
     assert isinstance(nas, NumberAndString), type(nas)
     as_dict.assert_not_called()
 
-    # Under DEBUG logging level, as_dict() is ALSO called
+    # Under DEBUG logging level, the record is logged with the llama's identity only...
     logging.root.setLevel(logging.DEBUG)
     assert logging.root.level == logging.DEBUG, logging.root.level
 
-    with mock.patch.object(logging, "log") as log:
-        nas = NumberAndString.from_event_json('{"num": 42, "string": "hiya"}')
+    with mock.patch.object(llama_logger._logger, "log") as log:
+        nas = NumberAndString()
     assert isinstance(nas, NumberAndString), type(nas)
-    log.assert_called_once_with(logging.INFO, "%s:[%s]<msg:%s>", "NumberAndString", nas, "initialized")
+    log.assert_called_once()
+    level, fmt, qualifier, shown, msg = log.call_args.args
+    assert (level, fmt, qualifier, msg) == (logging.INFO, "%s:[%s]<msg:%s>", "NumberAndString", "initialized")
+    assert str(shown) == str(nas.table_id)
 
     with mock.patch.object(LlamaMixin, "as_dict") as as_dict:
         nas = NumberAndString.from_event_json('{"num": 42, "string": "hiya"}')
+        str(nas.table_id)
     assert isinstance(nas, NumberAndString), type(nas)
-    as_dict.assert_called()
-
-    with mock.patch.object(logging, "log") as log:
-        nas = NumberAndString()
-    assert isinstance(nas, NumberAndString), type(nas)
-    log.assert_called_once_with(logging.INFO, "%s:[%s]<msg:%s>", "NumberAndString", nas, "initialized")
+    as_dict.assert_not_called()
 
-    with mock.patch.object(LlamaMixin, "as_dict") as as_dict:
+    # ... unless the full payload is asked for
+    with mock.patch.object(llama_logger._logger, "log") as log:
         nas = NumberAndString()
-    assert isinstance(nas, NumberAndString), type(nas)
-    as_dict.assert_called()
+        nas.log(msg="payload please", payload=True)
+    log.assert_called_with(logging.INFO, "%s:[%s]<msg:%s>", "NumberAndString", nas, "payload please")
 
     # reset the logging level to where it was
     logging.root.setLevel(original_logging_level)
 
 
-def test_log():
-    logger = logging.root
-    original_logging_level = logger.level
-
+def _capture_root_log(level=logging.INFO):
     stream = StringIO()
     handler = logging.StreamHandler(stream)
-    logger.setLevel(logging.INFO)
-    logger.removeHandler(handler)
-    logger.addHandler(handler)
+    logging.root.setLevel(level)
+    logging.root.addHandler(handler)
+    return stream, handler
+
+
+def _release_root_log(handler, level):
+    logging.root.removeHandler(handler)
+    handler.close()
+    logging.root.setLevel(level)
+
+
+def test_log():
+    original_logging_level = logging.root.level
+    stream, handler = _capture_root_log()
 
     mock_id = "I think, therefore I am"
     with mock.patch.object(uuid, "uuid4", mock.Mock(wraps=uuid.uuid4)) as patched_id:
         patched_id.return_value = mock_id
 
         NumberAndString.from_event_json('{"num": 42, "string": "hiya"}')
-
         handler.flush()
-        print(stream.getvalue())
+        assert stream.getvalue().strip() == f"NumberAndString:[{mock_id}]<msg:initialized>"
+
+        stream.truncate(0)
+        stream.seek(0)
+        llama_logger.log_payloads(True)
+        try:
+            NumberAndString.from_event_json('{"num": 42, "string": "hiya"}')
+        finally:
+            llama_logger.log_payloads(False)
+        handler.flush()
         assert (
             stream.getvalue().strip()
             == f'NumberAndString:[{{"num": 42, "string": "hiya", "table_id": "{mock_id}"}}]<msg:initialized>'
         )
 
-        logger.removeHandler(handler)
-        handler.close()
-        logging.root.setLevel(original_logging_level)
+    _release_root_log(handler, original_logging_level)
+
+
+def test_log_throttle():
+    original_logging_level = logging.root.level
+    stream, handler = _capture_root_log()
+
+    llama_logger.throttle("NumberAndString", every=10)
+    try:
+        for _ in range(25):
+            NumberAndString()
+        assert llama_logger.suppressed("NumberAndString") == 22
+    finally:
+        llama_logger.unthrottle()
+    handler.flush()
+    assert len(stream.getvalue().strip().splitlines()) == 3
+
+    _release_root_log(handler, original_logging_level)
+
+
+def test_background_logging_snapshots_args():
+    q = queue.Queue()
+    handler = llama_logger._NonFormattingQueueHandler(q)
+    nas = NumberAndString()
+    args = ("NumberAndString", nas, "initialized")
+    handler.emit(logging.LogRecord("llama", logging.INFO, __file__, 0, llama_logger.FORMAT, args, None))
+    nas.num = 43
+    # what the listener formats later is what was logged, not what the llama has become since
+    assert '"num": 42' in q.get_nowait().getMessage()
+
+
+def test_background_logging():
+    original_logging_level = logging.root.level
+    stream, handler = _capture_root_log()
+
+    llama_logger.start_background_logging([handler])
+    try:
+        nas = NumberAndString()
+        with pytest.raises(AssertionError):
+            llama_logger.start_background_logging([handler])
+    finally:
+        llama_logger.stop_background_logging()
+    assert stream.getvalue().strip() == f"NumberAndString:[{nas.table_id}]<msg:initialized>"
+    assert llama_logger.dropped() == 0
+
+    _release_root_log(handler, original_logging_level)
+
+
+def test_as_dict_schema_picks_up_new_attributes():
+    nas = NumberAndString()
+    assert set(nas.as_dict().keys()) == {"num", "string", "table_id"}
+
+    nas.late_arrival = "better late than never"
+    assert nas.as_dict()["late_arrival"] == "better late than never"
+
+    nas.a_callable = lambda: None
+    assert "a_callable" not in nas.as_dict()
+
+    assert set(NumberAndString().as_dict().keys()) == {"num", "string", "table_id"}
+
+
+def test_schema_caches_are_bounded():
+    layouts = schema_of(NumberAndString, ()).max_layouts
+    for i in range(layouts + 10):
+        nas = NumberAndString()
+        setattr(nas, f"attr_{i}", i)
+        assert nas.as_dict()[f"attr_{i}"] == i
+    assert len(schema_of(NumberAndString, ())._layouts) == layouts
+
+    Dynamic = type("Dynamic", (LlamaMixin,), {})
+    Dynamic().as_dict()
+    ref = weakref.ref(Dynamic)
+    del Dynamic
+    gc.collect()
+    assert ref() is None
+
+
+class WithClassField(LlamaMixin):
+    venue = "IEX"
+
+
+def test_as_dict_includes_class_fields():
+    wcf = WithClassField(num=42)
+    d = wcf.as_dict()
+    assert d["venue"] == "IEX"
+    assert d["num"] == 42
+    assert "json_excludes" not in d
+
+
+@slotted("symbol", "price")
+class Quote(CompactLlamaBase):
+    @classmethod
+    def has_timestamp(cls):
+        return True
+
+    def __init__(self, symbol, price):
+        super().__init__(symbol=symbol, price=price)
+
+
+def test_slotted():
+    q = Quote("IBM", 128.73)
+    assert not hasattr(q, "__dict__")
+    assert isinstance(q, LlamaABC)
+    assert q.symbol == "IBM"
+    assert hasattr(q, "created_at")
+
+    with pytest.raises(AttributeError):
+        q.price = 1.0
+
+    with pytest.raises(AttributeError):
+        Quote.from_event_json('{"symbol": "IBM", "not_a_field": 1}')
+
+    assert set(q.as_dict().keys()) == {"created_at", "price", "symbol", "table_id"}
+
+
+def test_slotted_roundtrip():
+    q = Quote("IBM", 128.73)
+    q2 = Quote.from_event_json(q.as_event_json())
+    assert q2 == q
+    assert q2.as_event_json() == q.as_event_json()
+
+    partial = Quote.from_event_json('{"symbol": "AAPL"}')
+    assert "price" not in partial.as_dict()
+    assert partial.as_dict()["symbol"] == "AAPL"
+
+
+def test_slotted_keeps_qualname():
+    class Outer:
+        @slotted("num")
+        class Inner(CompactLlamaBase):
+            pass
+
+    assert Outer.Inner.__qualname__.endswith("Outer.Inner")
+    assert Outer.Inner.__module__ == __name__
+    assert Outer.Inner.db_table_name() == Outer.Inner.__qualname__.lower()
+    assert Outer.Inner.db_table_name().endswith("outer.inner")
+
+
+def test_slotted_needs_compact_base():
+    with pytest.raises(TypeError):
+
+        @slotted("num")
+        class NotCompact(LlamaBase):
+            pass
+
+
+def test_lazy_from_event_json():
+    nas = NumberAndString()
+    raw = nas.as_event_json()
+
+    with mock.patch.object(ImmutableNumber, "_hydrate_from_event_json") as hydrate:
+        lazy = ImmutableNumber.from_event_json(raw, lazy=True, table_id=nas.table_id)
+        assert lazy.table_id == nas.table_id
+        assert lazy.as_event_json() == raw
+        hydrate.assert_not_called()
+
+    assert lazy._event_pending is True
+    assert lazy.string == "hiya"
+    assert lazy._event_pending is False
+    assert lazy.as_dict() == nas.as_dict()
+    assert lazy.as_event_json() is raw
+
+    with pytest.raises(AttributeError):
+        lazy.not_a_field
+
+
+def test_lazy_without_table_id_decodes_right_away():
+    nas = NumberAndString()
+    lazy = ImmutableNumber.from_event_json(nas.as_event_json().encode(), lazy=True)
+    assert lazy._event_pending is False
+    assert lazy.table_id == nas.table_id
+    assert lazy.as_event_json() == nas.as_event_json()
+
+
+def test_lazy_mutable_drops_raw_event():
+    nas = NumberAndString()
+    lazy = NumberAndString.from_event_json(nas.as_event_json(), lazy=True, table_id=nas.table_id)
+    lazy.num = 43
+    assert lazy.string == "hiya"
+    assert '"num": 43' in lazy.as_event_json()
+
+
+class WithDefault(LlamaMixin):
+    venue = "IEX"
+
+
+def test_from_fields_skips_init():
+    table_id = uuid.uuid4()
+    with mock.patch.object(uuid, "uuid4") as patched_id, mock.patch.object(llama_logger, "log") as log:
+        nas = NumberAndString.from_fields({"num": 42, "string": None, "table_id": table_id})
+    patched_id.assert_not_called()
+    log.assert_not_called()
+    assert nas.as_dict() == {"num": 42, "string": None, "table_id": table_id}
+
+
+def test_lazy_class_field_not_hidden():
+    nas = WithDefault(venue="NYSE")
+    lazy = WithDefault.from_event_json(nas.as_event_json(), lazy=True, table_id=nas.table_id)
+    assert lazy.venue == "NYSE"
+
+
+def test_lazy_hydration_across_threads():
+    nas = NumberAndString()
+    lazy = ImmutableNumber.from_event_json(nas.as_event_json(), lazy=True, table_id=nas.table_id)
+    hydrate = ImmutableNumber._hydrate_from_event_json
+    started = threading.Event()
+
+    def slow_hydrate(self, j, codec=None):
+        started.set()
+        time.sleep(0.05)
+        hydrate(self, j, codec=codec)
+
+    seen = []
+    with mock.patch.object(ImmutableNumber, "_hydrate_from_event_json", slow_hydrate):
+        first = threading.Thread(target=lambda: seen.append(lazy.num))
+        first.start()
+        started.wait()
+        # the first thread is mid hydration: this one waits for it rather than finding nothing there
+        seen.append(lazy.string)
+        first.join()
+    assert sorted(seen, key=str) == sorted([nas.num, nas.string], key=str)
+
+
+def test_lazy_orjson_as_event_json_is_canonical():
+    pytest.importorskip("orjson")
+    orjson_codec = get_codec("orjson")
+    nas = NumberAndString()
+    raw = nas.as_event_bytes(orjson_codec)
+    lazy = ImmutableNumber.from_event_bytes(raw, codec=orjson_codec, lazy=True, table_id=nas.table_id)
+    assert lazy.as_event_json() == nas.as_event_json()
+    assert lazy.as_event_bytes(orjson_codec) is raw
+
+
+def test_lazy_slotted():
+    with pytest.raises(TypeError):
+        Quote.from_event_json(Quote("IBM", 1.0).as_event_json(), lazy=True)
+
+
+@slotted()
+class AnnotatedQuote(CompactLlamaBase):
+    symbol: str
+    bid: float
+
+
+def test_slotted_from_annotations():
+    assert AnnotatedQuote.__slots__ == ("table_id", "symbol", "bid")
+    assert AnnotatedQuote(symbol="IBM").as_dict().keys() == {"symbol", "table_id"}
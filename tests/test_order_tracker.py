@@ -0,0 +1,108 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from llama.order_tracker import OrderTracker, stream_url
+from llama.trader import TradeExecutor
+from tests.alpaca_stub import AlpacaStub, TradeUpdatesStub
+
+
+def test_stream_url():
+    assert stream_url("https://paper-api.alpaca.markets") == "wss://paper-api.alpaca.markets/stream"
+    assert stream_url("http://127.0.0.1:8080/") == "ws://127.0.0.1:8080/stream"
+
+
+def test_track_orders():
+    async def go(stub: AlpacaStub, stream: TradeUpdatesStub):
+        teena = TradeExecutor(stub.broker())
+        before = teena.order("buy", "AAPL", 1)
+
+        tracker = OrderTracker(stub.broker(), url=stream.url)
+        await tracker.start()
+        # orders from before the tracker started come in with the resync
+        assert tracker.get(client_order_id=before["order"]["client_order_id"])["status"] == "accepted"
+
+        bundle = teena.order("buy", "IBM", 10)
+        client_order_id = bundle["order"]["client_order_id"]
+        waiting = asyncio.create_task(tracker.wait_for(client_order_id=client_order_id, timeout=5))
+        new = asyncio.create_task(tracker.wait_for(external_order_id=bundle["external_order_id"], states=["new"]))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+
+        await asyncio.to_thread(stream.push, "new", stub.orders[-1])
+        assert (await new)["status"] == "new"
+        assert not waiting.done()
+        await asyncio.to_thread(stream.push, "fill", stub.orders[-1], "filled")
+        filled = await waiting
+        assert filled["status"] == "filled"
+        assert tracker.get(external_order_id=bundle["external_order_id"]) == filled
+        # already there
+        assert await tracker.wait_for(client_order_id=client_order_id, timeout=0.01) == filled
+
+        with pytest.raises(asyncio.TimeoutError):
+            await tracker.wait_for(client_order_id=before["order"]["client_order_id"], timeout=0.05)
+
+        await tracker.stop()
+
+    with AlpacaStub() as stub, TradeUpdatesStub(stub) as stream:
+        asyncio.run(go(stub, stream))
+
+
+def test_reconnect_and_resync():
+    async def go(stub: AlpacaStub, stream: TradeUpdatesStub):
+        teena = TradeExecutor(stub.broker())
+        tracker = OrderTracker(stub.broker(), url=stream.url, reconnect_delay=0.05)
+        await tracker.start()
+        bundle = teena.order("sell", "MSFT", 3)
+        waiting = asyncio.create_task(tracker.wait_for(client_order_id=bundle["order"]["client_order_id"], timeout=5))
+        # what the tracker has from the stream...
+        await asyncio.to_thread(stream.push, "new", stub.orders[-1])
+        await asyncio.sleep(0.05)
+        assert tracker.get(client_order_id=bundle["order"]["client_order_id"])["status"] == "new"
+
+        # ...is older than the fill, whose update never makes it out before the connection drops: the resync
+        # finds it
+        with stub.lock:
+            stub.orders[-1].update(status="filled", updated_at=datetime.now(timezone.utc).isoformat())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        await asyncio.to_thread(stream.drop)
+        assert (await waiting)["status"] == "filled"
+        assert tracker.connects == 2
+        assert tracker.resyncs == 2
+        assert stream.connections == 2
+
+        await tracker.stop()
+        assert not tracker.connected
+
+    with AlpacaStub() as stub, TradeUpdatesStub(stub) as stream:
+        asyncio.run(go(stub, stream))
+
+
+def test_malformed_messages():
+    async def go(stub: AlpacaStub, stream: TradeUpdatesStub):
+        teena = TradeExecutor(stub.broker())
+        tracker = OrderTracker(stub.broker(), url=stream.url)
+        await tracker.start()
+        bundle = teena.order("buy", "AAPL", 1)
+        order = dict(stub.orders[-1], updated_at="not a time")
+        for message in (
+            "not json",
+            json.dumps({"stream": "trade_updates", "data": {}}),
+            json.dumps({"stream": "trade_updates", "data": {"event": "new", "order": order}}),
+        ):
+            await asyncio.to_thread(stream._call, stream._broadcast(message))
+
+        # the tracker logs and skips them, on the same connection
+        await asyncio.to_thread(stream.push, "fill", stub.orders[-1], "filled")
+        filled = await tracker.wait_for(client_order_id=bundle["order"]["client_order_id"], timeout=5)
+        assert filled["status"] == "filled"
+        assert tracker.connected
+        assert tracker.connects == 1
+
+        await tracker.stop()
+
+    with AlpacaStub() as stub, TradeUpdatesStub(stub) as stream:
+        asyncio.run(go(stub, stream))
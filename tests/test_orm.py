@@ -1,6 +1,8 @@
 import contextlib
-from sqlalchemy import text, Table, insert, Column, Integer, DateTime
-from sqlalchemy.exc import OperationalError
+import datetime
+import threading
+from sqlalchemy import text, Table, insert, select, Column, Integer, DateTime
+from sqlalchemy.exc import IntegrityError, OperationalError
 import uuid
 
 import pytest
@@ -191,3 +193,502 @@ def test_insert_and_retrieve():
                 result = comconn.execute(text("SELECT * FROM yomama"))
 
             assert "no such table: yomama" in str(oe.value)
+
+
+def test_retrieve_lazy():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        ori.add_table(EventHandler, Column("created_at", DateTime(timezone=True)))
+        ori.bootstrap_db()
+
+        some_events = [EventHandler(event_json='{"yo": "mama"}'), EventHandler(event_json='{"yo": "dada"}')]
+        ori.insert(EventHandler, *some_events)
+
+        lazies = ori.retrieve(EventHandler, *(e.table_id for e in some_events), lazy=True)
+        assert lazies == {e.table_id: e for e in some_events}
+        for e in some_events:
+            lazy = lazies[e.table_id]
+            assert lazy._event_pending is True
+            assert lazy.as_event_json() == e.as_event_json()
+            assert lazy.yo == e.yo
+            assert lazy._event_pending is False
+
+
+def test_insert_many():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        ori.add_table(ImmutableNumber, Column("num", Integer))
+        ori.bootstrap_db()
+
+        reports = []
+        inserted = ori.insert_many(
+            ImmutableNumber, (ImmutableNumber(i) for i in range(25)), chunk_size=10, progress=reports.append
+        )
+        assert inserted == 25
+        assert [r.inserted for r in reports] == [10, 10, 5]
+        assert [r.total_inserted for r in reports] == [10, 20, 25]
+        assert all(r.skipped == [] for r in reports)
+
+        with eng.connect() as conn:
+            assert conn.execute(text("SELECT count(*), sum(num) FROM yomama")).one() == (25, 300)
+
+
+def test_insert_many_bad_rows():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        ori.add_table(ImmutableNumber, Column("num", Integer))
+        ori.bootstrap_db()
+
+        dupe = ImmutableNumber(0)
+        ori.insert(ImmutableNumber, dupe)
+
+        with pytest.raises(AssertionError):
+            ori.insert_many(ImmutableNumber, [ImmutableNumber(1), EventHandler()])
+
+        reports = []
+        rows = [ImmutableNumber(1), EventHandler(), ImmutableNumber(2), dupe, ImmutableNumber(3)]
+        inserted = ori.insert_many(ImmutableNumber, rows, chunk_size=3, progress=reports.append, skip_bad_rows=True)
+        assert inserted == 3
+        assert [len(r.skipped) for r in reports] == [1, 1]
+        assert reports[0].skipped[0][0] == 1
+        assert reports[1].skipped[0][0] == str(dupe.table_id)
+
+        with eng.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM yomama")).scalar() == 4
+
+
+def test_retrieve_many_ids():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng, echo=False)
+        ori.add_table(ImmutableNumber, Column("num", Integer))
+        ori.bootstrap_db()
+
+        numbers = [ImmutableNumber(i) for i in range(2500)]
+        ori.insert_many(ImmutableNumber, numbers)
+
+        roundtrip = ori.retrieve(ImmutableNumber, *(n.table_id for n in numbers), uuid.uuid4())
+        assert len(roundtrip) == 2500
+        assert roundtrip == {n.table_id: n for n in numbers}
+
+
+def test_stream():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        table = ori.add_table(ImmutableNumber, Column("num", Integer))
+        ori.bootstrap_db()
+
+        numbers = [ImmutableNumber(i) for i in range(25)]
+        rows = [ori.transform(n) for n in numbers]
+        for i, row in enumerate(rows):
+            row["saved_at"] = datetime.datetime(2021, 1, 1 + i)
+        with eng.begin() as conn:
+            conn.execute(insert(table), rows)
+
+        batches = list(ori.stream(ImmutableNumber, batch_size=10))
+        assert [len(b) for b in batches] == [10, 10, 5]
+        assert [n.table_id for b in batches for n in b] == [n.table_id for n in numbers]
+
+        in_range = [
+            n
+            for b in ori.stream(
+                ImmutableNumber,
+                saved_from=datetime.datetime(2021, 1, 5),
+                saved_to=datetime.datetime(2021, 1, 8, tzinfo=datetime.timezone.utc),
+            )
+            for n in b
+        ]
+        assert [n.num for n in in_range] == [4, 5, 6]
+
+        some = [n for b in ori.stream(ImmutableNumber, ids=(n.table_id for n in numbers[:3]), lazy=True) for n in b]
+        assert sorted(n.num for n in some) == [0, 1, 2]
+
+
+def test_stream_server_set_saved_at():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        table = ori.add_table(ImmutableNumber, Column("num", Integer))
+        ori.bootstrap_db()
+        ori.insert(ImmutableNumber, ImmutableNumber(1))
+        with eng.connect() as conn:
+            saved_at = conn.execute(select(table.c.saved_at)).scalar()
+
+        def nums(**bounds):
+            return [n.num for b in ori.stream(ImmutableNumber, **bounds) for n in b]
+
+        # the row falls inside its own second, on either side of its exact saved_at
+        assert nums(saved_from=saved_at) == [1]
+        assert nums(saved_to=saved_at) == []
+        assert nums(saved_to=saved_at + datetime.timedelta(microseconds=1)) == [1]
+        assert nums(saved_from=saved_at.replace(microsecond=0), saved_to=saved_at) == []
+
+
+def test_sqlite_profile(tmp_path):
+    profile = orm.SQLiteProfile(readers=2)
+    ori = ORM(db_uri=f"sqlite+pysqlite:///{tmp_path / 'profiled.sqlite'}", echo=False, profile=profile)
+    try:
+        assert ori.read_engine is not ori.engine
+        ori.add_table(ImmutableNumber, Column("num", Integer))
+        ori.bootstrap_db()
+
+        with ori.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA mmap_size")).scalar() == profile.mmap_size
+
+        with ori.read_engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("DELETE FROM yomama"))
+
+        numbers = [ImmutableNumber(i) for i in range(10)]
+        ori.insert(ImmutableNumber, *numbers)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(ori.retrieve(ImmutableNumber, *(n.table_id for n in numbers))))
+            for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [{n.table_id: n for n in numbers}] * 4
+
+        # nested streams beyond `readers` get overflow connections rather than waiting forever
+        nested = [
+            [n.num for b in ori.stream(ImmutableNumber, batch_size=3) for n in b]
+            for _ in ori.stream(ImmutableNumber, batch_size=3)
+            for _ in ori.stream(ImmutableNumber, batch_size=5)
+        ]
+        assert len(nested) == 8
+        assert all(sorted(nums) == list(range(10)) for nums in nested)
+    finally:
+        ori.dispose()
+
+    with pytest.raises(AssertionError):
+        ORM(profile=profile)
+
+    quiet = ORM(db_uri=f"sqlite+pysqlite:///{tmp_path / 'quiet.sqlite'}", profile=profile)
+    assert not quiet.engine.echo and not quiet.read_engine.echo
+    quiet.dispose()
+
+
+class Quote(LlamaBase):
+    symbol: str
+    price: float
+    size: int
+
+    @classmethod
+    def has_timestamp(cls):
+        return True
+
+    @classmethod
+    def db_table_name(cls):
+        return "quotes"
+
+
+def test_generated_storage():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        table = ori.add_table(Quote, storage=orm.STORAGE_GENERATED, indexes=["symbol"])
+        assert table.c.symbol.computed is not None
+        ori.bootstrap_db()
+
+        quotes = [Quote(symbol="IBM", price=128.5, size=100), Quote(symbol="AAPL", price=150.25)]
+        ori.insert(Quote, *quotes)
+
+        with eng.connect() as conn:
+            assert conn.execute(text("SELECT price FROM quotes WHERE symbol = 'IBM'")).scalar() == 128.5
+            assert conn.execute(text("SELECT size FROM quotes WHERE symbol = 'AAPL'")).scalar() is None
+            plan = conn.execute(text("EXPLAIN QUERY PLAN SELECT id FROM quotes WHERE symbol = 'IBM'")).all()
+            assert "ix_quotes_symbol" in str(plan)
+
+        assert ori.retrieve(Quote, *(q.table_id for q in quotes)) == {q.table_id: q for q in quotes}
+
+
+def test_columnar_storage():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        table = ori.add_table(Quote, storage=orm.STORAGE_COLUMNAR, indexes=["symbol", "created_at"])
+        assert "event" not in table.c
+        assert {"symbol", "price", "size", "created_at"} <= set(table.c.keys())
+        ori.bootstrap_db()
+
+        quotes = [Quote(symbol="IBM", price=128.5, size=100), Quote(symbol="AAPL", price=150.25)]
+        ori.insert(Quote, *quotes)
+
+        with eng.connect() as conn:
+            assert conn.execute(text("SELECT price FROM quotes WHERE symbol = 'IBM'")).scalar() == 128.5
+
+        roundtrip = ori.retrieve(Quote, *(q.table_id for q in quotes))
+        for q in quotes:
+            assert roundtrip[q.table_id].as_dict() == q.as_dict()
+
+        with pytest.raises(AssertionError):
+            ori.insert(Quote, Quote(symbol="IBM", venue="IEX"))
+
+
+class Fill(LlamaBase):
+    order_id: uuid.UUID
+    filled_at: datetime.datetime
+    note: str
+
+    @classmethod
+    def db_table_name(cls):
+        return "fills"
+
+
+@pytest.mark.parametrize("storage", [orm.STORAGE_GENERATED, orm.STORAGE_COLUMNAR])
+def test_typed_columns(storage):
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        table = ori.add_table(Fill, storage=storage, indexes=["order_id"])
+        ori.bootstrap_db()
+
+        order_id = uuid.uuid4()
+        filled_at = datetime.datetime(2021, 3, 1, 12, 30, tzinfo=datetime.timezone.utc)
+        fill = Fill(order_id=order_id, filled_at=filled_at, note=None)
+        unset = Fill(order_id=uuid.uuid4())
+        ori.insert(Fill, fill, unset)
+
+        with eng.connect() as conn:
+            row = conn.execute(select(table.c.order_id, table.c.filled_at).where(table.c.order_id == order_id)).one()
+        assert row.order_id == order_id
+        assert row.filled_at == filled_at
+
+        found = [f for batch in ori.query(Fill, equals={"order_id": order_id}) for f in batch]
+        assert found == [fill]
+        roundtrip = ori.retrieve(Fill, fill.table_id, unset.table_id)
+        # set to None isn't the same as never set
+        assert roundtrip[fill.table_id].as_dict()["note"] is None
+        assert "note" not in roundtrip[unset.table_id].as_dict()
+        if storage == orm.STORAGE_COLUMNAR:
+            assert roundtrip[fill.table_id].as_dict() == fill.as_dict()
+            assert roundtrip[unset.table_id].as_dict() == unset.as_dict()
+
+
+@pytest.mark.parametrize("storage", [orm.STORAGE_GENERATED, orm.STORAGE_COLUMNAR])
+def test_query(storage):
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        ori.add_table(Quote, storage=storage, indexes=[("symbol", "created_at"), "saved_at"])
+        ori.bootstrap_db()
+
+        t0 = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+        quotes = [
+            Quote(symbol=symbol, price=float(day), created_at=t0 + datetime.timedelta(days=day))
+            for day in range(10)
+            for symbol in ("IBM", "AAPL")
+        ]
+        ori.insert(Quote, *quotes)
+
+        t1 = t0 + datetime.timedelta(days=3)
+        t2 = t0 + datetime.timedelta(days=6)
+        found = [
+            q
+            for batch in ori.query(
+                Quote,
+                equals={"symbol": "IBM"},
+                between={"created_at": (t1, t2)},
+                order_by="created_at",
+                descending=True,
+                batch_size=2,
+            )
+            for q in batch
+        ]
+        assert [q.price for q in found] == [5.0, 4.0, 3.0]
+        assert all(q.symbol == "IBM" for q in found)
+
+        open_ended = [q for batch in ori.query(Quote, between={"created_at": (None, t1)}) for q in batch]
+        assert len(open_ended) == 6
+
+        assert len([q for b in ori.query(Quote, equals={"symbol": "AAPL"}, limit=4) for q in b]) == 4
+
+        with eng.connect() as conn:
+            plan = conn.execute(
+                text("EXPLAIN QUERY PLAN SELECT id FROM quotes WHERE symbol = 'IBM' AND created_at >= '2021'")
+            ).all()
+            assert "ix_quotes_symbol_created_at" in str(plan)
+
+        with pytest.raises(AssertionError):
+            next(ori.query(Quote, equals={"venue": "IEX"}))
+
+
+def test_partition_start():
+    t = datetime.datetime(2021, 3, 4, 15, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-5)))
+    assert orm._partition_start(orm.PARTITION_DAY, t) == datetime.datetime(2021, 3, 4, 0, 0, tzinfo=datetime.timezone.utc)
+    assert orm._partition_start(orm.PARTITION_WEEK, t) == datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+    # late evening in New York is already the next day in UTC
+    late = t.replace(hour=21)
+    assert orm._partition_start(orm.PARTITION_DAY, late).day == 5
+
+
+@pytest.mark.parametrize("storage", [orm.STORAGE_GENERATED, orm.STORAGE_COLUMNAR])
+def test_partitioned_storage(storage, tmp_path):
+    db_uri = f"sqlite:///{tmp_path / 'events.db'}"
+    ori = ORM(db_uri=db_uri, echo=False)
+    ori.add_table(Quote, storage=storage, indexes=[("symbol", "created_at")], partition=orm.PARTITION_DAY)
+    ori.bootstrap_db()
+
+    t0 = datetime.datetime(2021, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    quotes = [
+        Quote(symbol=symbol, price=float(day), size=day, created_at=t0 + datetime.timedelta(days=day))
+        for day in range(10)
+        for symbol in ("IBM", "AAPL")
+    ]
+    ori.insert(Quote, *quotes[:10])
+    assert ori.insert_many(Quote, quotes[10:], chunk_size=3) == 10
+
+    partitions = ori.partitions(Quote)
+    assert [table.name for table in partitions.values()] == [f"quotes_p202103{d:02d}" for d in range(1, 11)]
+    with ori.engine.connect() as conn:
+        names = {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master"))}
+    assert "quotes" not in names
+    assert {"quotes_p20210301", "ix_quotes_p20210301_symbol_created_at"} <= names
+
+    assert ori.retrieve(Quote, *(q.table_id for q in quotes)) == {q.table_id: q for q in quotes}
+    assert sum(len(batch) for batch in ori.stream(Quote, batch_size=4)) == 20
+
+    t1, t2 = t0 + datetime.timedelta(days=3), t0 + datetime.timedelta(days=6)
+    assert [t.name for t in ori.read_tables(Quote, t1, t2)] == [f"quotes_p202103{d:02d}" for d in (4, 5, 6, 7)]
+    found = [
+        q
+        for batch in ori.query(
+            Quote,
+            equals={"symbol": "IBM"},
+            between={"created_at": (t1, t2)},
+            order_by="created_at",
+            descending=True,
+        )
+        for q in batch
+    ]
+    assert [q.price for q in found] == [5.0, 4.0, 3.0]
+    assert [q.size for b in ori.query(Quote, order_by="created_at", limit=3) for q in b] == [0, 0, 1]
+    assert list(ori.query(Quote, between={"created_at": (t0 + datetime.timedelta(days=30), None)})) == []
+
+    # a fresh ORM finds the partitions already in the database
+    again = ORM(db_uri=db_uri, echo=False)
+    again.add_table(Quote, storage=storage, indexes=[("symbol", "created_at")], partition=orm.PARTITION_DAY)
+    again.bootstrap_db()
+    assert list(again.partitions(Quote)) == list(partitions)
+
+    archive = tmp_path / "archive.db"
+    dropped = ori.drop_partitions(Quote, before=t0 + datetime.timedelta(days=2), archive=str(archive))
+    assert dropped == ["quotes_p20210301", "quotes_p20210302"]
+    assert len(ori.partitions(Quote)) == 8
+    assert sum(len(batch) for batch in ori.stream(Quote)) == 16
+    assert ori.drop_partitions(Quote, before=t0) == []
+
+    archived = orm.engine(f"sqlite:///{archive}", echo=False)
+    with archived.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM quotes_p20210302")).scalar() == 2
+    archived.dispose()
+
+    # writing into a dropped day brings its partition back
+    ori.insert(Quote, quotes[0])
+    assert list(ori.partitions(Quote))[0] == orm._partition_start(orm.PARTITION_DAY, t0)
+
+    again.dispose()
+    ori.dispose()
+
+
+def test_partitioned_json_storage():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        table = ori.add_table(Quote, partition=orm.PARTITION_WEEK)
+        ori.bootstrap_db()
+        assert "created_at" in table.c
+
+        t0 = datetime.datetime(2021, 3, 1, tzinfo=datetime.timezone.utc)
+        quotes = [Quote(symbol="IBM", price=1.0, created_at=t0 + datetime.timedelta(days=d)) for d in range(0, 21, 3)]
+        ori.insert(Quote, *quotes)
+        names = [t.name for t in ori.partitions(Quote).values()]
+        assert names == ["quotes_p20210301", "quotes_p20210308", "quotes_p20210315"]
+
+        week2 = [q for b in ori.query(Quote, between={"created_at": (t0 + datetime.timedelta(days=7), None)}) for q in b]
+        assert {q.table_id for q in week2} == {q.table_id for q in quotes[3:]}
+
+
+def test_concurrent_partition_creation(tmp_path):
+    ori = ORM(db_uri=f"sqlite:///{tmp_path / 'events.db'}", echo=False)
+    ori.add_table(Quote, partition=orm.PARTITION_DAY)
+    ori.bootstrap_db()
+
+    t0 = datetime.datetime(2021, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    start = threading.Barrier(4)
+    errors = []
+
+    def insert(n):
+        start.wait()
+        try:
+            # every thread needs the same new partitions at once
+            for day in range(5):
+                ori.insert(Quote, Quote(symbol=f"S{n}", price=1.0, created_at=t0 + datetime.timedelta(days=day)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=insert, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(ori.partitions(Quote)) == 5
+    assert sum(len(batch) for batch in ori.stream(Quote)) == 20
+    ori.dispose()
+
+
+def test_partition_needs_timestamp():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        with pytest.raises(AssertionError):
+            ori.add_table(ImmutableNumber, partition=orm.PARTITION_DAY)
+        with pytest.raises(AssertionError):
+            ori.add_table(Quote, partition="hourly")
+
+
+@pytest.mark.parametrize("partition", [None, orm.PARTITION_DAY])
+def test_on_conflict(partition):
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng, dedup_size=100)
+        ori.add_table(Quote, storage=orm.STORAGE_COLUMNAR, partition=partition)
+        ori.bootstrap_db()
+
+        quotes = [Quote(symbol="IBM", price=float(i)) for i in range(10)]
+        assert ori.insert(Quote, *quotes[:4]) == orm.InsertReport(inserted=4, skipped=0)
+
+        with pytest.raises(IntegrityError):
+            ori.insert(Quote, *quotes)
+
+        # the seen-set catches the known ids before they get to SQL
+        report = ori.insert(Quote, *quotes[:6], on_conflict=orm.ON_CONFLICT_IGNORE)
+        assert report == orm.InsertReport(inserted=2, skipped=4, filtered=4)
+
+        # ...and SQL catches the rest
+        ori.seen.clear()
+        report = ori.insert(Quote, *quotes, on_conflict=orm.ON_CONFLICT_IGNORE)
+        assert report == orm.InsertReport(inserted=4, skipped=6, filtered=0)
+
+        changed = Quote(symbol="IBM", price=-1.0, table_id=quotes[0].table_id)
+        assert ori.insert(Quote, changed, on_conflict=orm.ON_CONFLICT_REPLACE).inserted == 1
+        assert ori.retrieve(Quote, quotes[0].table_id)[quotes[0].table_id].price == -1.0
+        assert sum(len(b) for b in ori.stream(Quote)) == 10
+
+        with pytest.raises(AssertionError):
+            ori.insert(Quote, quotes[0], on_conflict="merge")
+
+
+def test_insert_many_replay():
+    with inmem_db_context() as eng:
+        ori = ORM(eng=eng)
+        ori.add_table(ImmutableNumber, Column("num", Integer))
+        ori.bootstrap_db()
+
+        numbers = [ImmutableNumber(num=i) for i in range(10)]
+        ori.insert(ImmutableNumber, *numbers[:5])
+
+        reports = []
+        total = ori.insert_many(
+            ImmutableNumber, iter(numbers), chunk_size=4, progress=reports.append, on_conflict=orm.ON_CONFLICT_IGNORE
+        )
+        assert total == 5
+        assert [(r.inserted, r.duplicates) for r in reports] == [(0, 4), (3, 1), (2, 0)]
@@ -1,12 +1,21 @@
 import alpaca_trade_api
 
+from datetime import datetime, timedelta, timezone
+import gc
+import time
 import uuid
+import weakref
 
-
+import pytest
+import requests
 from unittest.mock import patch, Mock, MagicMock
 
 from llama.trader import TradeExecutor, Broker
 from llama.alpaca_entity import AlpacaError, AlpacaEntity
+from llama.market_clock import MarketClock
+from llama.rate_limit import TokenBucket
+from llama.rest_pool import RestPool
+from tests.alpaca_stub import AlpacaStub
 
 
 def mock_init():
@@ -15,7 +24,7 @@ def mock_init():
         patched_REST.return_value = mocked_api
 
         broker = Broker("a", "b", "c", "d", "e", False)
-        teena = TradeExecutor(broker)
+        teena = TradeExecutor(broker, pool=RestPool())
     return mocked_api, patched_REST, broker, teena
 
 
@@ -125,3 +134,233 @@ def test_market_clock():
     mocked_api.get_clock.assert_called_once_with()
 
     assert clock == AlpacaEntity(mocked_clock).as_dict()
+
+
+def test_shared_market_clock():
+    with AlpacaStub() as stub:
+        now = datetime.now(timezone.utc)
+        stub.clock = {
+            "timestamp": now.isoformat(),
+            "is_open": True,
+            "next_open": (now + timedelta(days=1)).isoformat(),
+            "next_close": (now + timedelta(hours=1)).isoformat(),
+        }
+        teena, tina = TradeExecutor(stub.broker()), TradeExecutor(stub.broker())
+        assert teena.clock is tina.clock
+
+        for executor in (teena, tina) * 5:
+            is_open, window = executor.market_open_and_toggle_delta()
+            assert is_open
+            assert timedelta(minutes=59) < window <= timedelta(hours=1)
+        assert stub.count("GET", "/v2/clock") == 1
+        assert teena.clock.stats()["hits"] == 9
+
+        teena.clock.invalidate()
+        tina.market_open_and_toggle_delta()
+        assert stub.count("GET", "/v2/clock") == 2
+
+        # other settings get a clock of their own
+        class Daily(TradeExecutor):
+            clock_ttl = 86_400.0
+
+        daily = Daily(stub.broker())
+        assert daily.clock is not teena.clock
+        assert daily.clock.ttl == timedelta(days=1)
+
+        # the shared clock doesn't keep the executor that made it alive
+        clock, ref = daily.clock, weakref.ref(daily)
+        del daily
+        gc.collect()
+        assert ref() is None
+        assert Daily(stub.broker()).market_open_and_toggle_delta()[0]
+        assert clock.stats()["fetches"] == 1
+
+        # executors on another pool get their own clock, which keeps working after the pool is closed
+        pool = RestPool()
+        other = TradeExecutor(stub.broker(), pool=pool)
+        assert other.clock is not teena.clock
+        pool.close()
+        other.clock.invalidate()
+        assert other.market_open_and_toggle_delta()[0]
+
+
+def test_market_clock_refresh():
+    t0 = datetime(2021, 3, 1, 15, tzinfo=timezone.utc)
+    now = [t0]
+    clocks = [
+        {"is_open": True, "next_open": t0 + timedelta(hours=19), "next_close": t0 + timedelta(hours=6)},
+        {"is_open": False, "next_open": t0 + timedelta(hours=19), "next_close": t0 + timedelta(hours=25)},
+    ]
+    fetched = []
+
+    def fetch():
+        fetched.append(now[0])
+        return clocks[0] if now[0] < clocks[0]["next_close"] else clocks[1]
+
+    clock = MarketClock(fetch, ttl=3_600, now=lambda: now[0])
+    assert clock.open_and_toggle_delta() == (True, timedelta(hours=6))
+    now[0] = t0 + timedelta(minutes=30)
+    assert clock.is_open()
+    assert len(fetched) == 1
+
+    # the TTL ran out
+    now[0] = t0 + timedelta(hours=1)
+    assert clock.is_open()
+    assert len(fetched) == 2
+
+    # the close passed: fetched again even though the TTL hasn't run out
+    now[0] = t0 + timedelta(hours=6)
+    assert clock.open_and_toggle_delta() == (False, timedelta(hours=13))
+    assert len(fetched) == 3
+    assert clock.clock() == clocks[1]
+
+
+def test_market_clock_calendar():
+    with AlpacaStub() as stub:
+        teena = TradeExecutor(stub.broker("calendar"))
+        now = [datetime(2021, 3, 1, 14, 0, tzinfo=timezone.utc)]  # 9am in New York
+        clock = MarketClock(teena.market_clock, teena._calendar, ttl=86_400, now=lambda: now[0])
+
+        assert clock.state() == (False, datetime(2021, 3, 1, 14, 30, tzinfo=timezone.utc))
+        now[0] = datetime(2021, 3, 1, 15, 0, tzinfo=timezone.utc)
+        assert clock.state() == (True, datetime(2021, 3, 1, 21, 0, tzinfo=timezone.utc))
+        now[0] = datetime(2021, 3, 2, 1, 0, tzinfo=timezone.utc)
+        assert clock.state() == (False, datetime(2021, 3, 2, 14, 30, tzinfo=timezone.utc))
+        # open and close both passed without going back to the API
+        assert stub.count("GET", "/v2/clock") == 1
+        assert stub.count("GET", "/v2/calendar") == 1
+
+        # past the last session in the calendar
+        now[0] = datetime(2021, 3, 2, 22, 0, tzinfo=timezone.utc)
+        clock.state()
+        assert stub.count("GET", "/v2/calendar") == 2
+
+
+def test_shared_rest_clients():
+    with AlpacaStub(latency=0.01) as stub:
+        pool = RestPool(pool_size=4, warm_up=2)
+        teena = TradeExecutor(stub.broker(), pool=pool)
+        tina = TradeExecutor(stub.broker(), pool=pool)
+        other = TradeExecutor(stub.broker("other"), pool=RestPool())
+        assert teena.api is tina.api
+        assert other.api is not teena.api
+        # the rate limit is the account's, whichever executor uses it
+        assert teena.limiter is tina.limiter
+        assert other.limiter is not teena.limiter
+        with pytest.raises(AssertionError):
+            pool.limiter(stub.broker(), teena.requests_per_minute + 1)
+        assert stub.count("HEAD", "/") == 2
+
+        for executor in (teena, tina) * 5:
+            executor.order("buy", "IBM", 1)
+        stats = pool.stats(stub.broker())
+        assert stats["requests"] == 12
+        assert stats["errors"] == 0
+        # the warmed up connections get reused rather than each executor opening its own
+        assert stats["connections"] == 2
+        assert stats["reused"] == 10
+        assert 0.01 <= stats["p50"] <= stats["p99"] <= stats["max"]
+        assert teena.api._session.timeout == (3.05, 10.0)
+
+        pool.close()
+        assert TradeExecutor(stub.broker(), pool=pool).api is not teena.api
+
+
+def test_rest_pool_closes_replaced_session():
+    with AlpacaStub() as stub:
+        pool = RestPool()
+        with patch.object(requests.Session, "close", autospec=True) as close:
+            client = pool.client(stub.broker())
+        # the session REST() made, not the pool's own
+        assert close.call_count == 1
+        assert close.call_args.args[0] is not client._session
+        pool.close()
+
+
+def test_order_batch():
+    with AlpacaStub(latency=0.02) as stub:
+        teena = TradeExecutor(stub.broker())
+        teena.limiter = TokenBucket(rate=1_000, capacity=100)
+        basket = [{"side": "buy", "symbol": f"S{i:03d}", "qty": i + 1} for i in range(40)]
+        basket[7] = {"side": "buy", "symbol": "REJECT", "qty": 1}
+        basket[3] = {"side": "buy", "symbol": "TIMEOUT", "qty": 1}
+        submit = teena.api.submit_order
+
+        def flaky(**order):
+            if order["symbol"] == "TIMEOUT":
+                raise requests.ConnectionError("connection reset")
+            return submit(**order)
+
+        start = time.monotonic()
+        with patch.object(teena.api, "submit_order", flaky):
+            results = teena.order_batch(basket, max_workers=8)
+        elapsed = time.monotonic() - start
+
+        # submitted concurrently: well under the 40 * 20ms it takes one by one
+        assert elapsed < 40 * 0.02
+        assert stub.max_in_flight > 1
+
+        assert [r["order"]["symbol"] for r in results] == [o["symbol"] for o in basket]
+        rejected = results[7]
+        assert rejected["external_order_id"] is None
+        assert rejected["api_error"]["code"] == 40310000
+        assert rejected["api_error"]["status_code"] == 403
+
+        # didn't stop the rest of the batch
+        assert results[3]["external_order_id"] is None
+        assert "connection reset" in results[3]["error"]
+
+        accepted = [r for i, r in enumerate(results) if i not in (3, 7)]
+        assert all(set(r) == {"external_order_id", "order", "response"} for r in accepted)
+        assert {str(r["external_order_id"]) for r in accepted} == {o["id"] for o in stub.orders}
+        assert all(r["response"]["client_order_id"] == r["order"]["client_order_id"] for r in accepted)
+
+
+def test_placed():
+    with AlpacaStub() as stub:
+        teena = TradeExecutor(stub.broker())
+        bundle = teena.order("buy", "IBM", 3)
+        placed = dict(side="buy", symbol="IBM", qty=3, client_order_id=bundle["order"]["client_order_id"])
+        never = dict(side="buy", symbol="IBM", qty=3, client_order_id=str(uuid.uuid4()))
+
+        found, missing = teena.placed([placed, never])
+        assert missing is None
+        assert found["external_order_id"] == bundle["external_order_id"]
+        assert found["order"] == bundle["order"]
+
+        # resending what the broker already has only gets a 422
+        again = teena.order_batch([placed])[0]
+        assert again["external_order_id"] is None
+        assert again["api_error"]["status_code"] == 422
+        assert len(stub.orders) == 1
+
+
+def test_order_batch_priority_and_rate_limit():
+    with AlpacaStub() as stub:
+        teena = TradeExecutor(stub.broker())
+        teena.limiter = TokenBucket(rate=50, capacity=2)
+        orders = [{"side": "buy", "symbol": f"B{i}", "qty": 1} for i in range(6)]
+        orders += [{"side": "sell", "symbol": f"S{i}", "qty": 1, "priority": -1} for i in range(4)]
+
+        start = time.monotonic()
+        results = teena.order_batch(orders, max_workers=1)
+        elapsed = time.monotonic() - start
+
+        # the sells jump the queue
+        assert [o["side"] for o in stub.orders] == ["sell"] * 4 + ["buy"] * 6
+        assert [r["order"]["side"] for r in results] == ["buy"] * 6 + ["sell"] * 4
+        # 2 right away, then 50 a second
+        assert elapsed >= 8 / 50 * 0.9
+        assert teena.order_batch([]) == []
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=3)
+    assert all(bucket.try_acquire() for _ in range(3))
+    assert not bucket.try_acquire()
+    assert not bucket.acquire(timeout=0.001)
+    assert bucket.acquire(timeout=1)
+
+    per_minute = TokenBucket.per_minute(200)
+    assert per_minute.rate == 200 / 60
+    assert per_minute.capacity == 20
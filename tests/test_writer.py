@@ -0,0 +1,145 @@
+import threading
+import queue
+
+import pytest
+from sqlalchemy import Column, Integer, text
+
+from llama.base import LlamaBase
+from llama.event_handler import EventHandler
+import llama.orm as orm
+from llama.orm import ORM
+from llama.writer import WriteBehindWriter
+
+
+class Number(LlamaBase):
+    pass
+
+
+@pytest.fixture
+def file_orm(tmp_path):
+    eng = orm.engine(db_uri=f"sqlite+pysqlite:///{tmp_path / 'writer.sqlite'}", echo=False)
+    ori = ORM(eng=eng)
+    ori.add_table(Number, Column("num", Integer))
+    ori.add_table(EventHandler)
+    ori.bootstrap_db()
+    yield ori
+    eng.dispose()
+
+
+def count(ori: ORM, table: str) -> int:
+    with ori.engine.connect() as conn:
+        return conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+
+
+def test_group_commit(file_orm):
+    with WriteBehindWriter(file_orm, max_batch=50, max_latency=10) as writer:
+        for i in range(120):
+            writer.enqueue(Number(num=i))
+        writer.enqueue(EventHandler())
+        assert writer.flush(timeout=10)
+
+        assert count(file_orm, "number") == 120
+        assert count(file_orm, "events") == 1
+
+        metrics = writer.metrics()
+        assert metrics["committed"] == 121
+        assert metrics["commits"] <= 4
+        assert metrics["queue_depth"] == 0
+        assert metrics["commit_latency_max"] >= metrics["commit_latency_avg"] > 0
+
+    with pytest.raises(AssertionError):
+        writer.enqueue(Number(num=1))
+
+
+def test_close_drains(file_orm):
+    writer = WriteBehindWriter(file_orm, max_batch=10_000, max_latency=10)
+    for i in range(30):
+        writer.enqueue(Number(num=i))
+    writer.close()
+    assert count(file_orm, "number") == 30
+
+
+def test_backpressure(file_orm):
+    release = threading.Event()
+    writer = WriteBehindWriter(file_orm, max_batch=1, max_latency=0, max_queue=2)
+    original = writer._commit
+    writer._commit = lambda batch: (release.wait(), original(batch))
+
+    writer.enqueue(Number(num=0))  # the writer thread takes this one and blocks on it
+    writer.enqueue(Number(num=1))
+    writer.enqueue(Number(num=2))
+    with pytest.raises(queue.Full):
+        writer.enqueue(Number(num=3), timeout=0.05)
+
+    # the queue is full, but flush still gives up on time
+    assert not writer.flush(timeout=0.05)
+
+    release.set()
+    assert writer.flush(timeout=10)
+    writer.close()
+    assert count(file_orm, "number") == 3
+
+
+def test_failed_commit(file_orm):
+    errors = []
+    with WriteBehindWriter(file_orm, on_error=lambda e, batch: errors.append((e, len(batch)))) as writer:
+        n = Number(num=1)
+        writer.enqueue(n)
+        writer.flush(timeout=10)
+        writer.enqueue(n)
+        writer.flush(timeout=10)
+
+        assert writer.failed == 1
+        assert len(errors) == 1
+        assert writer.last_error is errors[0][0]
+    assert count(file_orm, "number") == 1
+
+
+def test_on_error_raising(file_orm):
+    def on_error(e, batch):
+        raise RuntimeError("broken callback")
+
+    with WriteBehindWriter(file_orm, on_error=on_error) as writer:
+        n = Number(num=1)
+        writer.enqueue(n)
+        writer.enqueue(n)
+        writer.flush(timeout=10)
+        assert writer.failed == 2
+        # the writer thread lived through it
+        writer.enqueue(Number(num=2))
+        assert writer.flush(timeout=10)
+    assert count(file_orm, "number") == 1
+
+
+def test_close_races_enqueue(file_orm):
+    writer = WriteBehindWriter(file_orm, max_batch=7, max_latency=0.001)
+    accepted = []
+
+    def produce():
+        for i in range(200):
+            try:
+                writer.enqueue(Number(num=i))
+            except AssertionError:
+                return
+            accepted.append(i)
+
+    producers = [threading.Thread(target=produce) for _ in range(4)]
+    for p in producers:
+        p.start()
+    writer.close()
+    for p in producers:
+        p.join()
+    # everything enqueue() took got committed, and flush has nothing left to wait for
+    assert count(file_orm, "number") == len(accepted)
+    assert writer.flush(timeout=1)
+
+
+def test_writer_ignores_replays(file_orm):
+    numbers = [Number(num=i) for i in range(5)]
+    file_orm.insert(Number, *numbers[:2])
+    with WriteBehindWriter(file_orm, on_conflict=orm.ON_CONFLICT_IGNORE) as writer:
+        for n in numbers:
+            writer.enqueue(n)
+        assert writer.flush(timeout=10)
+        assert writer.metrics()["failed"] == 0
+    assert count(file_orm, "number") == 5